@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from core.gaps import LEVEL_FIELDS, round_level
 from core.models import (
     AdministrativeBoundary, Crop, YieldData, 
     Variety, Scenario, YieldStatistics, GapType, GapStatistics
@@ -21,6 +22,13 @@ class YieldDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = YieldData
         fields = '__all__'
+    
+    def to_representation(self, instance):
+        # Yield levels are stored unrounded
+        data = super().to_representation(instance)
+        for field in LEVEL_FIELDS:
+            data[field] = round_level(data[field])
+        return data
 
 
 class VarietySerializer(serializers.ModelSerializer):
@@ -1,3 +1,41 @@
+from django.core.cache import cache
 from django.test import TestCase
+from core.models import DatasetVersion, Variety, YieldStatistics
 
-# Create your tests here.
+
+class CachedActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        YieldStatistics.objects.create(province='NORTH', year=2020, count=1, mean=2.0)
+
+    def test_cached_until_statistics_bump(self):
+        self.assertEqual(self.client.get('/api/yield-statistics/provinces/').json(), ['NORTH'])
+        YieldStatistics.objects.create(province='SOUTH', year=2020, count=1, mean=1.0)
+        self.assertEqual(self.client.get('/api/yield-statistics/provinces/').json(), ['NORTH'])
+        DatasetVersion.bump('statistics')
+        self.assertEqual(self.client.get('/api/yield-statistics/provinces/').json(), ['NORTH', 'SOUTH'])
+
+
+class ConditionalGetMixinTests(TestCase):
+    def test_viewset_etag_per_accept_header(self):
+        YieldStatistics.objects.create(province='NORTH', year=2020, count=1, mean=2.0)
+        response = self.client.get('/api/yield-statistics/', HTTP_ACCEPT='application/json')
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/yield-statistics/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/yield-statistics/', HTTP_ACCEPT='*/*', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        DatasetVersion.bump('statistics')
+        response = self.client.get('/api/yield-statistics/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_varieties_revalidate_after_parcel_load(self):
+        response = self.client.get('/api/varieties/')
+        etag = response['ETag']
+        Variety.ids_for(['Achtar'])
+        DatasetVersion.bump('parcels')
+        response = self.client.get('/api/varieties/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([variety['name'] for variety in response.json()['results']], ['Achtar'])
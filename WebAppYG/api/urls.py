@@ -1,6 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from core.views import api_crops, api_years, api_boundaries, api_yield_data, export_csv, api_parcel_points
+from core.views import (
+    api_crops, api_years, api_boundaries, api_boundary_geometry, api_yield_data,
+    api_yield_stats, export_data, api_parcel_points, api_parcel_clusters, api_aggregate,
+    api_facets, api_timeseries, api_compare_farm, api_tiles
+)
 from .views import (
     VarietyViewSet, ScenarioViewSet, YieldStatisticsViewSet,
     GapTypeViewSet, GapStatisticsViewSet
@@ -19,9 +23,19 @@ urlpatterns = [
     path('crops/', api_crops, name='api_crops'),
     path('years/', api_years, name='api_years'),
     path('boundaries/', api_boundaries, name='api_boundaries'),
+    path('boundary-geometry/', api_boundary_geometry, name='api_boundary_geometry'),
     path('yield-data/', api_yield_data, name='api_yield_data'),
+    path('yield-data/stats/', api_yield_stats, name='api_yield_stats'),
     path('parcel-points/', api_parcel_points, name='api_parcel_points'),
-    path('export-csv/', export_csv, name='export_csv'),
+    path('parcel-points/clusters/', api_parcel_clusters, name='api_parcel_clusters'),
+    path('export-csv/', export_data, name='export_csv'),
+    path('export-csv/<str:dataset>/', export_data, name='export_csv_dataset'),
+    path('export/<str:dataset>/', export_data, name='export_data'),
+    path('aggregate/', api_aggregate, name='api_aggregate'),
+    path('facets/', api_facets, name='api_facets'),
+    path('timeseries/', api_timeseries, name='api_timeseries'),
+    path('compare-farm/', api_compare_farm, name='api_compare_farm'),
+    path('tiles/<str:layer>/<int:z>/<int:x>/<int:y>.pbf', api_tiles, name='api_tiles'),
     
     # New REST API endpoints
     path('', include(router.urls)),
@@ -3,6 +3,8 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.http import JsonResponse
 from django_filters.rest_framework import DjangoFilterBackend
+from core.cache import cached_action, ConditionalGetMixin
+from core.cube import cube_summary
 from core.models import (
     AdministrativeBoundary, Crop, YieldData,
     Variety, Scenario, YieldStatistics, GapType, GapStatistics
@@ -13,15 +15,18 @@ from .serializers import (
     GapTypeSerializer, GapStatisticsSerializer
 )
 
-class AdministrativeBoundaryViewSet(viewsets.ReadOnlyModelViewSet):
+class AdministrativeBoundaryViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_datasets = ('boundaries',)
     queryset = AdministrativeBoundary.objects.all()
     serializer_class = AdministrativeBoundarySerializer
 
-class CropViewSet(viewsets.ReadOnlyModelViewSet):
+class CropViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_datasets = ('yield',)
     queryset = Crop.objects.all()
     serializer_class = CropSerializer
 
-class YieldDataViewSet(viewsets.ReadOnlyModelViewSet):
+class YieldDataViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_datasets = ('boundaries', 'yield')
     queryset = YieldData.objects.all()
     serializer_class = YieldDataSerializer
     
@@ -43,20 +48,23 @@ class YieldDataViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class VarietyViewSet(viewsets.ReadOnlyModelViewSet):
+class VarietyViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for wheat varieties"""
+    etag_datasets = ('statistics', 'parcels')  # Parcel loaders create varieties too
     queryset = Variety.objects.all()
     serializer_class = VarietySerializer
 
 
-class ScenarioViewSet(viewsets.ReadOnlyModelViewSet):
+class ScenarioViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for yield scenarios"""
+    etag_datasets = ('statistics',)
     queryset = Scenario.objects.all()
     serializer_class = ScenarioSerializer
 
 
-class YieldStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
+class YieldStatisticsViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for yield statistics with filtering"""
+    etag_datasets = ('statistics',)
     queryset = YieldStatistics.objects.all().select_related('variety', 'scenario')
     serializer_class = YieldStatisticsSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -90,6 +98,7 @@ class YieldStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @cached_action('statistics')
     def provinces(self, request):
         """Get list of unique provinces"""
         provinces = YieldStatistics.objects.exclude(
@@ -98,6 +107,7 @@ class YieldStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(list(provinces))
     
     @action(detail=False, methods=['get'])
+    @cached_action('statistics')
     def years(self, request):
         """Get list of unique years"""
         years = YieldStatistics.objects.exclude(
@@ -106,45 +116,25 @@ class YieldStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(list(years))
     
     @action(detail=False, methods=['get'])
+    @cached_action('statistics')
     def summary(self, request):
-        """Get summary statistics"""
-        variety_id = request.query_params.get('variety')
-        province = request.query_params.get('province')
-        year = request.query_params.get('year')
-        
-        queryset = self.get_queryset()
-        
-        if variety_id:
-            queryset = queryset.filter(variety_id=variety_id)
-        if province:
-            queryset = queryset.filter(province=province)
-        if year:
-            queryset = queryset.filter(year=year)
-        
-        # Group by scenario and calculate averages
-        summary = {}
-        for stat in queryset:
-            scenario_name = stat.scenario.name if stat.scenario else 'Overall'
-            if scenario_name not in summary:
-                summary[scenario_name] = {
-                    'mean': stat.mean,
-                    'min': stat.min,
-                    'max': stat.max,
-                    'median': stat.median,
-                    'count': stat.count
-                }
-        
-        return Response(summary)
+        """
+        Pooled statistics per scenario for the optional variety (id), province
+        and year filters, read from the statistics cube in one lookup
+        """
+        return Response(cube_summary('yield', request.query_params))
 
 
-class GapTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class GapTypeViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for gap types"""
+    etag_datasets = ('statistics',)
     queryset = GapType.objects.all()
     serializer_class = GapTypeSerializer
 
 
-class GapStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
+class GapStatisticsViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """API endpoint for gap statistics with filtering"""
+    etag_datasets = ('statistics',)
     queryset = GapStatistics.objects.all().select_related('gap_type', 'variety')
     serializer_class = GapStatisticsSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -178,6 +168,7 @@ class GapStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @cached_action('statistics')
     def provinces(self, request):
         """Get list of unique provinces"""
         provinces = GapStatistics.objects.exclude(
@@ -186,6 +177,7 @@ class GapStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(list(provinces))
     
     @action(detail=False, methods=['get'])
+    @cached_action('statistics')
     def years(self, request):
         """Get list of unique years"""
         years = GapStatistics.objects.exclude(
@@ -194,35 +186,13 @@ class GapStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(list(years))
     
     @action(detail=False, methods=['get'])
+    @cached_action('statistics')
     def summary(self, request):
-        """Get summary statistics"""
-        variety_id = request.query_params.get('variety')
-        province = request.query_params.get('province')
-        year = request.query_params.get('year')
-        
-        queryset = self.get_queryset()
-        
-        if variety_id:
-            queryset = queryset.filter(variety_id=variety_id)
-        if province:
-            queryset = queryset.filter(province=province)
-        if year:
-            queryset = queryset.filter(year=year)
-        
-        # Group by gap type and calculate averages
-        summary = {}
-        for stat in queryset:
-            gap_type_name = stat.gap_type.name if stat.gap_type else 'Overall'
-            if gap_type_name not in summary:
-                summary[gap_type_name] = {
-                    'mean': stat.mean,
-                    'min': stat.min,
-                    'max': stat.max,
-                    'median': stat.median,
-                    'count': stat.count
-                }
-        
-        return Response(summary)
+        """
+        Pooled statistics per gap type for the optional variety (id), province
+        and year filters, read from the statistics cube in one lookup
+        """
+        return Response(cube_summary('gap', request.query_params))
 
 
 def yield_data_api(request):
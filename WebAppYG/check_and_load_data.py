@@ -51,7 +51,7 @@ def verify_files_exist():
     return all_exist
 
 def check_and_load_data():
-    """Check if data exists, if not, load it"""
+    """Load any source data that changed since the last run"""
     print("\n" + "=" * 60)
     print("Checking if data is loaded...")
     print("=" * 60)
@@ -72,92 +72,123 @@ def check_and_load_data():
         boundary_count = 0
         yield_count = 0
     
-    if boundary_count == 0 or yield_count == 0:
+    # Every loader checks its source files against the manifest and skips
+    # the load when nothing changed, so this is cheap on a normal restart.
+    # Empty tables mean the manifest can't be trusted, so reload everything.
+    force = boundary_count == 0 or yield_count == 0
+    if force:
         print("\n⚠️  Data missing! Loading data now...")
-        print("=" * 60)
-        
-        base_dir = Path(settings.BASE_DIR)
-        success_count = 0
-        fail_count = 0
-        
-        # 1. Load Morocco
-        print("\n[1/4] Loading Morocco shapefile...")
-        morocco_path = base_dir / 'data' / 'Shapefiles' / 'Morocco' / 'Morocco.shp'
-        try:
-            if morocco_path.exists():
-                call_command('load_shapefiles', shapefile=str(morocco_path), verbosity=2)
-                print("   ✓ Morocco loaded successfully")
-                success_count += 1
-            else:
-                print(f"   ✗ File not found: {morocco_path}")
-                fail_count += 1
-        except Exception as e:
-            print(f"   ✗ Morocco failed: {e}")
-            import traceback
-            traceback.print_exc()
-            fail_count += 1
-        
-        # 2. Load Provinces
-        print("\n[2/4] Loading Provinces shapefile...")
-        provinces_path = base_dir / 'data' / 'Shapefiles' / 'Concerned_Provinces.shp'
-        try:
-            if provinces_path.exists():
-                call_command('load_shapefiles', shapefile=str(provinces_path), verbosity=2)
-                print("   ✓ Provinces loaded successfully")
-                success_count += 1
-            else:
-                print(f"   ✗ File not found: {provinces_path}")
-                fail_count += 1
-        except Exception as e:
-            print(f"   ✗ Provinces failed: {e}")
-            import traceback
-            traceback.print_exc()
+    else:
+        print("\nRunning loaders (unchanged inputs are skipped)...")
+    print("=" * 60)
+    
+    base_dir = Path(settings.BASE_DIR)
+    success_count = 0
+    fail_count = 0
+    
+    # 1. Load Morocco
+    print("\n[1/4] Loading Morocco shapefile...")
+    morocco_path = base_dir / 'data' / 'Shapefiles' / 'Morocco' / 'Morocco.shp'
+    try:
+        if morocco_path.exists():
+            call_command('load_shapefiles', shapefile=str(morocco_path), force=force, skip_payloads=True, verbosity=2)
+            print("   ✓ Morocco loaded successfully")
+            success_count += 1
+        else:
+            print(f"   ✗ File not found: {morocco_path}")
             fail_count += 1
-        
-        # 3. Load Varieties
-        print("\n[3/4] Loading Variety shapefiles...")
-        try:
-            call_command('load_variety_shapefiles', verbosity=2)
-            print("   ✓ Varieties loaded successfully")
+    except Exception as e:
+        print(f"   ✗ Morocco failed: {e}")
+        import traceback
+        traceback.print_exc()
+        fail_count += 1
+    
+    # 2. Load Provinces
+    print("\n[2/4] Loading Provinces shapefile...")
+    provinces_path = base_dir / 'data' / 'Shapefiles' / 'Concerned_Provinces.shp'
+    try:
+        if provinces_path.exists():
+            call_command('load_shapefiles', shapefile=str(provinces_path), force=force, skip_payloads=True, verbosity=2)
+            print("   ✓ Provinces loaded successfully")
             success_count += 1
-        except Exception as e:
-            print(f"   ✗ Varieties failed: {e}")
-            import traceback
-            traceback.print_exc()
+        else:
+            print(f"   ✗ File not found: {provinces_path}")
             fail_count += 1
-        
-        # 4. Load Yield Data
-        print("\n[4/4] Loading Yield data...")
-        yield_file = base_dir / 'data' / 'Yield_Statistics_Complete_Analysis.xlsx'
-        try:
-            if yield_file.exists():
-                call_command('load_real_data', verbosity=2)
-                print("   ✓ Yield data loaded successfully")
-                success_count += 1
-            else:
-                print(f"   ✗ File not found: {yield_file}")
-                fail_count += 1
-        except Exception as e:
-            print(f"   ✗ Yield data failed: {e}")
-            import traceback
-            traceback.print_exc()
+    except Exception as e:
+        print(f"   ✗ Provinces failed: {e}")
+        import traceback
+        traceback.print_exc()
+        fail_count += 1
+    
+    # 3. Load Varieties
+    print("\n[3/4] Loading Variety shapefiles...")
+    try:
+        call_command('load_variety_shapefiles', force=force, skip_payloads=True, verbosity=2)
+        print("   ✓ Varieties loaded successfully")
+        success_count += 1
+    except Exception as e:
+        print(f"   ✗ Varieties failed: {e}")
+        import traceback
+        traceback.print_exc()
+        fail_count += 1
+    
+    # 4. Load Yield Data
+    print("\n[4/4] Loading Yield data...")
+    yield_file = base_dir / 'data' / 'Yield_Statistics_Complete_Analysis.xlsx'
+    try:
+        if yield_file.exists():
+            call_command('load_real_data', force=force, skip_payloads=True, verbosity=2)
+            print("   ✓ Yield data loaded successfully")
+            success_count += 1
+        else:
+            print(f"   ✗ File not found: {yield_file}")
             fail_count += 1
-        
-        # Final verification
-        print("\n" + "=" * 60)
-        print("Final verification...")
-        print("=" * 60)
-        try:
-            boundary_count = AdministrativeBoundary.objects.count()
-            yield_count = YieldData.objects.count()
-            print(f"✅ Final data: {boundary_count} boundaries, {yield_count} yield records")
-            print(f"✅ Successfully loaded: {success_count}/4")
-            if fail_count > 0:
-                print(f"⚠️  Failed: {fail_count}/4")
-        except Exception as e:
-            print(f"❌ Error verifying data: {e}")
-    else:
-        print("✅ Data already loaded!")
+    except Exception as e:
+        print(f"   ✗ Yield data failed: {e}")
+        import traceback
+        traceback.print_exc()
+        fail_count += 1
+    
+    # Summary cube of the yield and gap statistics
+    print("\nBuilding statistics cube...")
+    try:
+        call_command('build_statistics_cube', verbosity=2)
+    except Exception as e:
+        print(f"   ✗ Statistics cube failed: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    # Parcel clusters of a database that predates them, or after a failed build
+    print("\nBuilding parcel clusters...")
+    try:
+        call_command('build_parcel_clusters', verbosity=2)
+    except Exception as e:
+        print(f"   ✗ Parcel clusters failed: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    # Common API responses are precompressed once for whatever changed above
+    print("\nBuilding precompressed API responses...")
+    try:
+        call_command('build_payloads', verbosity=2)
+    except Exception as e:
+        print(f"   ✗ Precompressed responses failed: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    # Final verification
+    print("\n" + "=" * 60)
+    print("Final verification...")
+    print("=" * 60)
+    try:
+        boundary_count = AdministrativeBoundary.objects.count()
+        yield_count = YieldData.objects.count()
+        print(f"✅ Final data: {boundary_count} boundaries, {yield_count} yield records")
+        print(f"✅ Successfully loaded: {success_count}/4")
+        if fail_count > 0:
+            print(f"⚠️  Failed: {fail_count}/4")
+    except Exception as e:
+        print(f"❌ Error verifying data: {e}")
     
     print("=" * 60 + "\n")
 
@@ -1,12 +1,13 @@
 from django.contrib import admin
 from .models import (
     AdministrativeBoundary, Crop, YieldData, ParcelPoint,
-    Variety, Scenario, YieldStatistics, GapType, GapStatistics
+    Variety, Scenario, YieldStatistics, GapType, GapStatistics, DatasetVersion,
+    SourceManifest, CompressedPayload
 )
 
 @admin.register(AdministrativeBoundary)
 class AdministrativeBoundaryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'code', 'level', 'created_at']
+    list_display = ['name', 'code', 'level', 'area_km2', 'created_at']
     list_filter = ['level', 'created_at']
     search_fields = ['name', 'code']
     readonly_fields = ['created_at']
@@ -42,8 +43,10 @@ class YieldDataAdmin(admin.ModelAdmin):
 @admin.register(ParcelPoint)
 class ParcelPointAdmin(admin.ModelAdmin):
     list_display = ['parcel_id', 'province', 'variety', 'year', 'yield_per_ha', 'area']
-    list_filter = ['province', 'variety', 'year']
-    search_fields = ['parcel_id', 'province', 'variety']
+    list_filter = ['variety', 'year', 'boundary']
+    list_select_related = ['variety']
+    raw_id_fields = ['boundary']
+    search_fields = ['parcel_id', 'province', 'variety__name']
     readonly_fields = ['created_at']
 
 
@@ -84,4 +87,23 @@ class GapStatisticsAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at']
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('gap_type', 'variety')
\ No newline at end of file
+        return super().get_queryset(request).select_related('gap_type', 'variety')
+
+@admin.register(DatasetVersion)
+class DatasetVersionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'version', 'updated_at']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(SourceManifest)
+class SourceManifestAdmin(admin.ModelAdmin):
+    list_display = ['source', 'checksum', 'updated_at']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(CompressedPayload)
+class CompressedPayloadAdmin(admin.ModelAdmin):
+    list_display = ['key', 'content_type', 'created_at']
+    search_fields = ['key']
+    exclude = ['identity', 'gzip', 'brotli']
+    readonly_fields = ['created_at']
@@ -0,0 +1,171 @@
+"""
+Whitelisted group-by aggregation over the yield, statistics and parcel tables.
+
+/api/aggregate/ turns ?source=, ?group_by=, ?metrics= and ?functions=
+into a single values().annotate() query, so the database does the
+grouping in one round trip. Only the dimensions and metrics listed per
+source below can be referenced; anything else is a 400.
+
+/api/facets/ groups each source by all of its dimensions at once and
+derives every dimension's value counts from that one result.
+"""
+from collections import Counter
+from django.core.exceptions import BadRequest
+from django.db.models import Avg, Case, Count, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import Cast, Greatest, Sqrt
+from django.db.models.lookups import GreaterThan
+from .gaps import LEVEL_FIELDS, GAP_FIELDS
+from .models import GapStatistics, ParcelPoint, YieldData, YieldStatistics
+
+STATISTICS_MEASURES = ['count', 'mean', 'std', 'min', 'q25', 'median', 'q75', 'max']
+
+# source: (model, {dimension: lookup}, [metric fields], dataset versions it reads)
+SOURCES = {
+    'yield-data': (
+        YieldData,
+        {'province': 'boundary__name', 'year': 'year', 'crop': 'crop__name'},
+        LEVEL_FIELDS + GAP_FIELDS,
+        ('boundaries', 'yield'),
+    ),
+    'yield-statistics': (
+        YieldStatistics,
+        {'province': 'province', 'year': 'year', 'variety': 'variety__name', 'scenario': 'scenario__name'},
+        STATISTICS_MEASURES,
+        ('statistics',),
+    ),
+    'gap-statistics': (
+        GapStatistics,
+        {'province': 'province', 'year': 'year', 'variety': 'variety__name', 'gap_type': 'gap_type__name'},
+        STATISTICS_MEASURES,
+        ('statistics',),
+    ),
+    'parcels': (
+        ParcelPoint,
+        {'province': 'province', 'year': 'year', 'variety': 'variety__name'},
+        ['yield_per_ha', 'yield_total', 'area'],
+        ('parcels',),
+    ),
+}
+
+def _sample_std(field):
+    """
+    Sample standard deviation of field, NULL for groups with fewer than 2
+    values. Built from sums: SQLite's STDDEV_SAMP raises on a single value
+    however it is wrapped, since the aggregate is finalized for every group.
+    """
+    n = Count(field)
+    value = Cast(field, FloatField())  # Integer measures such as count would divide as integers
+    squares = Sum(value * value) - Sum(value) * Sum(value) / n
+    variance = Greatest(squares / (n - 1), Value(0.0))
+    return Case(When(GreaterThan(n, 1), then=Sqrt(variance)), default=None, output_field=FloatField())
+
+
+FUNCTIONS = {
+    'count': Count,
+    'sum': Sum,
+    'avg': Avg,
+    'min': Min,
+    'max': Max,
+    'std': _sample_std,
+}
+
+# Dimensions that are filtered as integers
+INTEGER_DIMENSIONS = {'year'}
+
+
+def list_param(params, name, default=()):
+    """?name=a,b and ?name=a&name=b both give ['a', 'b']"""
+    values = [part.strip() for value in params.getlist(name) for part in value.split(',')]
+    return [value for value in values if value] or list(default)
+
+
+def _whitelisted(values, allowed, name):
+    unknown = [value for value in values if value not in allowed]
+    if unknown:
+        raise BadRequest(f'{name} must be among {", ".join(allowed)} (got {", ".join(unknown)})')
+    return values
+
+
+def _dimension_filters(params, dimensions):
+    """{dimension: value} of the dimensions given as exact-match parameters"""
+    filters = {}
+    for dimension in dimensions:
+        value = params.get(dimension)
+        if not value:
+            continue
+        if dimension in INTEGER_DIMENSIONS:
+            try:
+                value = int(value)
+            except ValueError:
+                raise BadRequest(f'{dimension} must be an integer')
+        filters[dimension] = value
+    return filters
+
+
+def aggregate(params):
+    """
+    {'source', 'group_by', 'results'} for the query parameters: one row
+    per group with the group's dimension values, its row count ('rows')
+    and '<metric>_<function>' for every requested metric and function.
+    Dimensions may also be given as exact-match filters, e.g. ?year=2020.
+    """
+    source = params.get('source', 'yield-data')
+    if source not in SOURCES:
+        raise BadRequest(f'source must be one of {", ".join(SOURCES)}')
+    model, dimensions, metrics, _ = SOURCES[source]
+
+    group_by = _whitelisted(list_param(params, 'group_by'), dimensions, 'group_by')
+    metric_names = _whitelisted(list_param(params, 'metrics', metrics[:1]), metrics, 'metrics')
+    functions = _whitelisted(list_param(params, 'functions', ['avg']), FUNCTIONS, 'functions')
+
+    queryset = model.objects.all()
+    for dimension, value in _dimension_filters(params, dimensions).items():
+        queryset = queryset.filter(**{dimensions[dimension]: value})
+
+    annotations = {'rows': Count('pk')}
+    for metric in metric_names:
+        for function in functions:
+            annotations[f'{metric}_{function}'] = FUNCTIONS[function](metric)
+
+    lookups = [dimensions[dimension] for dimension in group_by]
+    if lookups:
+        rows = queryset.values(*lookups).annotate(**annotations).order_by(*lookups)
+    else:
+        rows = [queryset.aggregate(**annotations)]
+
+    # Report dimensions by their public name, not the ORM lookup
+    names = {dimensions[dimension]: dimension for dimension in group_by}
+    results = [{names.get(key, key): value for key, value in row.items()} for row in rows]
+    return {'source': source, 'group_by': group_by, 'results': results}
+
+
+def facets(params):
+    """
+    {'filters', 'facets'}: for every source, each dimension's values with
+    their row counts, in one GROUP BY query per source. Dimensions given
+    as parameters (e.g. ?year=2020) narrow the counts of the other
+    dimensions of the sources that have them; a dimension's own filter
+    is ignored for its counts so the alternatives stay visible.
+    """
+    all_dimensions = {dimension for _, dimensions, _, _ in SOURCES.values() for dimension in dimensions}
+    filters = _dimension_filters(params, sorted(all_dimensions))
+
+    result = {}
+    for source, (model, dimensions, _, _) in SOURCES.items():
+        names = list(dimensions)
+        lookups = [dimensions[dimension] for dimension in names]
+        counts = {dimension: Counter() for dimension in names}
+        groups = model.objects.values_list(*lookups).annotate(rows=Count('pk')).order_by()
+        for *values, rows in groups:
+            row = dict(zip(names, values))
+            mismatched = [dimension for dimension, value in filters.items() if dimension in row and row[dimension] != value]
+            if len(mismatched) > 1:
+                continue
+            for dimension in (mismatched or names):
+                if row[dimension] is not None:
+                    counts[dimension][row[dimension]] += rows
+        result[source] = {
+            dimension: [{'value': value, 'count': count} for value, count in sorted(counter.items())]
+            for dimension, counter in counts.items()
+        }
+    return {'filters': filters, 'facets': result}
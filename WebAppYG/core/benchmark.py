@@ -0,0 +1,85 @@
+"""
+"Compare My Farm": a farmer's yield ranked against the parcels of the
+same province, variety and year, and set against the modeled potential
+and water-limited yields of the province.
+
+The parcel yields of every (province, variety, year) are read once per
+'parcels' version into ascending lists, so a ranking is two bisections,
+O(log n), instead of a pass over the parcel table.
+"""
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from .gaps import round_level
+from .models import DatasetVersion, ParcelPoint, YieldData
+
+# Modeled yields the farm is compared to
+REFERENCE_FIELDS = ['potential_yield', 'water_limited_yield']
+
+
+def _key(province, variety, year):
+    # Names as typed by farmers rarely match the stored case
+    return (province or '').casefold(), (variety or '').casefold(), year
+
+
+@lru_cache(maxsize=2)
+def _percentile_index(version):
+    """{(province, variety, year): ascending parcel yields} for a parcels version"""
+    index = {}
+    rows = ParcelPoint.objects.filter(yield_per_ha__isnull=False).order_by('yield_per_ha').values_list(
+        'province', 'variety__name', 'year', 'yield_per_ha',
+    )
+    for province, variety, year, value in rows.iterator():
+        index.setdefault(_key(province, variety, year), []).append(value)
+    return index
+
+
+def percentile_index():
+    """The sorted parcel yields of the current 'parcels' version"""
+    return _percentile_index(DatasetVersion.current('parcels'))
+
+
+def percentile_rank(values, value):
+    """Percentile of value among ascending values, ties counted half"""
+    below = bisect_left(values, value)
+    at_or_below = bisect_right(values, value)
+    return 100.0 * (below + at_or_below) / 2 / len(values)
+
+
+def compare_farm(province, variety, year, value, crop=None):
+    """Ranking of value among the matching parcels and its gaps to the modeled yields"""
+    values = percentile_index().get(_key(province, variety, year), [])
+    ranking = {'parcels': len(values), 'percentile': None, 'min': None, 'median': None, 'max': None}
+    if values:
+        middle = len(values) // 2
+        median = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+        ranking.update({
+            'percentile': round(percentile_rank(values, value), 1),
+            'min': values[0],
+            'median': round(median, 2),
+            'max': values[-1],
+        })
+
+    queryset = YieldData.objects.filter(boundary__name__iexact=province, year=year)
+    if crop:
+        queryset = queryset.filter(crop__name=crop)
+    modeled = queryset.order_by('crop__name').values(*REFERENCE_FIELDS).first() or {}
+    references = {}
+    for field in REFERENCE_FIELDS:
+        reference = modeled.get(field)
+        if reference is None:
+            references[field] = None
+            continue
+        references[field] = {
+            'value': round_level(reference),
+            'gap': round(reference - value, 2),
+            'gap_percent': round(100 * (reference - value) / reference, 1) if reference else None,
+        }
+
+    return {
+        'province': province,
+        'variety': variety,
+        'year': year,
+        'yield': value,
+        'ranking': ranking,
+        'references': references,
+    }
@@ -0,0 +1,181 @@
+"""
+Server-side response cache and HTTP validators for the read-only API.
+
+Responses are cached under the endpoint path, the normalized query string
+and the current DatasetVersion of every dataset the endpoint reads. Loader
+commands bump those versions, so a reload makes every dependent key miss
+without having to find and delete old entries; they simply age out.
+
+The same key gives a strong ETag, and the datasets' updated_at gives
+Last-Modified, so If-None-Match / If-Modified-Since are answered with a
+304 after a single version lookup, before the view runs any query.
+
+On a cache miss cached_view first looks for a payload precompressed at
+load time (core.payloads) and serves the encoding the client accepts.
+"""
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+from .models import DatasetVersion
+from .payloads import Payload, load_payload
+
+KEY_PREFIX = 'api'
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def dataset_versions(request, datasets):
+    """
+    ([version per dataset], last update timestamp or None) in a single
+    query, remembered on the request so views and decorators share it.
+    """
+    http_request = getattr(request, '_request', request)  # DRF wraps the HttpRequest
+    memo = http_request.__dict__.setdefault('_dataset_versions', {})
+    if datasets not in memo:
+        stored = {
+            name: (version, updated_at)
+            for name, version, updated_at in DatasetVersion.objects.filter(
+                name__in=datasets
+            ).values_list('name', 'version', 'updated_at')
+        }
+        versions = [stored.get(name, (0, None))[0] for name in datasets]
+        updated = [stored[name][1] for name in datasets if name in stored]
+        memo[datasets] = (versions, int(max(updated).timestamp()) if updated else None)
+    return memo[datasets]
+
+
+def cache_key(request, datasets):
+    """
+    Key for a GET request: parameter order and empty parameters don't
+    matter, since the views treat ?crop= like a missing crop.
+    """
+    params = sorted(
+        (name, value)
+        for name, values in request.GET.lists()
+        for value in values if value != ''
+    )
+    query = hashlib.md5(urlencode(params).encode('utf-8')).hexdigest()
+    versions, _ = dataset_versions(request, datasets)
+    versions = '-'.join(f'{name}{version}' for name, version in zip(datasets, versions))
+    return f'{KEY_PREFIX}:{request.path}:{query}:{versions}'
+
+
+def _validators(request, datasets, variant=''):
+    key = f'{cache_key(request, datasets)}:{variant}'
+    etag = '"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+    _, last_modified = dataset_versions(request, datasets)
+    return etag, last_modified
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Let browsers keep the body but revalidate it on every use
+    if not response.has_header('Cache-Control'):
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def not_modified(request, datasets, variant=''):
+    """304 response if the client's copy is current, else None"""
+    etag, last_modified = _validators(request, datasets, variant)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None and response.status_code == 304:
+        _set_validators(response, etag, last_modified)
+    return response
+
+
+def add_validators(request, response, datasets, variant=''):
+    if response.status_code == 200:
+        _set_validators(response, *_validators(request, datasets, variant))
+    return response
+
+
+def conditional_view(*datasets):
+    """ETag / Last-Modified and 304s for a function view, without caching the body"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return view(request, *args, **kwargs)
+            response = not_modified(request, datasets)
+            if response is None:
+                response = add_validators(request, view(request, *args, **kwargs), datasets)
+            return response
+        return wrapped
+    return decorator
+
+
+def cached_view(*datasets):
+    """Conditional responses plus a server-side cache of successful GET responses"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return view(request, *args, **kwargs)
+            response = not_modified(request, datasets)
+            if response is not None:
+                return response
+            key = cache_key(request, datasets)
+            entry = cache.get(key)
+            if entry is None:
+                entry = load_payload(key)
+                if entry is None:
+                    entry = view(request, *args, **kwargs)
+                    if entry.status_code != 200 or entry.streaming:
+                        return entry
+                    add_validators(request, entry, datasets)
+                cache.set(key, entry)
+            if not isinstance(entry, Payload):
+                return entry
+            # Each encoding is a different representation: weak ETag
+            response = add_validators(request, entry.response(request), datasets)
+            if response.has_header('Content-Encoding'):
+                response['ETag'] = f'W/{response["ETag"]}'
+            return response
+        wrapped.datasets = datasets
+        return wrapped
+    return decorator
+
+
+def cached_action(*datasets):
+    """Cache the data of a successful DRF viewset action"""
+    def decorator(method):
+        @wraps(method)
+        def wrapped(self, request, *args, **kwargs):
+            key = cache_key(request, datasets)
+            data = cache.get(key)
+            if data is None:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                data = response.data
+                cache.set(key, data)
+            return Response(data)
+        return wrapped
+    return decorator
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified for every read action of a viewset, derived from
+    the versions of etag_datasets; matching requests get a 304 before the
+    handler (and its queries) runs. The Accept header is part of the ETag
+    since DRF renders the browsable API and JSON from the same URL.
+    """
+    etag_datasets = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS or not self.etag_datasets:
+            return super().dispatch(request, *args, **kwargs)
+        variant = request.META.get('HTTP_ACCEPT', '')
+        response = not_modified(request, self.etag_datasets, variant)
+        if response is not None:
+            return response
+        response = super().dispatch(request, *args, **kwargs)
+        return add_validators(request, response, self.etag_datasets, variant)
@@ -0,0 +1,89 @@
+"""
+Distribution statistics and choropleth class breaks, computed with NumPy.
+
+Breaks are returned as classes + 1 ascending boundaries from the minimum
+to the maximum value; class i holds the values in (breaks[i], breaks[i+1]]
+(the first class also holds the minimum).
+
+Jenks natural breaks use Fisher's exact dynamic program on the sorted
+values, which is O(classes * n^2); above JENKS_MAX_VALUES values it runs
+on that many evenly spaced quantiles instead.
+"""
+import numpy as np
+
+DEFAULT_CLASSES = 8  # One per color step of the map's scales
+MAX_CLASSES = 12
+JENKS_MAX_VALUES = 1000
+DECIMALS = 4
+
+
+def _rounded(values):
+    return [round(float(value), DECIMALS) for value in values]
+
+
+def describe(values):
+    """count, min, max, mean, median and (population) std of a 1-D array"""
+    if not len(values):
+        return {'count': 0, 'min': None, 'max': None, 'mean': None, 'median': None, 'std': None}
+    return {
+        'count': int(len(values)),
+        **dict(zip(['min', 'max', 'mean', 'median', 'std'], _rounded([
+            values.min(), values.max(), values.mean(), np.median(values), values.std(),
+        ]))),
+    }
+
+
+def equal_interval_breaks(values, classes):
+    return _rounded(np.linspace(values.min(), values.max(), classes + 1))
+
+
+def quantile_breaks(values, classes):
+    return _rounded(np.quantile(values, np.linspace(0, 1, classes + 1)))
+
+
+def jenks_breaks(values, classes):
+    """Class boundaries minimizing the within-class sum of squared deviations"""
+    x = np.sort(values.astype(float))
+    if len(x) > JENKS_MAX_VALUES:
+        x = np.quantile(x, np.linspace(0, 1, JENKS_MAX_VALUES))
+    classes = min(classes, len(np.unique(x)))
+    n = len(x)
+    if classes < 2:
+        return _rounded([x[0], x[-1]])
+
+    # cost[i, j]: squared deviations of x[i:j] around its mean, from prefix sums
+    s1 = np.concatenate([[0.0], np.cumsum(x)])
+    s2 = np.concatenate([[0.0], np.cumsum(x * x)])
+    i = np.arange(n + 1)[:, None]
+    j = np.arange(n + 1)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = (s2[j] - s2[i]) - (s1[j] - s1[i]) ** 2 / (j - i)
+    cost[j <= i] = np.inf
+
+    # best[j]: least cost of splitting x[:j] into k classes; starts[k - 2][j]: where the k-th class begins
+    best = cost[0].copy()
+    starts = []
+    for _ in range(1, classes):
+        total = best[:, None] + cost
+        starts.append(np.argmin(total, axis=0))
+        best = total[starts[-1], np.arange(n + 1)]
+
+    # Walk back from the full range to the first class
+    uppers = []
+    end = n
+    for start in reversed(starts):
+        begin = start[end]
+        uppers.append(x[begin - 1])
+        end = begin
+    return _rounded([x[0]] + uppers[::-1] + [x[-1]])
+
+
+def breaks(values, classes):
+    """Equal-interval, quantile and Jenks boundaries; empty lists without values"""
+    if not len(values):
+        return {'equal_interval': [], 'quantile': [], 'jenks': []}
+    return {
+        'equal_interval': equal_interval_breaks(values, classes),
+        'quantile': quantile_breaks(values, classes),
+        'jenks': jenks_breaks(values, classes),
+    }
@@ -0,0 +1,107 @@
+"""
+Zoom-aware grid clustering of parcel points.
+
+Points are projected to Web Mercator pixels and binned into square cells
+of CELL_PIXELS screen pixels at every zoom up to MAX_CLUSTER_ZOOM, for
+each year and for all years together. Each cell stores its member count,
+mean position, mean yield and variety breakdown, so the map asks for the
+clusters of its viewport instead of every parcel. Above MAX_CLUSTER_ZOOM
+the API returns the individual points.
+
+Clusters are rebuilt whenever the 'parcels' dataset version changes.
+"""
+import json
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from .models import DatasetVersion, ParcelCluster, ParcelPoint, SourceManifest
+
+# Highest zoom served as clusters; the map gets individual points beyond it
+MAX_CLUSTER_ZOOM = 12
+
+# Cell edge in screen pixels (256 px tiles)
+CELL_PIXELS = 64
+TILE_PIXELS = 256
+
+# SourceManifest entry recording the parcels version the clusters were built from
+MANIFEST_SOURCE = 'parcel_clusters'
+
+ALL_YEARS = -1
+
+
+def mercator_pixels(lon, lat):
+    """Web Mercator pixel coordinates of lon/lat arrays at zoom 0"""
+    lon = np.asarray(lon, dtype=float)
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511))
+    px = (lon + 180.0) / 360.0 * TILE_PIXELS
+    py = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * TILE_PIXELS
+    return px, py
+
+
+def cluster_frame(points, zoom):
+    """
+    DataFrame of clusters (year, cell_x, cell_y, x, y, count, mean_yield,
+    varieties) at zoom for a frame of points with x, y, px, py, year,
+    variety and yield_per_ha columns.
+    """
+    scale = 2 ** zoom / CELL_PIXELS
+    points = points.assign(
+        cell_x=np.floor(points['px'] * scale).astype(np.int64),
+        cell_y=np.floor(points['py'] * scale).astype(np.int64),
+    )
+    keys = ['year', 'cell_x', 'cell_y']
+    clusters = points.groupby(keys).agg(
+        x=('x', 'mean'), y=('y', 'mean'), count=('x', 'size'), mean_yield=('yield_per_ha', 'mean'),
+    )
+    breakdown = points.groupby(keys + ['variety']).size().unstack(fill_value=0)
+    breakdown = breakdown.reindex(clusters.index)
+    names = breakdown.columns.tolist()
+    clusters['varieties'] = [
+        json.dumps({name: int(n) for name, n in zip(names, row) if n})
+        for row in breakdown.to_numpy()
+    ]
+    return clusters.reset_index()
+
+
+def build_parcel_clusters(force=False, batch_size=5000):
+    """
+    Rebuild every ParcelCluster from the stored parcel points; returns the
+    number of clusters stored, or None when they match the current
+    'parcels' version.
+    """
+    version = str(DatasetVersion.current('parcels'))
+    if not force and SourceManifest.is_current(MANIFEST_SOURCE, version):
+        return None
+
+    points = pd.DataFrame.from_records(
+        ParcelPoint.objects.values_list('x', 'y', 'year', 'variety__name', 'yield_per_ha').iterator(),
+        columns=['x', 'y', 'year', 'variety', 'yield_per_ha'],
+    )
+    points['variety'] = points['variety'].fillna('Unknown')
+    points['yield_per_ha'] = points['yield_per_ha'].astype(float)
+    points['px'], points['py'] = mercator_pixels(points['x'], points['y'])
+    # Every point counts once for its year and once for all years
+    points = pd.concat([points, points.assign(year=ALL_YEARS)], ignore_index=True)
+
+    clusters = []
+    if len(points):
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            frame = cluster_frame(points, zoom)
+            mean_yield = frame['mean_yield'].astype(object).where(frame['mean_yield'].notna(), None)
+            clusters.extend(
+                ParcelCluster(
+                    zoom=zoom, year=None if year == ALL_YEARS else year, cell_x=cell_x, cell_y=cell_y,
+                    x=x, y=y, count=count, mean_yield=mean, varieties_json=varieties,
+                )
+                for year, cell_x, cell_y, x, y, count, mean, varieties in zip(
+                    frame['year'].tolist(), frame['cell_x'].tolist(), frame['cell_y'].tolist(),
+                    frame['x'].tolist(), frame['y'].tolist(), frame['count'].tolist(),
+                    mean_yield.tolist(), frame['varieties'].tolist(),
+                )
+            )
+
+    with transaction.atomic():
+        ParcelCluster.objects.all().delete()
+        ParcelCluster.objects.bulk_create(clusters, batch_size=batch_size)
+        SourceManifest.record(MANIFEST_SOURCE, version)
+    return len(clusters)
@@ -0,0 +1,130 @@
+"""
+Parquet and Arrow IPC encoding for the data exports.
+
+Rows come from the same values_list() iterator as the CSV export and are
+converted to typed Arrow record batches: integer and float model fields
+keep their type, and repeated strings (province, variety, crop, ...) are
+dictionary-encoded so each distinct value is stored once.
+
+pyarrow is optional; ARROW_AVAILABLE is False when it isn't installed.
+"""
+import tempfile
+from django.db import models
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+ARROW_AVAILABLE = pa is not None
+
+# Rows per Arrow record batch / Parquet row group
+BATCH_ROWS = 50000
+
+# Parquet output is spooled to disk beyond this size instead of held in memory
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+FORMATS = {
+    # format: (content type, file extension)
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def column_name(lookup):
+    """'boundary__name' -> 'boundary', 'boundary__code' -> 'boundary_code'"""
+    if lookup.endswith('__name'):
+        lookup = lookup[:-len('__name')]
+    return lookup.replace('__', '_')
+
+
+def _model_field(model, lookup):
+    """Resolve a values_list() lookup such as 'boundary__name' to its model field"""
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _arrow_type(field, related):
+    if isinstance(field, (models.BigIntegerField, models.BigAutoField)):
+        return pa.int64()
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        return pa.int32()
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    # Strings unique to each exported row (ids) gain nothing from a dictionary;
+    # names reached through a foreign key repeat even when unique in their table
+    if field.unique and not related:
+        return pa.string()
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def schema_for(model, lookups):
+    """Arrow schema for values_list(*lookups) on model"""
+    return pa.schema([
+        pa.field(column_name(lookup), _arrow_type(_model_field(model, lookup), '__' in lookup), nullable=True)
+        for lookup in lookups
+    ])
+
+
+def _batches(rows, schema):
+    """Record batches of up to BATCH_ROWS rows from an iterator of tuples"""
+    columns = [[] for _ in schema]
+    count = 0
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+        count += 1
+        if count == BATCH_ROWS:
+            yield pa.record_batch([pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema)
+            columns = [[] for _ in schema]
+            count = 0
+    if count:
+        yield pa.record_batch([pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema)
+
+
+def write_parquet(rows, schema):
+    """Parquet file for rows in a spooled temporary file, rewound for reading"""
+    sink = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for batch in _batches(rows, schema):
+            writer.write_batch(batch)
+    sink.seek(0)
+    return sink
+
+
+class _Chunks:
+    """Write-only file object collecting bytes until they are taken"""
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_arrow(rows, schema):
+    """Arrow IPC stream for rows, yielded batch by batch"""
+    chunks = _Chunks()
+    with pa.ipc.new_stream(pa.PythonFile(chunks, mode='w'), schema) as writer:
+        yield chunks.take()
+        for batch in _batches(rows, schema):
+            writer.write_batch(batch)
+            yield chunks.take()
+    yield chunks.take()
@@ -0,0 +1,173 @@
+"""
+Materialized aggregate cube over the yield and gap statistics.
+
+Every YieldStatistics / GapStatistics row is a group of observations
+summarized by count, mean, std, min, quantiles and max. The statistics
+workbook holds them at several levels: a missing variety, province or
+year means the row already covers all of its values (Yield_By_Scenario,
+By_Province_Scenario, ...). Those rows are stored in the cube as the '*'
+cell they represent.
+
+Every other combination of variety, province and year, per scenario (or
+gap type), is pooled from the rows of a single finer level - the
+coarsest one that has rows for the cell - so no observation is counted
+twice. A summary for any filter combination is then one indexed lookup
+instead of a pass over the table.
+
+Pooling is exact for count, mean, std (from the groups' sums of
+squares), min and max. Quantiles can't be pooled, so they are only set
+on cells taken from a single row and left empty on pooled cells.
+"""
+import hashlib
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.db.models import Count, Max
+from .etl import sync_rows
+from .models import DatasetVersion, GapStatistics, SourceManifest, StatisticsCube, YieldStatistics
+
+DIMENSIONS = ['variety', 'province', 'year']
+MEASURES = ['count', 'mean', 'std', 'min', 'q25', 'median', 'q75', 'max']
+QUANTILES = ['q25', 'median', 'q75']
+KEY_FIELDS = ['source', 'variety', 'province', 'year', 'category']
+
+# (model, category lookup) of each cube source
+SOURCES = {
+    'yield': (YieldStatistics, 'scenario__name'),
+    'gap': (GapStatistics, 'gap_type__name'),
+}
+
+# Category of statistics rows without a scenario / gap type
+OVERALL = 'Overall'
+
+# SourceManifest entry for the statistics the cube was built from
+MANIFEST_SOURCE = 'statistics_cube'
+
+DECIMALS = 4
+
+# Part of the source checksum, so a change to the pooling rebuilds the cube
+POOLING_VERSION = 2
+
+
+def _source_checksum():
+    """Changes whenever a statistics row is added, edited or deleted"""
+    digest = hashlib.sha256(f'pooling:{POOLING_VERSION}'.encode('utf-8'))
+    for name, (model, _) in sorted(SOURCES.items()):
+        state = model.objects.aggregate(rows=Count('pk'), updated=Max('updated_at'))
+        digest.update(f'{name}:{state["rows"]}:{state["updated"]}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _statistics_frame(source):
+    model, category = SOURCES[source]
+    frame = pd.DataFrame.from_records(
+        model.objects.values_list('variety_id', 'province', 'year', category, *MEASURES).iterator(),
+        columns=DIMENSIONS + ['category'] + MEASURES,
+    )
+    # Keys are strings; a missing value is the workbook's row for all values
+    all_values = StatisticsCube.ALL
+    frame['variety'] = frame['variety'].map(lambda value: all_values if pd.isna(value) else str(int(value)))
+    frame['province'] = frame['province'].map(lambda value: all_values if pd.isna(value) or value == '' else str(value))
+    frame['year'] = frame['year'].map(lambda value: all_values if pd.isna(value) else str(int(value)))
+    frame['category'] = frame['category'].fillna(OVERALL).astype(str)
+    frame['source'] = source
+    frame[MEASURES] = frame[MEASURES].astype(float)
+    return frame
+
+
+def _levels(frame):
+    """Level of each row: the tuple of DIMENSIONS it gives a value for"""
+    given = frame[DIMENSIONS].ne(StatisticsCube.ALL)
+    return pd.Series(list(map(tuple, given.to_numpy().tolist())), index=frame.index)
+
+
+def pool(frame):
+    """
+    One row of MEASURES per KEY_FIELDS cell, for every subset of
+    DIMENSIONS rolled up to '*'. A cell is taken from the rows of one
+    level only: its own if it has any, else the coarsest finer level
+    with rows for it.
+    """
+    frame = frame.assign(
+        groups=1,
+        weighted_mean=frame['count'] * frame['mean'],
+        # Sum of squares of each group, recovered from its std and mean
+        squares=(frame['count'] - 1) * frame['std'].fillna(0) ** 2 + frame['count'] * frame['mean'] ** 2,
+    )
+    sums = ['groups', 'count', 'weighted_mean', 'squares'] + QUANTILES
+    levels = _levels(frame)
+    present = sorted(set(levels), key=lambda level: (sum(level), level))
+
+    cells = []
+    for size in range(len(DIMENSIONS) + 1):
+        for kept in combinations(range(len(DIMENSIONS)), size):
+            target = tuple(index in kept for index in range(len(DIMENSIONS)))
+            rolled = {dimension: StatisticsCube.ALL for index, dimension in enumerate(DIMENSIONS) if index not in kept}
+            # Own level first, then ever finer ones; never two levels in one cell
+            for level in present:
+                if all(given or not wanted for given, wanted in zip(level, target)):
+                    grouped = frame[levels == level].assign(**rolled).groupby(KEY_FIELDS)
+                    cells.append(grouped[sums].sum(min_count=1).join(
+                        grouped[['min', 'max']].agg({'min': 'min', 'max': 'max'})
+                    ))
+    cells = pd.concat(cells)
+    cells = cells[~cells.index.duplicated(keep='first')]
+
+    n = cells['count']
+    mean = cells['weighted_mean'] / n
+    variance = ((cells['squares'] - n * mean ** 2) / (n - 1)).where(n > 1)
+    single = cells['groups'] == 1
+    result = pd.DataFrame({
+        'count': n.astype(int),
+        'mean': mean,
+        'std': np.sqrt(variance.clip(lower=0)),
+        'min': cells['min'],
+        'max': cells['max'],
+        **{q: cells[q].where(single) for q in QUANTILES},
+    }, index=cells.index)
+    return result[MEASURES].round(DECIMALS).reset_index()
+
+
+def build_statistics_cube(force=False, batch_size=1000):
+    """
+    Bring the cube in line with the statistics tables, writing only the
+    cells that changed; returns the SyncResult, or None when the tables
+    are unchanged since the last build.
+    """
+    checksum = _source_checksum()
+    if not force and SourceManifest.is_current(MANIFEST_SOURCE, checksum):
+        return None
+
+    frames = [frame for frame in (_statistics_frame(source) for source in SOURCES) if len(frame)]
+    cells = pool(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame(columns=KEY_FIELDS + MEASURES)
+    cells = cells.astype(object).where(cells.notna(), None)
+    objects = [StatisticsCube(**row) for row in cells.to_dict('records')]
+
+    with transaction.atomic():
+        result = sync_rows(StatisticsCube.objects.all(), KEY_FIELDS, objects, MEASURES, batch_size=batch_size)
+        if result.created or result.updated or result.deleted:
+            DatasetVersion.bump('statistics')
+        SourceManifest.record(MANIFEST_SOURCE, checksum)
+    return result
+
+
+def cube_summary(source, params):
+    """
+    {category: measures} for the ?variety= (id), ?province= and ?year=
+    filters, read from the single cube cell of each category.
+    """
+    year = params.get('year') or StatisticsCube.ALL
+    if year != StatisticsCube.ALL:
+        try:
+            year = str(int(year))
+        except ValueError:
+            raise BadRequest('year must be an integer')
+    cells = StatisticsCube.objects.filter(
+        source=source,
+        variety=params.get('variety') or StatisticsCube.ALL,
+        province=params.get('province') or StatisticsCube.ALL,
+        year=year,
+    ).order_by('category').values('category', *MEASURES)
+    return {cell.pop('category'): cell for cell in cells}
@@ -0,0 +1,82 @@
+"""
+Vectorized yield-gap decomposition (Lobell et al.).
+
+Yield levels in t/ha, from highest to lowest:
+    Y_p   potential            potential_yield
+    Y_w   water-limited        water_limited_yield
+    Y_nut nutrient-limited     nutrient_limited_yield (Calibrated scenario)
+    Y_a   actual               actual_yield
+    Y_nf  unfertilized         unfertilized_yield
+
+Gaps, all clipped at 0:
+    yield_gap               Y_p - Y_a (total exploitable gap)
+    water_gap               Y_p - Y_w
+    nutrient_gap            Y_w - Y_nut
+    management_gap          Y_nut - Y_a
+    fertilizer_response_gap Y_a - Y_nf
+    yield_gap_percent       yield_gap / Y_p * 100 (0 when Y_p is 0)
+
+Every function works on whole columns at once; missing levels are NaN
+and give NaN gaps, stored as NULL.
+
+Levels are stored unrounded and gaps rounded to DECIMALS, so the stored
+levels reproduce every stored gap exactly; the API rounds the levels
+(round_level) when it serializes them.
+"""
+import numpy as np
+import pandas as pd
+
+LEVEL_FIELDS = [
+    'potential_yield', 'water_limited_yield', 'nutrient_limited_yield',
+    'actual_yield', 'unfertilized_yield',
+]
+GAP_FIELDS = [
+    'yield_gap', 'yield_gap_percent', 'water_gap', 'nutrient_gap',
+    'management_gap', 'fertilizer_response_gap',
+]
+
+DECIMALS = 2
+
+
+def decompose_gaps(levels):
+    """
+    DataFrame of LEVEL_FIELDS (clipped at 0, unrounded) and GAP_FIELDS
+    (rounded to DECIMALS) for a DataFrame or dict of level columns;
+    missing columns are all NaN.
+    """
+    levels = pd.DataFrame(levels)
+    index = levels.index
+    y_p, y_w, y_nut, y_a, y_nf = (
+        levels[field].astype(float).clip(lower=0) if field in levels
+        else pd.Series(np.nan, index=index)
+        for field in LEVEL_FIELDS
+    )
+
+    total_gap = (y_p - y_a).clip(lower=0)
+    gap_percent = (total_gap / y_p.where(y_p > 0) * 100).mask(y_p == 0, 0.0)
+
+    result = pd.DataFrame({
+        'potential_yield': y_p,
+        'water_limited_yield': y_w,
+        'nutrient_limited_yield': y_nut,
+        'actual_yield': y_a,
+        'unfertilized_yield': y_nf,
+        'yield_gap': total_gap,
+        'yield_gap_percent': gap_percent,
+        'water_gap': (y_p - y_w).clip(lower=0),
+        'nutrient_gap': (y_w - y_nut).clip(lower=0),
+        'management_gap': (y_nut - y_a).clip(lower=0),
+        'fertilizer_response_gap': (y_a - y_nf).clip(lower=0),
+    }, index=index)
+    result[GAP_FIELDS] = result[GAP_FIELDS].round(DECIMALS)
+    return result
+
+
+def round_level(value):
+    """A stored yield level rounded for output; None stays None"""
+    return round(value, DECIMALS) if value is not None else None
+
+
+def as_records(frame):
+    """DataFrame rows as dicts with NaN replaced by None, ready for model fields"""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
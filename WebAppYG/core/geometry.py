@@ -0,0 +1,84 @@
+"""
+Helpers for administrative boundary geometry.
+
+Each boundary is simplified once per level of detail at load time (see
+load_shapefiles) and the API picks the level matching the map zoom. The
+same pass stores WKB, bbox, centroid and area so spatial filters never
+need to parse GeoJSON.
+"""
+import json
+from pyproj import Geod
+from shapely.geometry import mapping
+
+_GEOD = Geod(ellps='WGS84')
+
+# (simplification tolerance in degrees, highest zoom served by the level).
+# A web-map pixel is ~360 / (256 * 2**zoom) degrees, so each tolerance
+# stays below about one screen pixel up to its max zoom.
+GEOMETRY_LEVELS = [
+    (0.05, 4),
+    (0.01, 6),
+    (0.002, 8),
+    (0.0005, 10),
+    (0.0001, None),
+]
+
+# Level stored in AdministrativeBoundary.geometry_json and served by default
+DEFAULT_TOLERANCE = 0.01
+
+TOLERANCES = [tolerance for tolerance, _ in GEOMETRY_LEVELS]
+
+
+def simplify_levels(geometry):
+    """Return {tolerance: GeoJSON string} for every level of detail"""
+    levels = {}
+    for tolerance in TOLERANCES:
+        simplified = geometry.simplify(tolerance=tolerance, preserve_topology=True)
+        levels[tolerance] = json.dumps(mapping(simplified))
+    return levels
+
+
+def tolerance_for_zoom(zoom):
+    """Coarsest stored tolerance that still looks exact at the given zoom"""
+    for tolerance, max_zoom in GEOMETRY_LEVELS:
+        if max_zoom is None or zoom <= max_zoom:
+            return tolerance
+    return TOLERANCES[-1]
+
+
+def nearest_tolerance(value):
+    """Snap an arbitrary tolerance to the closest stored level not coarser than it"""
+    for tolerance in TOLERANCES:
+        if tolerance <= value:
+            return tolerance
+    return TOLERANCES[-1]
+
+
+def zoom_range(tolerance):
+    """(min_zoom, max_zoom) served by a stored tolerance; max_zoom may be None"""
+    min_zoom = 0
+    for level_tolerance, max_zoom in GEOMETRY_LEVELS:
+        if level_tolerance == tolerance:
+            return min_zoom, max_zoom
+        min_zoom = max_zoom + 1
+    return min_zoom, None
+
+
+def geometry_columns(geometry):
+    """
+    Binary geometry, bounding box, centroid and geodesic area (km²) of a
+    lon/lat geometry, as stored on AdministrativeBoundary.
+    """
+    min_x, min_y, max_x, max_y = geometry.bounds
+    centroid = geometry.centroid
+    area, _ = _GEOD.geometry_area_perimeter(geometry)
+    return {
+        'geometry_wkb': geometry.wkb,
+        'min_x': min_x,
+        'min_y': min_y,
+        'max_x': max_x,
+        'max_y': max_y,
+        'centroid_x': centroid.x,
+        'centroid_y': centroid.y,
+        'area_km2': abs(area) / 1e6,
+    }
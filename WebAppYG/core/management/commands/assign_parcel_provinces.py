@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from core.models import ParcelPoint, DatasetVersion
+from core.spatial import assign_parcel_provinces
+import time
+
+
+class Command(BaseCommand):
+    help = 'Assign parcel points to the province polygon that contains them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--level', type=str, default='province',
+                            help='Administrative level of the boundaries to assign')
+        parser.add_argument('--only-unknown', action='store_true',
+                            help="Only re-assign parcels whose province is 'Unknown' or empty")
+
+    def handle(self, *args, **options):
+        queryset = ParcelPoint.objects.all()
+        if options['only_unknown']:
+            queryset = queryset.filter(province__in=['Unknown', ''])
+
+        start = time.time()
+        assigned, unmatched = assign_parcel_provinces(queryset, level=options['level'])
+        elapsed = time.time() - start
+        if assigned:
+            DatasetVersion.bump('parcels')
+
+        if unmatched:
+            self.stdout.write(self.style.WARNING(f'{unmatched} parcel points are outside every {options["level"]} boundary'))
+        self.stdout.write(self.style.SUCCESS(f'Assigned {assigned} parcel points to provinces in {elapsed:.2f}s'))
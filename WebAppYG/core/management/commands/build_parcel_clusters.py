@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from core.clusters import build_parcel_clusters, MAX_CLUSTER_ZOOM
+
+
+class Command(BaseCommand):
+    help = 'Precompute the per-zoom parcel point clusters served by /api/parcel-points/clusters/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild even if the clusters match the current parcel data')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        stored = build_parcel_clusters(force=options['force'])
+        if stored is None:
+            self.stdout.write('Parcel clusters are current, skipping (use --force to rebuild)')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {stored} parcel clusters for zooms 0-{MAX_CLUSTER_ZOOM} in {time.time() - start:.2f}s'
+        ))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from core.payloads import build_payloads, brotli
+
+
+class Command(BaseCommand):
+    help = 'Render and precompress (gzip, brotli) the common API responses for the current data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild even if the stored payloads match the current data')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        stored = build_payloads(force=options['force'])
+        if stored is None:
+            self.stdout.write('Precompressed payloads are current, skipping (use --force to rebuild)')
+            return
+
+        encodings = 'gzip + brotli' if brotli is not None else 'gzip only, brotli not installed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {stored} precompressed responses ({encodings}) in {time.time() - start:.2f}s'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from core.cube import build_statistics_cube
+
+
+class Command(BaseCommand):
+    help = 'Pool the yield and gap statistics into the aggregate cube read by the summary endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild even if the statistics are unchanged since the last build')
+
+    def handle(self, *args, **options):
+        result = build_statistics_cube(force=options['force'])
+        if result is None:
+            self.stdout.write('Statistics cube is current, skipping (use --force to rebuild)')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Statistics cube: {result.created} created, {result.updated} updated, '
+            f'{result.deleted} deleted, {result.unchanged} unchanged cells'
+        ))
@@ -1,154 +1,207 @@
 import pandas as pd
+import numpy as np
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from core.models import ParcelPoint
+from django.db import transaction
+from core.models import ParcelPoint, Variety, SourceManifest, DatasetVersion
+from core.etl import file_checksum, sync_rows
+from core.spatial import assign_parcel_provinces, in_morocco
+from core.clusters import build_parcel_clusters
 import os
 from pyproj import Transformer
 
+# Possible Excel column names for each ParcelPoint field (first match wins)
+COLUMN_CANDIDATES = {
+    'x': ['X', 'x', 'Longitude', 'LON'],
+    'y': ['Y', 'y', 'Latitude', 'LAT'],
+    'parcel_id': ['ID', 'id', 'Parcel_ID', 'ParcelID'],
+    'province': ['Province', 'province', 'PROVINCE'],
+    'variety': ['variety', 'Variety', 'VARIETY', 'Variety_planted'],
+    'year': ['Year', 'year', 'YEAR'],
+    'area': ['Area', 'area', 'AREA', 'Area_ha'],
+    'yield_total': ['Yield', 'yield', 'YIELD', 'Total_Yield'],
+    'yield_per_ha': ['yield (t/ha)', 'Yield (t/ha)', 'yield_t_ha', 'Yield_t_ha', 'yield_per_ha', 'yield'],
+}
+
+PARCEL_FIELDS = ['x', 'y', 'province', 'variety_id', 'year', 'area', 'yield_total', 'yield_per_ha']
+
+# Common Morocco projections: EPSG:26191 (Nord Maroc), then EPSG:26194 (Sahara) as fallback
+PROJECTED_CRS = ['EPSG:26191', 'EPSG:26194']
+
+
 class Command(BaseCommand):
     help = 'Load parcel data from Excel file'
 
     def add_arguments(self, parser):
-        parser.add_argument('--file', type=str, help='Path to Excel file', 
+        parser.add_argument('--file', type=str, help='Path to Excel file',
                           default='data/plot_v_p.xlsx')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk INSERT/UPDATE')
+        parser.add_argument('--force', action='store_true',
+                            help='Reload even if the file is unchanged since the last load')
+        parser.add_argument('--skip-payloads', action='store_true',
+                            help="Don't rebuild the precompressed API responses (run build_payloads later)")
 
     def handle(self, *args, **options):
         file_path = options['file']
-        
+
         if not os.path.exists(file_path):
             self.stdout.write(self.style.ERROR(f'File not found: {file_path}'))
             return
 
+        source = f'load_parcel_data:{file_path}'
+        checksum = file_checksum([file_path])
+        if not options['force'] and SourceManifest.is_current(source, checksum):
+            self.stdout.write(f'{file_path} unchanged since last load, skipping (use --force to reload)')
+            return
+
         try:
             # Read Excel file
             df = pd.read_excel(file_path)
-            
-            # Debug: Print column names
-            self.stdout.write(f'Excel columns found: {list(df.columns)}')
-            self.stdout.write(f'First few rows:')
-            self.stdout.write(str(df.head()))
-            
-            # Check coordinate ranges to detect CRS
-            x_vals = df['X'].dropna() if 'X' in df.columns else pd.Series()
-            y_vals = df['Y'].dropna() if 'Y' in df.columns else pd.Series()
-            
-            if len(x_vals) > 0:
-                x_min, x_max = x_vals.min(), x_vals.max()
-                y_min, y_max = y_vals.min(), y_vals.max()
-                self.stdout.write(f'X range: {x_min} to {x_max}')
-                self.stdout.write(f'Y range: {y_min} to {y_max}')
-                
-                # Morocco is roughly -17° to -1° longitude, 21° to 36° latitude
-                # If coordinates are outside these ranges, they're likely in a projected CRS
-                needs_transform = abs(x_max) > 180 or abs(y_max) > 90
-                
-                if needs_transform:
-                    self.stdout.write(self.style.WARNING('Coordinates appear to be in projected CRS (likely UTM or Lambert). Attempting transformation...'))
-                    # Common Morocco projections: EPSG:26191 (Nord Maroc), EPSG:26192 (Sud Maroc), EPSG:26194 (Sahara)
-                    # Try EPSG:26191 (Lambert Nord Maroc) -> EPSG:4326 (WGS84)
-                    transformer = Transformer.from_crs("EPSG:26191", "EPSG:4326", always_xy=True)
-                else:
-                    # Check if coordinates are already in Morocco range
-                    if x_min >= -17 and x_max <= -1 and y_min >= 21 and y_max <= 36:
-                        self.stdout.write('Coordinates appear to be in Morocco lat/long (WGS84)')
-                        transformer = None
-                    else:
-                        self.stdout.write(self.style.WARNING('Coordinates are in lat/long but not in Morocco range. May need transformation.'))
-                        transformer = None
-            else:
-                transformer = None
-            
-            # Clear existing data
-            ParcelPoint.objects.all().delete()
-            
-            # Load data
-            created_count = 0
-            for index, row in df.iterrows():
-                try:
-                    # Helper function to safely convert to float
-                    def safe_float(value):
-                        if pd.isna(value):
-                            return None
-                        try:
-                            return float(value)
-                        except (ValueError, TypeError):
-                            return None
-                    
-                    # Helper function to safely convert to int
-                    def safe_int(value):
-                        if pd.isna(value):
-                            return None
-                        try:
-                            return int(value)
-                        except (ValueError, TypeError):
-                            return None
-                    
-                    # Map column names to actual Excel columns
-                    column_mapping = {
-                        'x': 'X',
-                        'y': 'Y', 
-                        'parcel_id': 'ID',
-                        'province': 'Province',
-                        'variety': 'variety',
-                        'year': 'Year',
-                        'area': 'Area',
-                        'yield_total': 'Yield',
-                        'yield_per_ha': 'yield (t/ha)'
-                    }
-                    
-                    # Check if columns exist, use alternative names if needed
-                    def get_column_value(row, possible_names):
-                        for name in possible_names:
-                            if name in row.index:
-                                return row[name]
-                        return None
-                    
-                    # Get raw coordinates
-                    x_raw = safe_float(get_column_value(row, ['X', 'x', 'Longitude', 'LON']))
-                    y_raw = safe_float(get_column_value(row, ['Y', 'y', 'Latitude', 'LAT']))
-                    
-                    # Transform if needed
-                    if transformer and x_raw is not None and y_raw is not None:
-                        try:
-                            lon, lat = transformer.transform(x_raw, y_raw)
-                            # Check if transformed coordinates are in Morocco
-                            if not (-17 <= lon <= -1 and 21 <= lat <= 36):
-                                self.stdout.write(self.style.WARNING(f'Transformed coordinates not in Morocco for parcel {index}: lon={lon}, lat={lat}'))
-                                # Try alternative CRS
-                                try:
-                                    transformer_alt = Transformer.from_crs("EPSG:26194", "EPSG:4326", always_xy=True)
-                                    lon, lat = transformer_alt.transform(x_raw, y_raw)
-                                    if not (-17 <= lon <= -1 and 21 <= lat <= 36):
-                                        self.stdout.write(self.style.WARNING(f'Alternative transform also failed for parcel {index}'))
-                                        continue
-                                except:
-                                    continue
-                        except Exception as e:
-                            self.stdout.write(self.style.WARNING(f'Transform failed for parcel {index}: {e}'))
-                            continue
-                    else:
-                        lon, lat = x_raw, y_raw
-                        # Check if coordinates are in Morocco range
-                        if lon is not None and lat is not None and not (-17 <= lon <= -1 and 21 <= lat <= 36):
-                            self.stdout.write(self.style.WARNING(f'Coordinates not in Morocco range for parcel {index}: lon={lon}, lat={lat}'))
-                            continue
-                    
-                    parcel = ParcelPoint.objects.create(
-                        x=lon,
-                        y=lat,
-                        parcel_id=str(get_column_value(row, ['ID', 'id', 'Parcel_ID', 'ParcelID'])) or f'Parcel_{index}',
-                        province=str(get_column_value(row, ['Province', 'province', 'PROVINCE'])) or 'Unknown',
-                        variety=str(get_column_value(row, ['variety', 'Variety', 'VARIETY', 'Variety_planted'])) or 'Unknown',
-                        year=safe_int(get_column_value(row, ['Year', 'year', 'YEAR'])),
-                        area=safe_float(get_column_value(row, ['Area', 'area', 'AREA', 'Area_ha'])),
-                        yield_total=safe_float(get_column_value(row, ['Yield', 'yield', 'YIELD', 'Total_Yield'])),
-                        yield_per_ha=safe_float(get_column_value(row, ['yield (t/ha)', 'Yield (t/ha)', 'yield_t_ha', 'Yield_t_ha', 'yield_per_ha']))
-                    )
-                    created_count += 1
-                except Exception as e:
-                    self.stdout.write(self.style.WARNING(f'Error creating parcel {index}: {e}'))
-                    continue
-            
-            self.stdout.write(self.style.SUCCESS(f'Successfully loaded {created_count} parcel points'))
-            
+            self.stdout.write(f'Excel columns found: {list(df.columns)} ({len(df)} rows)')
+
+            columns = self.resolve_columns(df)
+            self.stdout.write(f'Column mapping: {columns}')
+
+            # Vectorized type coercion - unparseable values become NaN/None
+            def numeric(field):
+                if columns[field] is None:
+                    return pd.Series(np.nan, index=df.index)
+                return pd.to_numeric(df[columns[field]], errors='coerce')
+
+            def text(field, default):
+                if columns[field] is None:
+                    return pd.Series(default, index=df.index)
+                values = df[columns[field]].astype('string').str.strip()
+                return values.mask(values.isna() | (values == ''), default)
+
+            x_raw = numeric('x').to_numpy(dtype=float)
+            y_raw = numeric('y').to_numpy(dtype=float)
+            year = numeric('year')
+            parcel_ids = text('parcel_id', None)
+            parcel_ids = parcel_ids.fillna(pd.Series([f'Parcel_{i}' for i in df.index], index=df.index))
+
+            lon, lat = self.to_wgs84(x_raw, y_raw)
+
+            # Every rejected row gets the first reason that applies
+            reasons = pd.Series(None, index=df.index, dtype=object)
+            reasons[np.isnan(x_raw) | np.isnan(y_raw)] = 'missing coordinates'
+            reasons[reasons.isna() & ~in_morocco(lon, lat)] = 'outside Morocco'
+            reasons[reasons.isna() & year.isna()] = 'missing year'
+            reasons[reasons.isna() & parcel_ids.duplicated()] = 'duplicate parcel_id'
+            accepted = reasons.isna().to_numpy()
+
+            frame = pd.DataFrame({
+                'x': lon,
+                'y': lat,
+                'parcel_id': parcel_ids,
+                'province': text('province', 'Unknown'),
+                'variety': text('variety', 'Unknown'),
+                'year': year,
+                'area': numeric('area'),
+                'yield_total': numeric('yield_total'),
+                'yield_per_ha': numeric('yield_per_ha'),
+            })[accepted]
+            # NaN -> None so nullable FloatFields store NULL
+            frame = frame.astype(object).where(frame.notna(), None)
+
+            variety_ids = Variety.ids_for(str(name) for name in frame['variety'].unique())
+            parcels = [
+                ParcelPoint(
+                    x=row.x, y=row.y, parcel_id=str(row.parcel_id),
+                    province=str(row.province), variety_id=variety_ids[str(row.variety)], year=int(row.year),
+                    area=row.area, yield_total=row.yield_total, yield_per_ha=row.yield_per_ha,
+                )
+                for row in frame.itertuples(index=False)
+            ]
+
+            # Only write rows that changed; the province is derived from the
+            # boundaries afterwards, so it doesn't count as a change
+            with transaction.atomic():
+                result = sync_rows(ParcelPoint.objects.all(), ['parcel_id'], parcels, PARCEL_FIELDS,
+                                   compare_fields=[f for f in PARCEL_FIELDS if f != 'province'],
+                                   batch_size=options['batch_size'])
+
+                # Province comes from the polygon containing each point, in one STRtree pass
+                if result.changed_keys:
+                    changed = ParcelPoint.objects.filter(parcel_id__in=[key for key, in result.changed_keys])
+                    assigned, unmatched = assign_parcel_provinces(changed)
+                    self.stdout.write(f'Assigned {assigned} parcel points to provinces ({unmatched} outside all provinces)')
+
+                if result.created or result.updated or result.deleted:
+                    DatasetVersion.bump('parcels')
+
+                SourceManifest.record(source, checksum)
+
+            if result.created or result.updated or result.deleted:
+                stored = build_parcel_clusters()
+                if stored is not None:
+                    self.stdout.write(f'Stored {stored} parcel clusters')
+                if not options['skip_payloads']:
+                    call_command('build_payloads', stdout=self.stdout)
+
+            self.report_rejected(reasons)
+
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully loaded {len(parcels)} parcel points: {result.created} created, '
+                f'{result.updated} updated, {result.deleted} deleted, {result.unchanged} unchanged'
+            ))
+
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error loading file: {e}'))
+
+    def resolve_columns(self, df):
+        """Map each ParcelPoint field to an Excel column, each column used once"""
+        columns = {}
+        used = set()
+        for field, candidates in COLUMN_CANDIDATES.items():
+            columns[field] = next((name for name in candidates if name in df.columns and name not in used), None)
+            used.add(columns[field])
+        return columns
+
+    def to_wgs84(self, x, y):
+        """
+        Convert coordinate arrays to lon/lat in one pass per CRS.
+
+        Projected coordinates are tried against each Morocco CRS in turn,
+        only re-transforming rows that are still outside Morocco. Lon/lat
+        rows that only fall in Morocco with X and Y swapped are swapped.
+        """
+        valid = ~(np.isnan(x) | np.isnan(y))
+        if not valid.any():
+            return x.copy(), y.copy()
+
+        needs_transform = np.nanmax(np.abs(x)) > 180 or np.nanmax(np.abs(y)) > 90
+        if needs_transform:
+            self.stdout.write(self.style.WARNING('Coordinates appear to be in projected CRS (likely UTM or Lambert). Attempting transformation...'))
+            lon = np.full_like(x, np.nan)
+            lat = np.full_like(y, np.nan)
+            pending = valid.copy()
+            for crs in PROJECTED_CRS:
+                if not pending.any():
+                    break
+                transformer = Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+                t_lon, t_lat = transformer.transform(x[pending], y[pending])
+                ok = in_morocco(t_lon, t_lat)
+                rows = np.flatnonzero(pending)[ok]
+                lon[rows], lat[rows] = t_lon[ok], t_lat[ok]
+                pending[rows] = False
+                self.stdout.write(f'{crs}: {ok.sum()} rows transformed into Morocco')
+            return lon, lat
+
+        lon, lat = x.copy(), y.copy()
+        swapped = valid & ~in_morocco(x, y) & in_morocco(y, x)
+        if swapped.any():
+            self.stdout.write(self.style.WARNING(f'{swapped.sum()} rows have X/Y swapped (latitude in X) - swapping'))
+            lon[swapped], lat[swapped] = y[swapped], x[swapped]
+        return lon, lat
+
+    def report_rejected(self, reasons):
+        rejected = reasons.dropna()
+        if rejected.empty:
+            return
+        self.stdout.write(self.style.WARNING(f'Rejected {len(rejected)} rows:'))
+        for reason, rows in rejected.groupby(rejected):
+            sample = ', '.join(str(i) for i in rows.index[:10])
+            more = f' (+{len(rows) - 10} more)' if len(rows) > 10 else ''
+            self.stdout.write(self.style.WARNING(f'  {reason}: {len(rows)} rows - e.g. rows {sample}{more}'))
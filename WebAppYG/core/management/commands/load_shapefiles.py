@@ -1,8 +1,14 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.db import transaction
 import geopandas as gpd
 import os
 import json
-from core.models import AdministrativeBoundary
+from core.models import AdministrativeBoundary, BoundaryGeometry, BoundaryTopology, DatasetVersion, SourceManifest
+from core.etl import file_checksum
+from core.spatial import assign_parcel_provinces
+from core.geometry import simplify_levels, geometry_columns, DEFAULT_TOLERANCE, TOLERANCES
+from core.topojson import build_topology
 
 class Command(BaseCommand):
     help = 'Load Morocco shapefiles into the database'
@@ -12,6 +18,9 @@ class Command(BaseCommand):
         parser.add_argument('--level', type=str, default='province', help='Administrative level')
         parser.add_argument('--name-field', type=str, default='NOM_PROV', help='Field name for region names')
         parser.add_argument('--code-field', type=str, default='CODE_PROVI', help='Field name for region codes')
+        parser.add_argument('--force', action='store_true', help='Reload even if the shapefile is unchanged since the last load')
+        parser.add_argument('--skip-payloads', action='store_true',
+                            help="Don't rebuild the precompressed API responses (run build_payloads later)")
     
     def handle(self, *args, **options):
         shapefile_path = options.get('shapefile')
@@ -29,6 +38,13 @@ class Command(BaseCommand):
             )
             return
         
+        source = os.path.splitext(os.path.basename(shapefile_path))[0]
+        manifest_source = f'load_shapefiles:{shapefile_path}'
+        checksum = file_checksum([shapefile_path], level=level, name_field=name_field, code_field=code_field)
+        if not options['force'] and SourceManifest.is_current(manifest_source, checksum):
+            self.stdout.write(f'{shapefile_path} unchanged since last load, skipping (use --force to reload)')
+            return
+        
         # Read shapefile
         gdf = gpd.read_file(shapefile_path)
         
@@ -39,42 +55,104 @@ class Command(BaseCommand):
         self.stdout.write(f'Loaded shapefile with {len(gdf)} features')
         self.stdout.write(f'Available columns: {list(gdf.columns)}')
         
-        # Load into database
+        # Stored name, level and geometry per code, to skip rows where none of them changed
+        stored = {
+            code: (stored_name, stored_level, bytes(wkb) if wkb is not None else None)
+            for code, stored_name, stored_level, wkb in AdministrativeBoundary.objects.values_list(
+                'code', 'name', 'level', 'geometry_wkb'
+            )
+        }
+        
+        # Simplify every changed geometry before writing anything, so a bad
+        # feature leaves the stored boundaries and the manifest untouched
+        features = []
+        errors = []
         for idx, row in gdf.iterrows():
             # Extract name and code from shapefile attributes
-            name = row.get(name_field, f'{level}_{idx}')
-            code = row.get(code_field, f'{level}_{idx}')
+            name = str(row.get(name_field, f'{level}_{idx}'))
+            code = str(row.get(code_field, f'{level}_{idx}'))
+            
+            wkb = row.geometry.wkb if row.geometry is not None else None
+            if wkb is not None and stored.get(code) == (name, level, wkb):
+                self.stdout.write(f'Unchanged: {name} ({code})')
+                continue
             
-            # Convert geometry to GeoJSON
+            # Convert geometry to GeoJSON, simplified once per level of detail,
+            # plus WKB, bbox, centroid and area for server-side spatial work
             try:
-                geometry_json = row.geometry.__geo_interface__ if hasattr(row.geometry, '__geo_interface__') else None
-                if geometry_json:
-                    # Simplify geometry for better performance
-                    simplified_geom = row.geometry.simplify(tolerance=0.01, preserve_topology=True)
-                    geometry_json = simplified_geom.__geo_interface__
+                levels = simplify_levels(row.geometry) if row.geometry is not None else {}
+                columns = geometry_columns(row.geometry) if row.geometry is not None else {}
             except Exception as e:
-                self.stdout.write(f'Error processing geometry for {name}: {e}')
-                geometry_json = None
-            
-            # Create or update boundary
-            boundary, created = AdministrativeBoundary.objects.get_or_create(
-                code=code,
-                defaults={
-                    'name': name,
-                    'level': level,
-                    'geometry_json': json.dumps(geometry_json) if geometry_json else None,
-                }
-            )
+                errors.append(f'{name} ({code}): {e}')
+                continue
+            features.append((name, code, levels, columns))
+        
+        if errors:
+            for error in errors:
+                self.stdout.write(self.style.ERROR(f'Error processing geometry for {error}'))
+            self.stdout.write(self.style.ERROR(
+                f'Nothing loaded from {shapefile_path}: {len(errors)} geometries failed'
+            ))
+            return
+        changed = len(features)
+        
+        with transaction.atomic():
+            self.save_boundaries(features, level)
+            self.save_topology(gdf, source, level, code_field, changed)
             
-            if created:
-                self.stdout.write(f'Created: {name} ({code}) - Geometry: {bool(geometry_json)}')
+            if changed:
+                # New geometry version invalidates cached /api/boundary-geometry/ responses
+                version = DatasetVersion.bump('boundaries')
+                # Parcel provinces are derived from the boundaries
+                assigned, unmatched = assign_parcel_provinces(level=level)
+                self.stdout.write(f'Reassigned {assigned} parcel points to provinces ({unmatched} outside all provinces)')
+                if assigned:
+                    DatasetVersion.bump('parcels')
             else:
-                # Update geometry if it exists
-                if geometry_json:
-                    boundary.geometry_json = json.dumps(geometry_json)
-                    boundary.save()
-                self.stdout.write(f'Updated: {name} ({code}) - Geometry: {bool(geometry_json)}')
+                version = DatasetVersion.current('boundaries')
+            
+            SourceManifest.record(manifest_source, checksum)
+        
+        if changed and not options['skip_payloads']:
+            call_command('build_payloads', stdout=self.stdout)
         
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully loaded {len(gdf)} boundaries')
-        )
\ No newline at end of file
+            self.style.SUCCESS(f'Successfully loaded {len(gdf)} boundaries, {changed} changed (geometry version {version})')
+        )
+    
+    def save_boundaries(self, features, level):
+        """Create or update one boundary and its levels of detail per (name, code, levels, columns)"""
+        for name, code, levels, columns in features:
+            geometry_json = levels.get(DEFAULT_TOLERANCE)
+            
+            # Keep the stored geometry when the feature has none
+            defaults = {'name': name, 'level': level}
+            if geometry_json:
+                defaults.update({'geometry_json': geometry_json, **columns})
+            boundary, created = AdministrativeBoundary.objects.update_or_create(code=code, defaults=defaults)
+            
+            action = 'Created' if created else 'Updated'
+            self.stdout.write(f'{action}: {name} ({code}) - Geometry: {bool(geometry_json)}')
+            
+            if levels:
+                boundary.geometry_levels.all().delete()
+                BoundaryGeometry.objects.bulk_create([
+                    BoundaryGeometry(boundary=boundary, tolerance=tolerance, geometry_json=level_json)
+                    for tolerance, level_json in levels.items()
+                ])
+    
+    def save_topology(self, gdf, source, level, code_field, changed):
+        """Shared-arc TopoJSON per level of detail, rebuilt when any boundary changed"""
+        if changed or not BoundaryTopology.objects.filter(source=source).exists():
+            # Built from the unsimplified geometry
+            features = [
+                (str(row.get(code_field, f'{level}_{idx}')), row.geometry)
+                for idx, row in gdf.iterrows() if row.geometry is not None
+            ]
+            for tolerance in TOLERANCES:
+                topology = build_topology(features, tolerance)
+                BoundaryTopology.objects.update_or_create(
+                    source=source, tolerance=tolerance,
+                    defaults={'topology_json': json.dumps(topology, separators=(',', ':'))}
+                )
+            self.stdout.write(f'Built TopoJSON for {len(features)} features at {len(TOLERANCES)} levels')
@@ -1,28 +1,55 @@
 import os
+import numpy as np
+import shapely
 import geopandas as gpd
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from core.models import ParcelPoint
-import json
+from django.db import transaction
+from core.models import ParcelPoint, Variety, SourceManifest, DatasetVersion
+from core.etl import file_checksum, sync_rows
+from core.spatial import assign_parcel_provinces, in_morocco
+from core.clusters import build_parcel_clusters
+
+DEFAULT_VARIETY_FILES = [
+    'Achtar.shp',
+    'Arrehane.shp',
+    'Bandera.shp',
+    'Faiza.shp',
+    'Radia.shp',
+]
+DEFAULT_YEARS = [2019, 2020, 2021]
+
+PARCEL_FIELDS = ['x', 'y', 'province', 'variety_id', 'year', 'area', 'yield_total', 'yield_per_ha']
 
 
 class Command(BaseCommand):
     help = 'Load parcel points from variety shapefiles'
 
     def add_arguments(self, parser):
-        parser.add_argument('--dir', type=str, help='Directory containing variety shapefiles', 
+        parser.add_argument('--dir', type=str, help='Directory containing variety shapefiles',
                           default='data/Shapefiles/Varieties')
+        parser.add_argument('--files', nargs='+', default=DEFAULT_VARIETY_FILES,
+                            help='Variety shapefile names; the variety is the file name without .shp')
+        parser.add_argument('--years', nargs='+', type=int, default=DEFAULT_YEARS,
+                            help='Years to create a parcel point for, per feature')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk INSERT/UPDATE')
+        parser.add_argument('--force', action='store_true',
+                            help='Reload even if no shapefile changed since the last load')
+        parser.add_argument('--skip-payloads', action='store_true',
+                            help="Don't rebuild the precompressed API responses (run build_payloads later)")
 
     def handle(self, *args, **options):
         from django.conf import settings
         from pathlib import Path
-        
+
         shapefile_dir = options['dir']
-        
+
         # Convert to absolute path if relative
         if not os.path.isabs(shapefile_dir):
             base_dir = Path(settings.BASE_DIR)
             shapefile_dir = str(base_dir / shapefile_dir)
-        
+
         if not os.path.exists(shapefile_dir):
             self.stdout.write(self.style.ERROR(f'Directory not found: {shapefile_dir}'))
             # Try to find the directory
@@ -38,104 +65,130 @@ class Command(BaseCommand):
                             self.stdout.write(f'    - {shp.name}')
             return
 
-        # Clear existing parcel points
-        ParcelPoint.objects.all().delete()
-        self.stdout.write('Cleared existing parcel points')
-
-        # List of variety shapefiles
-        variety_files = [
-            'Achtar.shp',
-            'Arrehane.shp', 
-            'Bandera.shp',
-            'Faiza.shp',
-            'Radia.shp'
-        ]
+        base_varieties_dir = Path(shapefile_dir)
+        years = np.array(options['years'], dtype=np.int64)
 
-        created_count = 0
-        
-        # Convert to Path object
-        if isinstance(shapefile_dir, str):
-            if os.path.isabs(shapefile_dir):
-                base_varieties_dir = Path(shapefile_dir)
-            else:
-                base_varieties_dir = Path(settings.BASE_DIR) / shapefile_dir
-        else:
-            base_varieties_dir = shapefile_dir
-        
-        for variety_file in variety_files:
-            # Try direct path first
-            file_path = base_varieties_dir / variety_file
-            
-            # If not found, search in subdirectories
-            if not file_path.exists() and base_varieties_dir.exists():
-                for subdir in base_varieties_dir.iterdir():
-                    if subdir.is_dir():
-                        potential_path = subdir / variety_file
-                        if potential_path.exists():
-                            file_path = potential_path
-                            self.stdout.write(f'Found {variety_file} in subdirectory: {subdir.name}')
-                            break
-            
-            file_path = str(file_path)
-            
-            if not os.path.exists(file_path):
-                self.stdout.write(self.style.WARNING(f'Shapefile not found: {file_path}'))
+        variety_paths = {}
+        failed = []
+        for variety_file in options['files']:
+            file_path = self.find_shapefile(base_varieties_dir, variety_file)
+            if file_path is None:
+                self.stdout.write(self.style.ERROR(f'Shapefile not found: {base_varieties_dir / variety_file}'))
+                failed.append(variety_file)
                 continue
-                
+            variety_paths[variety_file] = file_path
+
+        source = f'load_variety_shapefiles:{shapefile_dir}'
+        checksum = file_checksum(variety_paths.values(), files=list(variety_paths), years=options['years'])
+        if not options['force'] and SourceManifest.is_current(source, checksum):
+            self.stdout.write('Variety shapefiles unchanged since last load, skipping (use --force to reload)')
+            return
+
+        parcels = []
+        for variety_file, file_path in variety_paths.items():
             try:
                 self.stdout.write(f'Loading {variety_file}...')
-                
+
                 # Read shapefile
                 gdf = gpd.read_file(file_path)
-                
+
                 # Convert to WGS84 if needed
                 if gdf.crs and gdf.crs != 'EPSG:4326':
                     gdf = gdf.to_crs('EPSG:4326')
-                
-                # Simplify geometries for better performance
-                gdf['geometry'] = gdf['geometry'].simplify(tolerance=0.001)
-                
+
                 self.stdout.write(f'Loaded {len(gdf)} features from {variety_file}')
-                self.stdout.write(f'Columns: {list(gdf.columns)}')
-                
+
                 # Extract variety name from filename
-                variety_name = variety_file.replace('.shp', '')
-                
-                # Process each feature
-                for index, row in gdf.iterrows():
-                    try:
-                        # Get geometry centroid
-                        centroid = row.geometry.centroid
-                        lon = centroid.x
-                        lat = centroid.y
-                        
-                        # Check if coordinates are in Morocco range
-                        if not (-17 <= lon <= -1 and 21 <= lat <= 36):
-                            self.stdout.write(self.style.WARNING(f'Skipping point outside Morocco: {lon}, {lat}'))
-                            continue
-                        
-                        # Create parcel points for each year
-                        for year in [2019, 2020, 2021]:
-                            parcel = ParcelPoint.objects.create(
-                                x=lon,
-                                y=lat,
-                                parcel_id=f'{variety_name}_{index}_{year}',
-                                province='Unknown',  # Will be updated if we have province data
-                                variety=variety_name,
-                                year=year,
-                                area=1.0,   # Default area
-                                yield_total=0.0,  # Default yield
-                                yield_per_ha=0.0  # Default yield per ha
-                            )
-                        
-                        created_count += 3  # 3 years per point
-                        
-                    except Exception as e:
-                        self.stdout.write(self.style.WARNING(f'Error creating parcel {index} from {variety_file}: {e}'))
-                        continue
-                        
+                variety_name = Path(variety_file).stem
+                variety_id = Variety.ids_for([variety_name])[variety_name]
+                parcels.extend(self.build_parcels(gdf, variety_name, variety_id, years))
+
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'Error loading {variety_file}: {e}'))
-                continue
+                failed.append(variety_file)
+
+        # The parcels of a file that failed would be missing below and so
+        # deleted; leave the stored parcels and the manifest as they are
+        if failed:
+            self.stdout.write(self.style.ERROR(
+                f'Nothing loaded: {", ".join(failed)} could not be read'
+            ))
+            return
+
+        # Only write rows that changed; the province is derived from the
+        # boundaries afterwards, so it doesn't count as a change
+        with transaction.atomic():
+            result = sync_rows(ParcelPoint.objects.all(), ['parcel_id'], parcels, PARCEL_FIELDS,
+                               compare_fields=[f for f in PARCEL_FIELDS if f != 'province'],
+                               batch_size=options['batch_size'])
+            self.stdout.write(f'{result.created} created, {result.updated} updated, '
+                              f'{result.deleted} deleted, {result.unchanged} unchanged')
+
+            # Province comes from the polygon containing each point, in one STRtree pass
+            if result.changed_keys:
+                changed = ParcelPoint.objects.filter(parcel_id__in=[key for key, in result.changed_keys])
+                assigned, unmatched = assign_parcel_provinces(changed)
+                self.stdout.write(f'Assigned {assigned} parcel points to provinces ({unmatched} outside all provinces)')
+
+            if result.created or result.updated or result.deleted:
+                DatasetVersion.bump('parcels')
+
+            SourceManifest.record(source, checksum)
 
-        self.stdout.write(self.style.SUCCESS(f'Successfully loaded {created_count} parcel points from variety shapefiles'))
+        if result.created or result.updated or result.deleted:
+            stored = build_parcel_clusters()
+            if stored is not None:
+                self.stdout.write(f'Stored {stored} parcel clusters')
+            if not options['skip_payloads']:
+                call_command('build_payloads', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully loaded {len(parcels)} parcel points from variety shapefiles'))
+
+    def find_shapefile(self, base_dir, variety_file):
+        """Path to a variety shapefile, looking one subdirectory deep if needed"""
+        file_path = base_dir / variety_file
+        if file_path.exists():
+            return file_path
+        for subdir in base_dir.iterdir():
+            potential_path = subdir / variety_file
+            if subdir.is_dir() and potential_path.exists():
+                self.stdout.write(f'Found {variety_file} in subdirectory: {subdir.name}')
+                return potential_path
+        return None
+
+    def build_parcels(self, gdf, variety_name, variety_id, years):
+        """One unsaved ParcelPoint per feature inside Morocco and per year"""
+        # Centroids of the unsimplified geometry, for every feature at once
+        geometries = gdf.geometry.to_numpy()
+        valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        centroids = shapely.centroid(geometries[valid])
+        lon, lat = shapely.get_x(centroids), shapely.get_y(centroids)
+        indexes = gdf.index.to_numpy()[valid]
+
+        inside = in_morocco(lon, lat)
+        if (~inside).any() or (~valid).any():
+            self.stdout.write(self.style.WARNING(
+                f'Skipping {(~inside).sum()} points outside Morocco and {(~valid).sum()} empty geometries'
+            ))
+        lon, lat, indexes = lon[inside], lat[inside], indexes[inside]
+
+        # Fan out each point over the years: point-major, year-minor
+        lon = np.repeat(lon, len(years))
+        lat = np.repeat(lat, len(years))
+        indexes = np.repeat(indexes, len(years))
+        point_years = np.tile(years, int(inside.sum()))
+
+        return [
+            ParcelPoint(
+                x=x,
+                y=y,
+                parcel_id=f'{variety_name}_{index}_{year}',
+                province='Unknown',  # Set by assign_parcel_provinces
+                variety_id=variety_id,
+                year=year,
+                area=1.0,   # Default area
+                yield_total=0.0,  # Default yield
+                yield_per_ha=0.0  # Default yield per ha
+            )
+            for x, y, index, year in zip(lon.tolist(), lat.tolist(), indexes.tolist(), point_years.tolist())
+        ]
@@ -0,0 +1,53 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+import pandas as pd
+from core.models import YieldData, DatasetVersion
+from core.gaps import decompose_gaps, as_records, LEVEL_FIELDS, GAP_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Re-derive every stored yield gap from the stored yield levels'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk UPDATE')
+        parser.add_argument('--force', action='store_true',
+                            help='Rewrite the gaps of every row, not only those that differ')
+        parser.add_argument('--skip-payloads', action='store_true',
+                            help="Don't rebuild the precompressed API responses (run build_payloads later)")
+
+    def handle(self, *args, **options):
+        stored = pd.DataFrame.from_records(
+            YieldData.objects.values('id', *LEVEL_FIELDS, *GAP_FIELDS), index='id',
+            columns=['id'] + LEVEL_FIELDS + GAP_FIELDS,
+        ).astype(float)
+        if stored.empty:
+            self.stdout.write('No yield data stored')
+            return
+
+        # All gaps for all rows in one pass. Levels are stored unrounded, so
+        # the loaders' gaps are reproduced exactly and only rows that differ
+        # are written
+        gaps = decompose_gaps(stored[LEVEL_FIELDS])[GAP_FIELDS]
+        old = stored[GAP_FIELDS]
+        changed = ((gaps != old) & ~(gaps.isna() & old.isna())).any(axis=1)
+        if not options['force']:
+            gaps = gaps[changed]
+
+        updates = [
+            YieldData(id=row_id, **row)
+            for row_id, row in zip(gaps.index.tolist(), as_records(gaps))
+        ]
+        with transaction.atomic():
+            YieldData.objects.bulk_update(updates, GAP_FIELDS, batch_size=options['batch_size'])
+            if changed.any():
+                DatasetVersion.bump('yield')
+
+        if changed.any() and not options['skip_payloads']:
+            call_command('build_payloads', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed gaps for {len(stored)} rows: {int(changed.sum())} changed, '
+            f'{len(updates)} written, {len(stored) - len(updates)} skipped as unchanged'
+        ))
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_datasetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoundaryGeometry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tolerance', models.FloatField()),
+                ('geometry_json', models.TextField()),
+                ('boundary', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geometry_levels', to='core.administrativeboundary')),
+            ],
+            options={
+                'verbose_name_plural': 'Boundary Geometries',
+                'unique_together': {('boundary', 'tolerance')},
+            },
+        ),
+    ]
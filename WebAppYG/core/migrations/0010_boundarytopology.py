@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_boundarygeometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoundaryTopology',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=200)),
+                ('tolerance', models.FloatField()),
+                ('topology_json', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Boundary Topologies',
+                'unique_together': {('source', 'tolerance')},
+            },
+        ),
+    ]
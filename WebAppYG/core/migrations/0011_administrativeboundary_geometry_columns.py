@@ -0,0 +1,75 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:20
+
+import json
+from django.db import migrations, models
+
+
+def backfill_geometry_columns(apps, schema_editor):
+    """Derive the new columns from the stored (simplified) GeoJSON until the next load"""
+    from shapely.geometry import shape
+    from core.geometry import geometry_columns
+    
+    AdministrativeBoundary = apps.get_model('core', 'AdministrativeBoundary')
+    for boundary in AdministrativeBoundary.objects.exclude(geometry_json__isnull=True):
+        try:
+            columns = geometry_columns(shape(json.loads(boundary.geometry_json)))
+        except (ValueError, TypeError, KeyError):
+            continue
+        for field, value in columns.items():
+            setattr(boundary, field, value)
+        boundary.save(update_fields=list(columns))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_boundarytopology'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='area_km2',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='centroid_x',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='centroid_y',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='geometry_wkb',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='max_x',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='max_y',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='min_x',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='administrativeboundary',
+            name='min_y',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='administrativeboundary',
+            index=models.Index(fields=['min_x', 'max_x', 'min_y', 'max_y'], name='core_admini_min_x_956eef_idx'),
+        ),
+        migrations.RunPython(backfill_geometry_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_administrativeboundary_geometry_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=300, unique=True)),
+                ('checksum', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Source Manifest',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_sourcemanifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressedPayload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=300, unique=True)),
+                ('content_type', models.CharField(max_length=100)),
+                ('headers_json', models.TextField(default='{}')),
+                ('identity', models.BinaryField()),
+                ('gzip', models.BinaryField()),
+                ('brotli', models.BinaryField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Compressed Payloads',
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_parcels(apps, schema_editor):
+    """Point existing parcels at Variety rows and their province boundary, one UPDATE per name"""
+    ParcelPoint = apps.get_model('core', 'ParcelPoint')
+    Variety = apps.get_model('core', 'Variety')
+    AdministrativeBoundary = apps.get_model('core', 'AdministrativeBoundary')
+
+    names = ParcelPoint.objects.values_list('variety_name', flat=True).distinct()
+    for name in names:
+        variety, _ = Variety.objects.get_or_create(name=name)
+        ParcelPoint.objects.filter(variety_name=name).update(variety=variety)
+
+    provinces = AdministrativeBoundary.objects.filter(level='province').values_list('name', 'id')
+    for name, boundary_id in provinces:
+        ParcelPoint.objects.filter(province=name).update(boundary_id=boundary_id)
+
+
+def unlink_parcels(apps, schema_editor):
+    ParcelPoint = apps.get_model('core', 'ParcelPoint')
+    Variety = apps.get_model('core', 'Variety')
+    for variety_id, name in Variety.objects.values_list('id', 'name'):
+        ParcelPoint.objects.filter(variety_id=variety_id).update(variety_name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_compressedpayload'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='parcelpoint',
+            old_name='variety',
+            new_name='variety_name',
+        ),
+        migrations.AddField(
+            model_name='parcelpoint',
+            name='boundary',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='parcel_points', to='core.administrativeboundary'),
+        ),
+        migrations.AddField(
+            model_name='parcelpoint',
+            name='variety',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='parcel_points', to='core.variety'),
+        ),
+        migrations.RunPython(link_parcels, unlink_parcels),
+        migrations.RemoveField(
+            model_name='parcelpoint',
+            name='variety_name',
+        ),
+        migrations.AddIndex(
+            model_name='parcelpoint',
+            index=models.Index(fields=['year', 'variety', 'boundary'], name='parcel_year_variety_boundary'),
+        ),
+        migrations.AddIndex(
+            model_name='parcelpoint',
+            index=models.Index(fields=['boundary', 'year'], name='parcel_boundary_year'),
+        ),
+    ]
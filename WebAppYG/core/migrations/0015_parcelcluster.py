@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_parcelpoint_boundary_variety'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParcelCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.IntegerField()),
+                ('year', models.IntegerField(blank=True, null=True)),
+                ('cell_x', models.IntegerField()),
+                ('cell_y', models.IntegerField()),
+                ('x', models.FloatField()),
+                ('y', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('mean_yield', models.FloatField(blank=True, null=True)),
+                ('varieties_json', models.TextField(default='{}')),
+            ],
+            options={
+                'verbose_name_plural': 'Parcel Clusters',
+                'indexes': [models.Index(fields=['zoom', 'year', 'x', 'y'], name='parcel_cluster_zoom_year_xy')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_parcelcluster'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='parcelpoint',
+            index=models.Index(fields=['x', 'y'], name='parcel_xy'),
+        ),
+    ]
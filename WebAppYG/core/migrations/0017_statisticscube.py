@@ -0,0 +1,39 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_parcelpoint_xy_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatisticsCube',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('yield', 'Yield Statistics'), ('gap', 'Gap Statistics')], max_length=10)),
+                ('variety', models.CharField(max_length=20)),
+                ('province', models.CharField(max_length=100)),
+                ('year', models.CharField(max_length=10)),
+                ('category', models.CharField(max_length=100)),
+                ('count', models.IntegerField()),
+                ('mean', models.FloatField()),
+                ('std', models.FloatField(blank=True, null=True)),
+                ('min', models.FloatField(blank=True, null=True)),
+                ('q25', models.FloatField(blank=True, null=True)),
+                ('median', models.FloatField(blank=True, null=True)),
+                ('q75', models.FloatField(blank=True, null=True)),
+                ('max', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Statistics Cube',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='statisticscube',
+            constraint=models.UniqueConstraint(fields=('source', 'variety', 'province', 'year', 'category'), name='statistics_cube_cell'),
+        ),
+    ]
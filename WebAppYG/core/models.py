@@ -1,14 +1,50 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
 class AdministrativeBoundary(models.Model):
     name = models.CharField(max_length=200)
     level = models.CharField(max_length=50)  # commune, province, region
     code = models.CharField(max_length=20, unique=True)
     geometry_json = models.TextField(blank=True, null=True)  # Store GeoJSON as text
+    geometry_wkb = models.BinaryField(blank=True, null=True)  # Unsimplified geometry as WKB
+    # Bounding box, centroid and area computed at load time (see core.geometry.geometry_columns)
+    min_x = models.FloatField(null=True, blank=True)
+    min_y = models.FloatField(null=True, blank=True)
+    max_x = models.FloatField(null=True, blank=True)
+    max_y = models.FloatField(null=True, blank=True)
+    centroid_x = models.FloatField(null=True, blank=True)  # longitude
+    centroid_y = models.FloatField(null=True, blank=True)  # latitude
+    area_km2 = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         verbose_name_plural = "Administrative Boundaries"
+        indexes = [
+            models.Index(fields=['min_x', 'max_x', 'min_y', 'max_y']),
+        ]
+
+class BoundaryGeometry(models.Model):
+    """Pre-simplified boundary geometry for one level of detail"""
+    boundary = models.ForeignKey(AdministrativeBoundary, on_delete=models.CASCADE,
+                                 related_name='geometry_levels')
+    tolerance = models.FloatField()  # Simplification tolerance in degrees
+    geometry_json = models.TextField()  # GeoJSON as text
+    
+    class Meta:
+        verbose_name_plural = "Boundary Geometries"
+        unique_together = ['boundary', 'tolerance']
+
+class BoundaryTopology(models.Model):
+    """Precomputed TopoJSON for the boundaries of one shapefile at one level of detail"""
+    source = models.CharField(max_length=200)  # Shapefile name
+    tolerance = models.FloatField()  # Simplification tolerance in degrees
+    topology_json = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Boundary Topologies"
+        unique_together = ['source', 'tolerance']
 
 class Crop(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -47,8 +83,11 @@ class YieldData(models.Model):
 
 class ParcelPoint(models.Model):
     parcel_id = models.CharField(max_length=100, unique=True)
-    province = models.CharField(max_length=100)
-    variety = models.CharField(max_length=100)
+    province = models.CharField(max_length=100)  # Name of the boundary, or as given in the source
+    boundary = models.ForeignKey(AdministrativeBoundary, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='parcel_points')  # Set by assign_parcel_provinces
+    variety = models.ForeignKey('Variety', on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='parcel_points')
     year = models.IntegerField()
     yield_per_ha = models.FloatField(null=True, blank=True)
     yield_total = models.FloatField(null=True, blank=True)
@@ -59,6 +98,32 @@ class ParcelPoint(models.Model):
     
     class Meta:
         verbose_name_plural = "Parcel Points"
+        indexes = [
+            # Year / variety / province filters of the parcel API and exports
+            models.Index(fields=['year', 'variety', 'boundary'], name='parcel_year_variety_boundary'),
+            models.Index(fields=['boundary', 'year'], name='parcel_boundary_year'),
+            # ?bbox= viewport filter
+            models.Index(fields=['x', 'y'], name='parcel_xy'),
+        ]
+
+
+class ParcelCluster(models.Model):
+    """Grid cluster of parcel points at one map zoom, built by core.clusters"""
+    zoom = models.IntegerField()
+    year = models.IntegerField(null=True, blank=True)  # None = all years
+    cell_x = models.IntegerField()  # Grid cell in Web Mercator pixels at this zoom
+    cell_y = models.IntegerField()
+    x = models.FloatField()  # Mean longitude of the members
+    y = models.FloatField()  # Mean latitude of the members
+    count = models.IntegerField()
+    mean_yield = models.FloatField(null=True, blank=True)  # Mean yield_per_ha (t/ha)
+    varieties_json = models.TextField(default='{}')  # {variety name: parcel count}
+    
+    class Meta:
+        verbose_name_plural = "Parcel Clusters"
+        indexes = [
+            models.Index(fields=['zoom', 'year', 'x', 'y'], name='parcel_cluster_zoom_year_xy'),
+        ]
 
 
 class Variety(models.Model):
@@ -69,6 +134,13 @@ class Variety(models.Model):
     def __str__(self):
         return self.name
     
+    @classmethod
+    def ids_for(cls, names):
+        """{name: id} for the given variety names, creating missing varieties"""
+        names = set(names)
+        cls.objects.bulk_create([cls(name=name) for name in names], ignore_conflicts=True)
+        return dict(cls.objects.filter(name__in=names).values_list('name', 'id'))
+    
     class Meta:
         verbose_name_plural = "Varieties"
 
@@ -189,4 +261,105 @@ class GapStatistics(models.Model):
             parts.append(self.province)
         if self.year:
             parts.append(str(self.year))
-        return ' - '.join(parts) if parts else 'Overall Gap Statistics'
\ No newline at end of file
+        return ' - '.join(parts) if parts else 'Overall Gap Statistics'
+
+
+class StatisticsCube(models.Model):
+    """
+    YieldStatistics / GapStatistics pooled over every combination of
+    variety, province and year, built by core.cube. '*' in a dimension
+    means all of its values.
+    """
+    SOURCE_CHOICES = [('yield', 'Yield Statistics'), ('gap', 'Gap Statistics')]
+    ALL = '*'
+    
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    variety = models.CharField(max_length=20)  # Variety id
+    province = models.CharField(max_length=100)
+    year = models.CharField(max_length=10)
+    category = models.CharField(max_length=100)  # Scenario or gap type name
+    
+    # Pooled measures (t/ha); quantiles only for cells taken from a single row
+    count = models.IntegerField()
+    mean = models.FloatField()
+    std = models.FloatField(null=True, blank=True)
+    min = models.FloatField(null=True, blank=True)
+    q25 = models.FloatField(null=True, blank=True)
+    median = models.FloatField(null=True, blank=True)
+    q75 = models.FloatField(null=True, blank=True)
+    max = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name_plural = "Statistics Cube"
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'variety', 'province', 'year', 'category'],
+                                    name='statistics_cube_cell'),
+        ]
+    
+    def __str__(self):
+        return f'{self.source}: {self.variety}/{self.province}/{self.year}/{self.category}'
+
+
+class DatasetVersion(models.Model):
+    """Version counter bumped each time a loader command rewrites a dataset"""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Dataset Versions"
+    
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+    
+    @classmethod
+    def current(cls, name):
+        """Return the current version of a dataset (0 if never loaded)"""
+        version = cls.objects.filter(name=name).values_list('version', flat=True).first()
+        return version or 0
+    
+    @classmethod
+    def bump(cls, name):
+        """Increment the version of a dataset and return the new value"""
+        cls.objects.get_or_create(name=name)
+        cls.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now())
+        return cls.current(name)
+
+
+class SourceManifest(models.Model):
+    """Checksum of the input files (and options) a loader command last loaded"""
+    source = models.CharField(max_length=300, unique=True)  # '<command>:<path>'
+    checksum = models.CharField(max_length=64)  # SHA-256 hex digest
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Source Manifest"
+    
+    def __str__(self):
+        return f'{self.source} ({self.checksum[:12]})'
+    
+    @classmethod
+    def is_current(cls, source, checksum):
+        """True if source was last loaded from exactly this checksum"""
+        return cls.objects.filter(source=source, checksum=checksum).exists()
+    
+    @classmethod
+    def record(cls, source, checksum):
+        cls.objects.update_or_create(source=source, defaults={'checksum': checksum})
+
+
+class CompressedPayload(models.Model):
+    """Common API response rendered and compressed once per data load"""
+    key = models.CharField(max_length=300, unique=True)  # core.cache.cache_key of the request
+    content_type = models.CharField(max_length=100)
+    headers_json = models.TextField(default='{}')  # Extra response headers
+    identity = models.BinaryField()
+    gzip = models.BinaryField()
+    brotli = models.BinaryField(null=True, blank=True)  # None when brotli isn't installed
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name_plural = "Compressed Payloads"
+    
+    def __str__(self):
+        return self.key
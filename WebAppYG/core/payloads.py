@@ -0,0 +1,188 @@
+"""
+Precompressed payloads for the responses every map visit requests.
+
+Loader commands render the common responses (crop and year lists,
+boundary geometry at every level of detail, the value-only choropleth of
+each crop / year / metric) once, right after the data
+changes, and store them as identity, gzip and - when the brotli package
+is installed - brotli bodies. cached_view serves the stored variant that
+matches Accept-Encoding, so requests never spend CPU on compression.
+
+Payloads are keyed by core.cache.cache_key, which includes the dataset
+versions, so a payload of older data is never served; build_payloads()
+drops them when it stores the new ones.
+"""
+import gzip
+import json
+from dataclasses import dataclass
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from .models import CompressedPayload
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Headers set by the views that are stored with the body
+STORED_HEADERS = ('Cache-Control', 'X-Boundaries-Version')
+
+
+@dataclass
+class Payload:
+    """A stored response with its encoded bodies"""
+    content_type: str
+    headers: dict
+    identity: bytes
+    gzip: bytes
+    brotli: bytes = None
+
+    @classmethod
+    def from_model(cls, stored):
+        return cls(
+            content_type=stored.content_type,
+            headers=json.loads(stored.headers_json),
+            identity=bytes(stored.identity),
+            gzip=bytes(stored.gzip),
+            brotli=bytes(stored.brotli) if stored.brotli is not None else None,
+        )
+
+    def response(self, request):
+        """HttpResponse with the best body the client accepts"""
+        encoding = preferred_encoding(request, self)
+        body = {'br': self.brotli, 'gzip': self.gzip}.get(encoding, self.identity)
+        response = HttpResponse(body, content_type=self.content_type)
+        for name, value in self.headers.items():
+            response[name] = value
+        if encoding:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+
+def accepted_encodings(request):
+    """Content codings of Accept-Encoding with a non-zero q-value"""
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def preferred_encoding(request, payload):
+    """'br', 'gzip' or None (identity) for a payload and request"""
+    accepted = accepted_encodings(request)
+    if payload.brotli is not None and ({'br', '*'} & accepted):
+        return 'br'
+    if {'gzip', '*'} & accepted:
+        return 'gzip'
+    return None
+
+
+def load_payload(key):
+    """Stored Payload for a cache key, or None"""
+    stored = CompressedPayload.objects.filter(key=key).first()
+    return Payload.from_model(stored) if stored is not None else None
+
+
+def compress(body):
+    """(gzip bytes, brotli bytes or None) for a response body"""
+    compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if brotli is None:
+        return compressed, None
+    return compressed, brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def common_requests():
+    """(path, params) of every response the map requests on a typical visit"""
+    from .geometry import TOLERANCES
+    from .models import Crop, DatasetVersion, YieldData
+    from .views import YIELD_METRICS
+
+    requests = [('/api/crops/', {}), ('/api/years/', {}), ('/api/facets/', {}), ('/api/boundaries/', {})]
+
+    # The map follows the boundary-geometry redirect to the versioned URL
+    version = DatasetVersion.current('boundaries')
+    for tolerance in TOLERANCES:
+        for output_format in ('topojson', None):
+            params = {'tolerance': str(tolerance), 'v': str(version)}
+            if output_format:
+                params['format'] = output_format
+            requests.append(('/api/boundary-geometry/', params))
+
+    # Value-only choropleths; the map drops an empty crop or year
+    crops = [None] + list(Crop.objects.order_by('name').values_list('name', flat=True))
+    years = [None] + list(YieldData.objects.values_list('year', flat=True).distinct().order_by('year'))
+    for crop in crops:
+        for year in years:
+            for metric in YIELD_METRICS:
+                params = {'metric': metric, 'geometry': '0'}
+                if crop:
+                    params['crop'] = crop
+                if year:
+                    params['year'] = str(year)
+                requests.append(('/api/yield-data/', params))
+                # Legend and summary statistics of the same selection
+                stats_params = {key: value for key, value in params.items() if key != 'geometry'}
+                requests.append(('/api/yield-data/stats/', stats_params))
+    return requests
+
+
+def build_payloads(force=False):
+    """
+    Render, compress and store every common response for the current
+    data, replacing older payloads; returns the number stored, or None
+    when the stored payloads already match the current versions.
+    """
+    from django.db import transaction
+    from django.test import RequestFactory
+    from django.urls import resolve
+    from .cache import cache_key
+
+    factory = RequestFactory()
+    pending = []
+    for path, params in common_requests():
+        request = factory.get(path, params)
+        match = resolve(path)
+        datasets = getattr(match.func, 'datasets', None)
+        if datasets is not None:
+            pending.append((cache_key(request, datasets), request, match))
+
+    stored_keys = set(CompressedPayload.objects.values_list('key', flat=True))
+    if not force and stored_keys == {key for key, _, _ in pending}:
+        return None
+
+    payloads = []
+    for key, request, match in pending:
+        # The undecorated view, so nothing is read from or written to the cache
+        view = getattr(match.func, '__wrapped__', match.func)
+        response = view(request, *match.args, **match.kwargs)
+        if response.status_code != 200 or response.streaming:
+            continue
+        body = response.content
+        compressed_gzip, compressed_brotli = compress(body)
+        headers = {name: response[name] for name in STORED_HEADERS if response.has_header(name)}
+        payloads.append(CompressedPayload(
+            key=key,
+            content_type=response['Content-Type'],
+            headers_json=json.dumps(headers),
+            identity=body,
+            gzip=compressed_gzip,
+            brotli=compressed_brotli,
+        ))
+
+    with transaction.atomic():
+        CompressedPayload.objects.all().delete()
+        CompressedPayload.objects.bulk_create(payloads, batch_size=100)
+    return len(payloads)
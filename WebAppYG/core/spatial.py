@@ -0,0 +1,93 @@
+"""
+Bulk point-in-polygon assignment of parcel points to provinces.
+
+Province polygons are read from AdministrativeBoundary.geometry_wkb and
+the points are indexed in a shapely STRtree, so all points are located in
+a single vectorized query against prepared polygons instead of a Python
+loop over every point and polygon.
+"""
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+from django.db import transaction
+from .models import AdministrativeBoundary, ParcelPoint
+
+UPDATE_BATCH_SIZE = 5000
+
+# Morocco is roughly -17° to -1° longitude, 21° to 36° latitude
+MOROCCO_LON = (-17, -1)
+MOROCCO_LAT = (21, 36)
+
+
+def in_morocco(lon, lat):
+    """Vectorized Morocco range check on lon/lat arrays"""
+    return (
+        (lon >= MOROCCO_LON[0]) & (lon <= MOROCCO_LON[1]) &
+        (lat >= MOROCCO_LAT[0]) & (lat <= MOROCCO_LAT[1])
+    )
+
+
+def province_boundaries(level='province'):
+    """[(id, name, geometry, area_km2)] for boundaries with stored WKB"""
+    boundaries = []
+    for boundary_id, name, wkb, area in AdministrativeBoundary.objects.filter(
+        level=level, geometry_wkb__isnull=False
+    ).values_list('id', 'name', 'geometry_wkb', 'area_km2'):
+        boundaries.append((boundary_id, name, shapely.from_wkb(bytes(wkb)), area or 0.0))
+    return boundaries
+
+
+def locate_points(x, y, geometries, areas):
+    """
+    Index into geometries of the polygon containing each point, -1 if none.
+
+    When polygons overlap (e.g. a country outline loaded at province level)
+    the smallest one by area wins.
+    """
+    points = shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    located = np.full(len(points), -1, dtype=np.int64)
+    if not len(points) or not geometries:
+        return located
+
+    # Index the points and query with prepared polygons, so each point test
+    # is a fast lookup even against complex outlines
+    geometries = np.asarray(geometries, dtype=object)
+    shapely.prepare(geometries)
+    tree = STRtree(points)
+    geom_idx, point_idx = tree.query(geometries, predicate='intersects')
+    if len(point_idx):
+        order = np.lexsort((np.asarray(areas, dtype=float)[geom_idx], point_idx))
+        point_idx, geom_idx = point_idx[order], geom_idx[order]
+        _, first = np.unique(point_idx, return_index=True)
+        located[point_idx[first]] = geom_idx[first]
+    return located
+
+
+def assign_parcel_provinces(queryset=None, level='province'):
+    """
+    Set ParcelPoint.boundary and .province from the boundary containing each point.
+
+    Points outside every boundary keep their current value. Returns
+    (assigned, unmatched) counts.
+    """
+    if queryset is None:
+        queryset = ParcelPoint.objects.all()
+    rows = np.array(list(queryset.values_list('id', 'x', 'y')), dtype=float).reshape(-1, 3)
+    boundaries = province_boundaries(level)
+    located = locate_points(rows[:, 1], rows[:, 2],
+                            [geometry for _, _, geometry, _ in boundaries],
+                            [area for _, _, _, area in boundaries])
+    ids = rows[:, 0].astype(np.int64)
+
+    # One UPDATE per province (in batches) instead of one per point
+    with transaction.atomic():
+        for index in np.unique(located[located >= 0]):
+            boundary_id, name = boundaries[index][:2]
+            matched = ids[located == index].tolist()
+            for start in range(0, len(matched), UPDATE_BATCH_SIZE):
+                ParcelPoint.objects.filter(
+                    id__in=matched[start:start + UPDATE_BATCH_SIZE]
+                ).update(boundary_id=boundary_id, province=name)
+
+    assigned = int(np.count_nonzero(located >= 0))
+    return assigned, len(ids) - assigned
@@ -1,39 +1,68 @@
 from celery import shared_task
-from django.contrib.gis.geos import GEOSGeometry
+import json
 import pandas as pd
-from .models import AdministrativeBoundary, Crop, YieldData
+import shapely
+from shapely.geometry import mapping
+from django.db import transaction
+from .models import AdministrativeBoundary, Crop, YieldData, DatasetVersion
+from .etl import sync_rows
+from .gaps import decompose_gaps, as_records, LEVEL_FIELDS, GAP_FIELDS
+from .geometry import geometry_columns
+from .payloads import build_payloads
+
+
+def _parse_geometry(value):
+    """Shapely geometry from a GeoJSON or WKT string, None if empty"""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    return shapely.from_geojson(value) if value.startswith('{') else shapely.from_wkt(value)
+
 
 @shared_task
 def process_yield_data(csv_file_path):
     """Process yield data from CSV file"""
     df = pd.read_csv(csv_file_path)
-    
-    for _, row in df.iterrows():
-        # Process each row
-        boundary, created = AdministrativeBoundary.objects.get_or_create(
+
+    # Create boundaries that don't exist yet, once per code
+    boundaries = AdministrativeBoundary.objects.in_bulk(df['boundary_code'].astype(str).unique(), field_name='code')
+    new_rows = df.drop_duplicates('boundary_code')
+    new_rows = new_rows[~new_rows['boundary_code'].astype(str).isin(boundaries)]
+    for row in new_rows.to_dict('records'):
+        geometry = _parse_geometry(row.get('geometry'))
+        boundaries[str(row['boundary_code'])] = AdministrativeBoundary.objects.create(
             code=row['boundary_code'],
-            defaults={
-                'name': row['boundary_name'],
-                'level': row['boundary_level'],
-                'geometry': GEOSGeometry(row['geometry'])
-            }
-        )
-        
-        crop, created = Crop.objects.get_or_create(
-            name=row['crop_name']
+            name=row['boundary_name'],
+            level=row['boundary_level'],
+            geometry_json=json.dumps(mapping(geometry)) if geometry is not None else None,
+            **(geometry_columns(geometry) if geometry is not None else {}),
         )
-        
-        yield_data, created = YieldData.objects.get_or_create(
-            boundary=boundary,
-            crop=crop,
-            year=row['year'],
-            defaults={
-                'actual_yield': row.get('actual_yield'),
-                'potential_yield': row.get('potential_yield'),
-                'yield_gap': row.get('yield_gap'),
-                'yield_gap_percent': row.get('yield_gap_percent'),
-                'data_source': row.get('data_source', 'CSV Import')
-            }
+
+    crops = {name: Crop.objects.get_or_create(name=name)[0] for name in df['crop_name'].unique()}
+
+    # Derive gaps from whichever yield levels the file has; gaps given in
+    # the file are only used where the levels can't produce them
+    values = decompose_gaps(df[[field for field in LEVEL_FIELDS if field in df]])
+    given = df.reindex(columns=GAP_FIELDS)
+    values[GAP_FIELDS] = values[GAP_FIELDS].fillna(given)
+
+    data_source = df['data_source'] if 'data_source' in df else pd.Series('CSV Import', index=df.index)
+    records = [
+        YieldData(boundary=boundaries[str(code)], crop=crops[crop], year=int(year),
+                  data_source=source if isinstance(source, str) else 'CSV Import', **row)
+        for code, crop, year, source, row in zip(
+            df['boundary_code'], df['crop_name'], df['year'], data_source, as_records(values)
         )
-    
-    return f"Processed {len(df)} records"
\ No newline at end of file
+    ]
+
+    with transaction.atomic():
+        result = sync_rows(YieldData.objects.all(), ['boundary_id', 'crop_id', 'year'], records,
+                           LEVEL_FIELDS + GAP_FIELDS + ['data_source'], delete_missing=False)
+        if result.created or result.updated:
+            DatasetVersion.bump('yield')
+
+    if result.created or result.updated:
+        build_payloads()
+
+    return (f"Processed {len(df)} records: {result.created} created, "
+            f"{result.updated} updated, {result.unchanged} unchanged")
@@ -1,3 +1,1053 @@
-from django.test import TestCase
+import gzip
+import json
+import statistics
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from shapely.geometry import box, mapping
+from .geometry import DEFAULT_TOLERANCE, TOLERANCES, geometry_columns, simplify_levels, tolerance_for_zoom
+from . import benchmark, binary, classify, columnar
+from .cache import cache_key
+from .payloads import build_payloads
+from .clusters import build_parcel_clusters
+from .cube import build_statistics_cube
+from .etl import sync_rows
+from .gaps import as_records, decompose_gaps
+from .models import (
+    AdministrativeBoundary, BoundaryGeometry, BoundaryTopology, Crop, DatasetVersion, ParcelPoint, SourceManifest,
+    Scenario, StatisticsCube, Variety, YieldData, YieldStatistics
+)
+from .spatial import assign_parcel_provinces
+from .topojson import build_topology
 
-# Create your tests here.
+
+def make_boundary(code, name, bounds, level='province'):
+    """Rectangular boundary stored the way load_shapefiles stores it"""
+    geometry = box(*bounds)
+    levels = simplify_levels(geometry)
+    boundary = AdministrativeBoundary.objects.create(
+        code=code, name=name, level=level, geometry_json=levels[DEFAULT_TOLERANCE], **geometry_columns(geometry)
+    )
+    BoundaryGeometry.objects.bulk_create([
+        BoundaryGeometry(boundary=boundary, tolerance=tolerance, geometry_json=level_json)
+        for tolerance, level_json in levels.items()
+    ])
+    return boundary
+
+
+def write_shapefile(path, geometries, **columns):
+    gpd.GeoDataFrame(columns, geometry=list(geometries), crs='EPSG:4326').to_file(path)
+
+
+def make_topologies(source='test'):
+    """Shared-arc TopoJSON of every stored boundary at every level of detail"""
+    features = [
+        (code, box(min_x, min_y, max_x, max_y))
+        for code, min_x, min_y, max_x, max_y in AdministrativeBoundary.objects.values_list(
+            'code', 'min_x', 'min_y', 'max_x', 'max_y'
+        )
+    ]
+    for tolerance in TOLERANCES:
+        BoundaryTopology.objects.update_or_create(
+            source=source, tolerance=tolerance,
+            defaults={'topology_json': json.dumps(build_topology(features, tolerance))},
+        )
+
+
+class TempDirMixin:
+    def make_temp_dir(self):
+        path = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Runs a test between migrate_from and migrate_to of the core app"""
+    migrate_from = None
+    migrate_to = None
+
+    def _migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('core', target)])
+        return executor.loader.project_state([('core', target)]).apps
+
+    def setUp(self):
+        self.old_apps = self._migrate(self.migrate_from)
+        self.addCleanup(call_command, 'migrate', verbosity=0)
+
+    def migrate(self):
+        return self._migrate(self.migrate_to)
+
+
+class MapDataTestCase(TestCase):
+    """
+    Two provinces with wheat yields for 2020, 2021 and the Average (9999)
+    row. The API cache is cleared before every test.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.north = make_boundary('1', 'NORTH', (-6.0, 34.0, -5.0, 35.0))
+        cls.south = make_boundary('2', 'SOUTH', (-8.0, 31.0, -7.0, 32.0))
+        make_topologies()
+        cls.wheat = Crop.objects.create(name='wheat')
+        rows = [
+            (cls.north, 2020, 2.0, 6.0, 4.0),
+            (cls.north, 2021, 3.0, 6.5, 4.5),
+            (cls.north, 9999, 2.5, 6.25, 4.25),
+            (cls.south, 2020, 1.0, 5.0, 2.0),
+            (cls.south, 9999, 1.0, 5.0, 2.0),
+        ]
+        YieldData.objects.bulk_create([
+            YieldData(
+                boundary=boundary, crop=cls.wheat, year=year, actual_yield=actual,
+                potential_yield=potential, water_limited_yield=water_limited,
+                yield_gap=potential - actual, data_source='test',
+            )
+            for boundary, year, actual, potential, water_limited in rows
+        ])
+        for name in ('boundaries', 'yield'):
+            DatasetVersion.bump(name)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertBadRequest(self, path, params):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 400)
+        return response
+
+
+class ParcelDataTestCase(MapDataTestCase):
+    """
+    MapDataTestCase plus six parcel points: four Achtar and one Radia in
+    NORTH, one Achtar in SOUTH; all 2020 but one NORTH Achtar in 2021.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.achtar = Variety.objects.create(name='Achtar')
+        cls.radia = Variety.objects.create(name='Radia')
+        rows = [
+            ('n1', cls.north, cls.achtar, 2020, 2.0, -5.9, 34.1),
+            ('n2', cls.north, cls.achtar, 2020, 3.0, -5.5, 34.5),
+            ('n3', cls.north, cls.achtar, 2020, 4.0, -5.1, 34.9),
+            ('n4', cls.north, cls.radia, 2020, 5.0, -5.4, 34.6),
+            ('n5', cls.north, cls.achtar, 2021, 3.5, -5.6, 34.4),
+            ('s1', cls.south, cls.achtar, 2020, 1.0, -7.5, 31.5),
+        ]
+        ParcelPoint.objects.bulk_create([
+            ParcelPoint(
+                parcel_id=parcel_id, province=boundary.name, boundary=boundary, variety=variety, year=year,
+                yield_per_ha=value, yield_total=value, area=1.0, x=x, y=y,
+            )
+            for parcel_id, boundary, variety, year, value, x, y in rows
+        ])
+        DatasetVersion.bump('parcels')
+
+    def parcel_ids(self, rows):
+        return sorted(row['parcel_id'] for row in rows)
+
+
+class YieldDataTests(MapDataTestCase):
+    def test_values_without_geometry(self):
+        response = self.client.get('/api/yield-data/', {'metric': 'yield_gap', 'geometry': '0', 'year': '2020'})
+        self.assertEqual(response.status_code, 200)
+        rows = sorted(response.json(), key=lambda row: row['boundary_code'])
+        self.assertEqual([row['boundary_code'] for row in rows], ['1', '2'])
+        self.assertNotIn('geometry', rows[0])
+        self.assertEqual([row['metric_value'] for row in rows], [4.0, 4.0])
+        self.assertEqual(response['X-Boundaries-Version'], '1')
+
+    def test_values_with_geometry(self):
+        response = self.client.get('/api/yield-data/', {'year': '2021'})
+        rows = response.json()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(json.loads(rows[0]['geometry'])['type'], 'Polygon')
+
+
+class BoundaryGeometryTests(MapDataTestCase):
+    def test_redirects_to_versioned_url(self):
+        response = self.client.get('/api/boundary-geometry/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('v=1', response['Location'])
+        self.assertIn(f'tolerance={DEFAULT_TOLERANCE}', response['Location'])
+
+    def test_versioned_collection_is_immutable(self):
+        response = self.client.get('/api/boundary-geometry/', {'v': '1', 'tolerance': str(DEFAULT_TOLERANCE)})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        collection = json.loads(response.content)
+        self.assertEqual(collection['version'], 1)
+        self.assertEqual(sorted(feature['id'] for feature in collection['features']), ['1', '2'])
+
+    def test_boundaries_without_geometry_are_left_out(self):
+        AdministrativeBoundary.objects.create(code='3', name='EMPTY', level='province', geometry_json='')
+        AdministrativeBoundary.objects.create(code='4', name='MISSING', level='province')
+        response = self.client.get('/api/boundary-geometry/', {'v': '1', 'tolerance': str(DEFAULT_TOLERANCE)})
+        collection = json.loads(response.content)
+        self.assertEqual(sorted(feature['id'] for feature in collection['features']), ['1', '2'])
+
+    def test_stale_version_redirects(self):
+        response = self.client.get('/api/boundary-geometry/', {'v': '0', 'tolerance': str(DEFAULT_TOLERANCE)})
+        self.assertEqual(response.status_code, 302)
+
+
+class LevelOfDetailTests(MapDataTestCase):
+    def test_zoom_selects_level(self):
+        response = self.client.get('/api/boundaries/', {'zoom': '3'})
+        self.assertEqual(response.status_code, 200)
+        north = next(item for item in response.json() if item['code'] == '1')
+        stored = BoundaryGeometry.objects.get(boundary=self.north, tolerance=tolerance_for_zoom(3))
+        self.assertEqual(north['geometry_json'], stored.geometry_json)
+
+    def test_zoom_redirects_to_tolerance(self):
+        response = self.client.get('/api/boundary-geometry/', {'zoom': '12', 'v': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(f'tolerance={tolerance_for_zoom(12)}', response['Location'])
+        self.assertNotIn('zoom', response['Location'])
+
+    def test_invalid_zoom_or_tolerance(self):
+        for path in ('/api/yield-data/', '/api/boundaries/', '/api/boundary-geometry/'):
+            self.assertBadRequest(path, {'zoom': 'abc'})
+            self.assertBadRequest(path, {'tolerance': 'x'})
+        self.assertBadRequest('/api/boundaries/', {'tolerance': 'nan'})
+
+
+class VectorTileTests(TempDirMixin, MapDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tile_dir = self.make_temp_dir()
+        settings_override = override_settings(TILE_CACHE_DIR=self.tile_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_yield_layer_filters_year(self):
+        response = self.client.get('/api/tiles/yield/0/0/0.pbf', {'year': '2021'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'NORTH', response.content)
+        self.assertNotIn(b'SOUTH', response.content)
+        self.assertTrue((self.tile_dir / 'b1-y1' / 'yield' / 'all-2021' / '0' / '0' / '0.pbf').exists())
+
+    def test_invalid_year(self):
+        self.assertBadRequest('/api/tiles/yield/0/0/0.pbf', {'year': 'abc'})
+
+    def test_new_version_keeps_concurrently_created_directory(self):
+        old_dir = self.tile_dir / 'b0-y0'
+        old_dir.mkdir()
+        # Another worker creates the current version's directory after this one checked for it
+        version_dir = self.tile_dir / 'b1-y1'
+        other_tile = version_dir / 'boundaries' / 'all-all' / '1' / '0' / '0.pbf'
+        other_tile.parent.mkdir(parents=True)
+        other_tile.write_bytes(b'tile')
+        exists = Path.exists
+        with mock.patch.object(Path, 'exists', lambda path: path != version_dir and exists(path)):
+            response = self.client.get('/api/tiles/boundaries/0/0/0.pbf')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(old_dir.exists())
+        self.assertTrue(other_tile.exists())
+        self.assertTrue((version_dir / 'boundaries' / 'all-all' / '0' / '0' / '0.pbf').exists())
+
+
+class TopologyTests(MapDataTestCase):
+    def test_shared_border_is_one_arc(self):
+        topology = build_topology([('a', box(0, 0, 1, 1)), ('b', box(1, 0, 2, 1))], DEFAULT_TOLERANCE)
+        self.assertEqual(len(topology['arcs']), 3)
+        first, second = topology['objects']['boundaries']['geometries']
+        # The second square walks the shared arc backwards (~index)
+        self.assertIn(~first['arcs'][0][0], second['arcs'][0])
+
+    def test_yield_data_topology_carries_values(self):
+        response = self.client.get('/api/yield-data/', {'format': 'topojson', 'year': '2020'})
+        self.assertEqual(response.status_code, 200)
+        topology = response.json()
+        self.assertEqual(topology['type'], 'Topology')
+        geometries = topology['objects']['boundaries']['geometries']
+        values = {geometry['id']: geometry['properties']['actual_yield'] for geometry in geometries}
+        self.assertEqual(values, {'1': 2.0, '2': 1.0})
+
+    def test_boundaries_topology_honours_bbox(self):
+        response = self.client.get('/api/boundaries/', {'format': 'topojson', 'bbox': '-6.5,33.5,-4.5,35.5'})
+        geometries = response.json()['objects']['boundaries']['geometries']
+        self.assertEqual([geometry['id'] for geometry in geometries], ['1'])
+
+
+class GeometryColumnTests(MapDataTestCase):
+    def test_boundaries_carry_extent(self):
+        response = self.client.get('/api/boundaries/')
+        north = next(item for item in response.json() if item['code'] == '1')
+        self.assertEqual(north['bbox'], [-6.0, 34.0, -5.0, 35.0])
+        self.assertEqual(north['centroid'], [-5.5, 34.5])
+        # One degree square at ~34.5°N is roughly 111 km x 92 km
+        self.assertAlmostEqual(north['area_km2'], 10170, delta=200)
+
+    def test_bbox_filter(self):
+        response = self.client.get('/api/yield-data/', {'geometry': '0', 'bbox': '-8.5,30.5,-7.5,31.5'})
+        self.assertEqual({row['boundary_code'] for row in response.json()}, {'2'})
+
+    def test_malformed_bbox(self):
+        self.assertBadRequest('/api/boundaries/', {'bbox': '1,2,3'})
+
+
+class BackfillGeometryColumnsMigrationTests(MigrationTestCase):
+    migrate_from = '0010_boundarytopology'
+    migrate_to = '0011_administrativeboundary_geometry_columns'
+
+    def test_columns_derived_from_geojson(self):
+        Boundary = self.old_apps.get_model('core', 'AdministrativeBoundary')
+        Boundary.objects.create(code='1', name='NORTH', level='province',
+                                geometry_json=json.dumps(mapping(box(-6.0, 34.0, -5.0, 35.0))))
+        Boundary.objects.create(code='2', name='EMPTY', level='province')
+
+        Boundary = self.migrate().get_model('core', 'AdministrativeBoundary')
+        north = Boundary.objects.get(code='1')
+        self.assertEqual((north.min_x, north.min_y, north.max_x, north.max_y), (-6.0, 34.0, -5.0, 35.0))
+        self.assertEqual((north.centroid_x, north.centroid_y), (-5.5, 34.5))
+        self.assertEqual(bytes(north.geometry_wkb), box(-6.0, 34.0, -5.0, 35.0).wkb)
+        self.assertIsNone(Boundary.objects.get(code='2').min_x)
+
+
+class LinkParcelsMigrationTests(MigrationTestCase):
+    migrate_from = '0013_compressedpayload'
+    migrate_to = '0014_parcelpoint_boundary_variety'
+
+    def test_variety_names_and_provinces_become_foreign_keys(self):
+        Boundary = self.old_apps.get_model('core', 'AdministrativeBoundary')
+        Parcel = self.old_apps.get_model('core', 'ParcelPoint')
+        Boundary.objects.create(code='1', name='NORTH', level='province')
+        Boundary.objects.create(code='11', name='NORTH', level='commune')
+        for parcel_id, province, variety in (('a', 'NORTH', 'Achtar'), ('b', 'NORTH', 'Radia'),
+                                             ('c', 'ELSEWHERE', 'Achtar')):
+            Parcel.objects.create(parcel_id=parcel_id, province=province, variety=variety, year=2020, x=0, y=0)
+
+        apps = self.migrate()
+        Parcel = apps.get_model('core', 'ParcelPoint')
+        linked = {
+            parcel_id: (variety, code)
+            for parcel_id, variety, code in Parcel.objects.values_list('parcel_id', 'variety__name', 'boundary__code')
+        }
+        self.assertEqual(linked, {'a': ('Achtar', '1'), 'b': ('Radia', '1'), 'c': ('Achtar', None)})
+        self.assertEqual(apps.get_model('core', 'Variety').objects.count(), 2)
+
+
+class AssignParcelProvincesTests(TestCase):
+    def test_smallest_containing_polygon_wins(self):
+        country = make_boundary('MA', 'MOROCCO', (-10.0, 30.0, -2.0, 36.0))
+        north = make_boundary('1', 'NORTH', (-6.0, 34.0, -5.0, 35.0))
+        ParcelPoint.objects.bulk_create([
+            ParcelPoint(parcel_id='in-north', province='?', year=2020, x=-5.5, y=34.5),
+            ParcelPoint(parcel_id='in-country', province='?', year=2020, x=-8.0, y=31.0),
+            ParcelPoint(parcel_id='outside', province='AS GIVEN', year=2020, x=10.0, y=50.0),
+        ])
+
+        self.assertEqual(assign_parcel_provinces(), (2, 1))
+        located = {
+            parcel_id: (province, boundary_id)
+            for parcel_id, province, boundary_id in ParcelPoint.objects.values_list('parcel_id', 'province', 'boundary_id')
+        }
+        self.assertEqual(located['in-north'], ('NORTH', north.id))
+        self.assertEqual(located['in-country'], ('MOROCCO', country.id))
+        self.assertEqual(located['outside'], ('AS GIVEN', None))
+
+
+class LoadParcelDataTests(TempDirMixin, TestCase):
+    def setUp(self):
+        self.north = make_boundary('1', 'NORTH', (-6.0, 34.0, -5.0, 35.0))
+        self.path = self.make_temp_dir() / 'parcels.xlsx'
+
+    def load(self, rows, **options):
+        pd.DataFrame(rows, columns=['ID', 'X', 'Y', 'Variety', 'Year', 'Area', 'yield (t/ha)']).to_excel(self.path, index=False)
+        output = StringIO()
+        call_command('load_parcel_data', file=str(self.path), skip_payloads=True, stdout=output, **options)
+        return output.getvalue()
+
+    def test_vectorized_load_rejects_bad_rows(self):
+        output = self.load([
+            ('p1', -5.5, 34.5, 'Achtar', 2020, 2.0, 3.5),
+            ('p2', 34.6, -5.4, 'Radia', 2021, 1.0, 'n/a'),  # X/Y swapped, unparseable yield
+            ('p3', None, 34.5, 'Achtar', 2020, 1.0, 1.0),
+            ('p4', 5.0, 50.0, 'Achtar', 2020, 1.0, 1.0),
+            ('p5', -5.5, 34.5, 'Achtar', None, 1.0, 1.0),
+            ('p1', -5.6, 34.6, 'Achtar', 2020, 1.0, 1.0),
+        ])
+        parcels = {parcel.parcel_id: parcel for parcel in ParcelPoint.objects.select_related('variety')}
+        self.assertEqual(sorted(parcels), ['p1', 'p2'])
+        self.assertEqual((parcels['p2'].x, parcels['p2'].y), (-5.4, 34.6))
+        self.assertIsNone(parcels['p2'].yield_per_ha)
+        self.assertEqual(parcels['p1'].variety.name, 'Achtar')
+        self.assertEqual((parcels['p1'].province, parcels['p1'].boundary_id), ('NORTH', self.north.id))
+        for reason in ('missing coordinates', 'outside Morocco', 'missing year', 'duplicate parcel_id'):
+            self.assertIn(f'{reason}: 1 rows', output)
+
+    def test_projected_coordinates(self):
+        # Lambert Nord Maroc (EPSG:26191) coordinates of about -5.5, 34.5
+        self.load([('p1', 450000.0, 390000.0, 'Achtar', 2020, 1.0, 2.0)])
+        parcel = ParcelPoint.objects.get()
+        self.assertTrue(-7 < parcel.x < -4 and 33 < parcel.y < 36)
+
+
+class VarietyShapefilesTestCase(TempDirMixin, TestCase):
+    """Two variety shapefiles loaded for 2020 and 2021"""
+
+    def setUp(self):
+        self.north = make_boundary('1', 'NORTH', (-6.0, 34.0, -5.0, 35.0))
+        self.dir = self.make_temp_dir()
+        write_shapefile(self.dir / 'Achtar.shp', [box(-5.6, 34.4, -5.4, 34.6), box(-5.2, 34.2, -5.1, 34.3)])
+        write_shapefile(self.dir / 'Radia.shp', [box(-7.6, 31.4, -7.4, 31.6), box(20.0, 40.0, 21.0, 41.0)])
+
+    def load(self, **options):
+        output = StringIO()
+        call_command('load_variety_shapefiles', dir=str(self.dir), files=['Achtar.shp', 'Radia.shp'],
+                     years=[2020, 2021], skip_payloads=True, stdout=output, **options)
+        return output.getvalue()
+
+
+class LoadVarietyShapefilesTests(VarietyShapefilesTestCase):
+    def test_one_parcel_per_feature_and_year(self):
+        self.load()
+        parcels = ParcelPoint.objects.order_by('parcel_id').values_list('parcel_id', 'variety__name', 'province', 'year')
+        self.assertEqual(list(parcels), [
+            ('Achtar_0_2020', 'Achtar', 'NORTH', 2020),
+            ('Achtar_0_2021', 'Achtar', 'NORTH', 2021),
+            ('Achtar_1_2020', 'Achtar', 'NORTH', 2020),
+            ('Achtar_1_2021', 'Achtar', 'NORTH', 2021),
+            # The second Radia feature is outside Morocco
+            ('Radia_0_2020', 'Radia', 'Unknown', 2020),
+            ('Radia_0_2021', 'Radia', 'Unknown', 2021),
+        ])
+        achtar = ParcelPoint.objects.get(parcel_id='Achtar_0_2020')
+        self.assertAlmostEqual(achtar.x, -5.5)
+        self.assertAlmostEqual(achtar.y, 34.5)
+
+
+class IncrementalVarietyLoadTests(VarietyShapefilesTestCase):
+    def manifest(self):
+        return SourceManifest.objects.get(source=f'load_variety_shapefiles:{self.dir}').checksum
+
+    def test_unchanged_files_are_skipped(self):
+        self.load()
+        version = DatasetVersion.current('parcels')
+        self.assertIn('unchanged since last load', self.load())
+        self.assertEqual(DatasetVersion.current('parcels'), version)
+
+    def test_only_changed_rows_are_written(self):
+        self.load()
+        write_shapefile(self.dir / 'Radia.shp', [box(-7.7, 31.4, -7.5, 31.6)])
+        output = self.load()
+        self.assertIn('0 created, 2 updated, 0 deleted, 4 unchanged', output)
+
+    def test_removed_features_are_deleted(self):
+        self.load()
+        write_shapefile(self.dir / 'Achtar.shp', [box(-5.6, 34.4, -5.4, 34.6)])
+        self.load()
+        self.assertFalse(ParcelPoint.objects.filter(parcel_id__startswith='Achtar_1_').exists())
+        self.assertEqual(ParcelPoint.objects.count(), 4)
+
+    def test_unreadable_file_keeps_parcels_and_manifest(self):
+        self.load()
+        checksum = self.manifest()
+        (self.dir / 'Achtar.shp').write_bytes(b'not a shapefile')
+        output = self.load()
+        self.assertIn('Nothing loaded', output)
+        self.assertEqual(ParcelPoint.objects.filter(variety__name='Achtar').count(), 4)
+        self.assertEqual(self.manifest(), checksum)
+
+    def test_missing_file_keeps_parcels(self):
+        self.load()
+        for part in self.dir.glob('Radia.*'):
+            part.unlink()
+        self.load()
+        self.assertEqual(ParcelPoint.objects.filter(variety__name='Radia').count(), 2)
+
+
+class LoadShapefilesTests(TempDirMixin, TestCase):
+    def setUp(self):
+        self.path = self.make_temp_dir() / 'provinces.shp'
+        self.geometries = [box(-6.0, 34.0, -5.0, 35.0), box(-8.0, 31.0, -7.0, 32.0)]
+
+    def load(self, names, **options):
+        write_shapefile(self.path, self.geometries, NOM_PROV=names, CODE_PROVI=['1', '2'])
+        output = StringIO()
+        call_command('load_shapefiles', shapefile=str(self.path), skip_payloads=True, stdout=output, **options)
+        return output.getvalue()
+
+    def test_renamed_boundary_is_updated(self):
+        self.load(['NORTH', 'SOUTH'])
+        version = DatasetVersion.current('boundaries')
+        output = self.load(['NORTH', 'SOUTH WEST'])
+        self.assertIn('Unchanged: NORTH (1)', output)
+        self.assertIn('Updated: SOUTH WEST (2)', output)
+        self.assertEqual(AdministrativeBoundary.objects.get(code='2').name, 'SOUTH WEST')
+        self.assertEqual(DatasetVersion.current('boundaries'), version + 1)
+
+    def test_geometry_error_writes_nothing(self):
+        self.load(['NORTH', 'SOUTH'])
+        self.geometries[0] = box(-6.5, 34.0, -5.0, 35.0)
+        with mock.patch('core.management.commands.load_shapefiles.simplify_levels', side_effect=ValueError('bad')):
+            output = self.load(['NORTH', 'SOUTH'])
+        self.assertIn('Nothing loaded', output)
+        self.assertEqual(AdministrativeBoundary.objects.get(code='1').min_x, -6.0)
+        # The next run retries instead of skipping the file
+        self.assertIn('Updated: NORTH (1)', self.load(['NORTH', 'SOUTH']))
+        self.assertEqual(AdministrativeBoundary.objects.get(code='1').min_x, -6.5)
+
+
+class SyncRowsTests(TestCase):
+    def test_creates_updates_and_deletes(self):
+        crop = Crop.objects.create(name='wheat')
+        boundaries = [make_boundary(str(code), f'B{code}', (code, 30, code + 1, 31)) for code in range(-9, -6)]
+        YieldData.objects.bulk_create([
+            YieldData(boundary=boundary, crop=crop, year=2020, actual_yield=1.0, data_source='test')
+            for boundary in boundaries[:2]
+        ])
+        objects = [
+            YieldData(boundary=boundaries[0], crop=crop, year=2020, actual_yield=1.0, data_source='test'),
+            YieldData(boundary=boundaries[2], crop=crop, year=2020, actual_yield=3.0, data_source='test'),
+        ]
+        objects[0].actual_yield = 1.5
+        result = sync_rows(YieldData.objects.all(), ['boundary_id', 'crop_id', 'year'], objects, ['actual_yield'])
+        self.assertEqual((result.created, result.updated, result.deleted, result.unchanged), (1, 1, 1, 0))
+        self.assertEqual(
+            dict(YieldData.objects.values_list('boundary__code', 'actual_yield')),
+            {'-9': 1.5, '-7': 3.0},
+        )
+
+        result = sync_rows(YieldData.objects.all(), ['boundary_id', 'crop_id', 'year'], objects[:1], ['actual_yield'],
+                           delete_missing=False)
+        self.assertEqual((result.created, result.updated, result.deleted, result.unchanged), (0, 0, 0, 1))
+        self.assertEqual(YieldData.objects.count(), 2)
+
+
+class DecomposeGapsTests(TestCase):
+    def test_gaps_taken_before_rounding(self):
+        gaps = decompose_gaps({'potential_yield': [2.346, 0.0, 3.0], 'actual_yield': [1.004, 1.0, None]})
+        # 2.346 - 1.004 = 1.342, not 2.35 - 1.00
+        self.assertEqual(gaps['yield_gap'].tolist()[0], 1.34)
+        # Levels are kept unrounded so the stored levels reproduce the gaps
+        self.assertEqual(gaps['potential_yield'].tolist()[0], 2.346)
+        self.assertEqual(gaps['yield_gap_percent'].tolist()[0], round(1.342 / 2.346 * 100, 2))
+        self.assertEqual(gaps['yield_gap_percent'].tolist()[1], 0.0)
+        self.assertIsNone(as_records(gaps)[2]['yield_gap'])
+
+
+class RecomputeGapsTests(TestCase):
+    def setUp(self):
+        crop = Crop.objects.create(name='wheat')
+        boundary = make_boundary('1', 'NORTH', (-6.0, 34.0, -5.0, 35.0))
+        values = as_records(decompose_gaps({'potential_yield': [2.346, 0.01], 'actual_yield': [1.004, 0.004]}))
+        self.loaded = YieldData.objects.create(boundary=boundary, crop=crop, year=2020, data_source='test', **values[0])
+        self.low = YieldData.objects.create(boundary=boundary, crop=crop, year=2021, data_source='test', **values[1])
+        self.stale = YieldData.objects.create(boundary=boundary, crop=crop, year=2022, data_source='test',
+                                              potential_yield=5.0, actual_yield=2.0, yield_gap=1.0)
+
+    def recompute(self, **options):
+        output = StringIO()
+        call_command('recompute_gaps', skip_payloads=True, stdout=output, **options)
+        return output.getvalue()
+
+    def test_only_differing_rows_are_written(self):
+        version = DatasetVersion.current('yield')
+        # A small change to a row with a tiny potential yield is not ignored
+        YieldData.objects.filter(pk=self.low.pk).update(yield_gap_percent=59.0)
+        output = self.recompute()
+        self.assertIn('2 changed, 2 written, 1 skipped as unchanged', output)
+        self.assertEqual(YieldData.objects.get(pk=self.loaded.pk).yield_gap, 1.34)
+        self.assertEqual(YieldData.objects.get(pk=self.low.pk).yield_gap_percent, 60.0)
+        self.stale.refresh_from_db()
+        self.assertEqual((self.stale.yield_gap, self.stale.yield_gap_percent), (3.0, 60.0))
+        self.assertGreater(DatasetVersion.current('yield'), version)
+        self.assertIn('0 changed, 0 written, 3 skipped', self.recompute())
+
+    def test_force_rewrites_every_row(self):
+        self.recompute()
+        version = DatasetVersion.current('yield')
+        self.assertIn('0 changed, 3 written, 0 skipped', self.recompute(force=True))
+        self.assertEqual(DatasetVersion.current('yield'), version)
+
+    def test_levels_rounded_when_served(self):
+        cache.clear()
+        response = self.client.get('/api/yield-data/', {'geometry': '0', 'year': '2020', 'metric': 'potential_yield'})
+        [row] = response.json()
+        self.assertEqual((row['potential_yield'], row['metric_value'], row['yield_gap']), (2.35, 2.35, 1.34))
+        series = self.client.get('/api/timeseries/', {'boundary': '1'}).json()['series'][0]
+        self.assertEqual(series['values']['actual_yield'], [1.0, 0.0, 2.0])
+
+
+class CsvExportTests(ParcelDataTestCase):
+    def read_csv(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return pd.read_csv(StringIO(b''.join(response.streaming_content).decode()))
+
+    def test_yield_export_has_levels_and_gaps(self):
+        response = self.client.get('/api/export-csv/', {'year': '2020'})
+        self.assertIn('yield_data.csv', response['Content-Disposition'])
+        frame = self.read_csv(response)
+        self.assertEqual(frame['Region'].tolist(), ['NORTH', 'SOUTH'])
+        self.assertEqual(frame['Yield Gap (t/ha)'].tolist(), [4.0, 4.0])
+        self.assertIn('Fertilizer Response Gap (t/ha)', frame.columns)
+
+    def test_parcel_export_filters(self):
+        frame = self.read_csv(self.client.get('/api/export-csv/parcels/', {'province': 'NORTH', 'year': '2020'}))
+        self.assertEqual(sorted(frame['Parcel ID']), ['n1', 'n2', 'n3', 'n4'])
+        self.assertEqual(set(frame['Variety']), {'Achtar', 'Radia'})
+
+    def test_bad_requests(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get('/api/export-csv/unknown/').status_code, 404)
+        self.assertBadRequest('/api/export-csv/parcels/', {'year': 'recent'})
+
+
+@skipUnless(columnar.ARROW_AVAILABLE, 'pyarrow is not installed')
+class ColumnarExportTests(ParcelDataTestCase):
+    def test_parquet_keeps_types(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        response = self.client.get('/api/export/parcels/', {'format': 'parquet', 'year': '2020'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('parcel_points.parquet', response['Content-Disposition'])
+        table = pq.read_table(pa.BufferReader(b''.join(response.streaming_content)))
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.schema.field('year').type, pa.int32())
+        self.assertEqual(table.schema.field('yield_per_ha').type, pa.float64())
+        self.assertEqual(table.schema.field('parcel_id').type, pa.string())
+        self.assertTrue(pa.types.is_dictionary(table.schema.field('variety').type))
+
+    def test_arrow_stream(self):
+        import pyarrow as pa
+        response = self.client.get('/api/export/yield/', {'format': 'arrow', 'crop': 'wheat'})
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        table = pa.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(sorted(table.column('boundary').to_pylist()), ['NORTH'] * 3 + ['SOUTH'] * 2)
+
+    def test_empty_export_has_schema(self):
+        import pyarrow as pa
+        response = self.client.get('/api/export/parcels/', {'format': 'arrow', 'year': '1990'})
+        table = pa.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        self.assertEqual(table.num_rows, 0)
+        self.assertIn('yield_per_ha', table.column_names)
+
+    def test_unknown_format(self):
+        self.assertBadRequest('/api/export/parcels/', {'format': 'xlsx'})
+
+    def test_without_pyarrow(self):
+        with mock.patch.object(columnar, 'ARROW_AVAILABLE', False):
+            response = self.client.get('/api/export/parcels/', {'format': 'parquet'})
+        self.assertEqual(response.status_code, 501)
+
+
+class ResponseCacheTests(MapDataTestCase):
+    def get_gaps(self):
+        response = self.client.get('/api/yield-data/', {'metric': 'yield_gap', 'geometry': '0', 'year': '2020'})
+        return sorted(row['metric_value'] for row in response.json())
+
+    def test_cached_until_version_bump(self):
+        self.assertEqual(self.get_gaps(), [4.0, 4.0])
+        YieldData.objects.filter(boundary=self.south, year=2020).update(yield_gap=3.5)
+        self.assertEqual(self.get_gaps(), [4.0, 4.0])
+        DatasetVersion.bump('yield')
+        self.assertEqual(self.get_gaps(), [3.5, 4.0])
+
+    def test_key_ignores_parameter_order_and_empty_values(self):
+        factory = RequestFactory()
+        key = cache_key(factory.get('/api/years/', {'crop': 'wheat', 'metric': 'yield_gap'}), ('yield',))
+        self.assertEqual(cache_key(factory.get('/api/years/?metric=yield_gap&year=&crop=wheat'), ('yield',)), key)
+        self.assertNotEqual(cache_key(factory.get('/api/years/', {'crop': 'barley'}), ('yield',)), key)
+        self.assertTrue(key.endswith(':yield1'))
+
+
+class ConditionalGetTests(MapDataTestCase):
+    def test_etag_answers_304_until_version_bump(self):
+        response = self.client.get('/api/crops/')
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(self.client.get('/api/crops/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/crops/', {'q': '1'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        DatasetVersion.bump('yield')
+        response = self.client.get('/api/crops/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        response = self.client.get('/api/years/')
+        response = self.client.get('/api/years/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_uncached_view(self):
+        etag = self.client.get('/api/export-csv/')['ETag']
+        self.assertEqual(self.client.get('/api/export-csv/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class PrecompressedPayloadTests(MapDataTestCase):
+    params = {'metric': 'yield_gap', 'geometry': '0', 'year': '2020'}
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(build_payloads())
+
+    def test_gzip_payload_keeps_view_headers(self):
+        response = self.client.get('/api/yield-data/', self.params, HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(response['X-Boundaries-Version'], '1')
+        rows = json.loads(gzip.decompress(response.content))
+        self.assertEqual(sorted(row['metric_value'] for row in rows), [4.0, 4.0])
+
+    def test_identity_payload(self):
+        response = self.client.get('/api/yield-data/', self.params, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response['ETag'].startswith('W/'))
+        self.assertEqual(response['X-Boundaries-Version'], '1')
+        self.assertEqual(len(response.json()), 2)
+
+    def test_build_skipped_while_current(self):
+        self.assertIsNone(build_payloads())
+        DatasetVersion.bump('yield')
+        self.assertTrue(build_payloads())
+
+
+class ParcelClusterTests(ParcelDataTestCase):
+    def setUp(self):
+        super().setUp()
+        build_parcel_clusters()
+
+    def clusters(self, **params):
+        response = self.client.get('/api/parcel-points/clusters/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_one_cluster_at_country_zoom(self):
+        data = self.clusters(zoom='0')
+        self.assertTrue(data['clustered'])
+        [cluster] = data['clusters']
+        self.assertEqual(cluster['count'], 6)
+        self.assertEqual(cluster['mean_yield'], round(18.5 / 6, 2))
+        self.assertEqual(cluster['varieties'], {'Achtar': 5, 'Radia': 1})
+        self.assertEqual(sum(c['count'] for c in self.clusters(zoom='0', year='2020')['clusters']), 5)
+
+    def test_viewport_filter(self):
+        clusters = self.clusters(zoom='12', bbox='-6,34,-5,35')['clusters']
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 5)
+
+    def test_points_above_cluster_zoom(self):
+        data = self.clusters(zoom='13', province='SOUTH')
+        self.assertFalse(data['clustered'])
+        self.assertEqual(self.parcel_ids(data['points']), ['s1'])
+
+    def test_rebuilt_only_after_parcels_change(self):
+        self.assertIsNone(build_parcel_clusters())
+        DatasetVersion.bump('parcels')
+        self.assertTrue(build_parcel_clusters())
+
+    def test_zoom_required(self):
+        self.assertBadRequest('/api/parcel-points/clusters/', {})
+        self.assertBadRequest('/api/parcel-points/clusters/', {'zoom': 'near'})
+
+
+class ParcelPaginationTests(ParcelDataTestCase):
+    def test_pages_follow_the_cursor(self):
+        seen = []
+        params = {'limit': '2'}
+        while True:
+            response = self.client.get('/api/parcel-points/', params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['parcel_id'] for row in response.json())
+            if not response.has_header('X-Next-Cursor'):
+                self.assertFalse(response.has_header('Link'))
+                break
+            self.assertIn(f'cursor={response["X-Next-Cursor"]}', response['Link'])
+            self.assertTrue(response['Link'].endswith('>; rel="next"'))
+            params['cursor'] = response['X-Next-Cursor']
+        self.assertEqual(seen, list(ParcelPoint.objects.order_by('pk').values_list('parcel_id', flat=True)))
+
+    def test_filters_and_bbox(self):
+        response = self.client.get('/api/parcel-points/', {'variety': 'Achtar', 'year': '2020', 'bbox': '-6,34,-5,35'})
+        self.assertEqual(self.parcel_ids(response.json()), ['n1', 'n2', 'n3'])
+        self.assertEqual(response.json()[0]['variety'], 'Achtar')
+
+    def test_bad_parameters(self):
+        for params in ({'limit': '0'}, {'limit': 'all'}, {'cursor': 'next'}, {'bbox': '-6,34,-5'}):
+            self.assertBadRequest('/api/parcel-points/', params)
+
+
+def decode_columns(body):
+    """(header, column section offset, {name: array}) of a core.binary body, decoded like the browser does"""
+    (header_length,) = np.frombuffer(body[:4], dtype='<u4')
+    header = json.loads(body[4:4 + header_length])
+    base = 4 + int(header_length)
+    columns = {
+        column['name']: np.frombuffer(body, dtype=np.dtype(column['type']).newbyteorder('<'),
+                                      count=header['count'], offset=base + column['offset'])
+        for column in header['columns']
+    }
+    return header, base, columns
+
+
+class BinaryParcelTests(ParcelDataTestCase):
+    def test_columns_match_json(self):
+        response = self.client.get('/api/parcel-points/', {'format': 'binary', 'limit': '4'})
+        self.assertEqual(response['Content-Type'], binary.CONTENT_TYPE)
+        header, base, columns = decode_columns(response.content)
+        self.assertEqual(header['count'], 4)
+        self.assertEqual(header['next_cursor'], int(response['X-Next-Cursor']))
+        self.assertEqual(base % 8, 0)
+        self.assertTrue(all(column['offset'] % 8 == 0 for column in header['columns']))
+
+        rows = self.client.get('/api/parcel-points/', {'limit': '4'}).json()
+        self.assertEqual(columns['id'].tolist(), [row['id'] for row in rows])
+        self.assertEqual(columns['yield_per_ha'].tolist(), [row['yield_per_ha'] for row in rows])
+        self.assertEqual(columns['year'].tolist(), [row['year'] for row in rows])
+        varieties = [header['dictionaries']['variety'][code] for code in columns['variety']]
+        self.assertEqual(varieties, [row['variety'] for row in rows])
+
+    def test_ids_beyond_int32(self):
+        ids = [1, 2 ** 40 + 3]
+        header, _, columns = decode_columns(binary.encode_columns([
+            ('id', 'int64', ids), ('x', 'float32', [1.5, None]), ('province', 'dictionary', ['A', None]),
+        ]))
+        self.assertEqual(columns['id'].tolist(), ids)
+        self.assertTrue(np.isnan(columns['x'][1]))
+        self.assertEqual(header['dictionaries']['province'], ['A', None])
+
+    def test_empty_page(self):
+        response = self.client.get('/api/parcel-points/', {'format': 'binary', 'year': '1990'})
+        header, _, columns = decode_columns(response.content)
+        self.assertEqual(header['count'], 0)
+        self.assertEqual(len(columns['id']), 0)
+
+
+def create_statistics(values, **dimensions):
+    """YieldStatistics row summarizing values"""
+    values = np.array(values)
+    return YieldStatistics.objects.create(
+        count=len(values), mean=values.mean(), std=values.std(ddof=1), min=values.min(),
+        median=np.median(values), max=values.max(), **dimensions,
+    )
+
+
+class StatisticsCubeTests(TestCase):
+    samples = {'NORTH': [1.0, 2.0, 3.0], 'SOUTH': [4.0, 6.0]}
+
+    def setUp(self):
+        cache.clear()
+        self.variety = Variety.objects.create(name='Achtar')
+        self.potential = Scenario.objects.create(name='Potential')
+        for province, values in self.samples.items():
+            create_statistics(values, variety=self.variety, province=province, year=2020, scenario=self.potential)
+        self.result = build_statistics_cube()
+
+    def test_pooling_matches_the_raw_values(self):
+        values = np.concatenate(list(self.samples.values()))
+        cell = StatisticsCube.objects.get(source='yield', variety='*', province='*', year='2020', category='Potential')
+        self.assertEqual(cell.count, 5)
+        self.assertAlmostEqual(cell.mean, values.mean())
+        self.assertAlmostEqual(cell.std, values.std(ddof=1), places=4)
+        self.assertEqual((cell.min, cell.max), (1.0, 6.0))
+        # Quantiles can't be pooled
+        self.assertIsNone(cell.median)
+        north = StatisticsCube.objects.get(variety='*', province='NORTH', year='2020', category='Potential')
+        self.assertEqual(north.median, 2.0)
+        self.assertEqual(StatisticsCube.objects.get(variety='*', province='SOUTH', year='*').count, 2)
+
+    def test_rows_for_all_values_are_not_pooled_again(self):
+        values = np.concatenate(list(self.samples.values()))
+        # The workbook's own all-province and overall rows next to the per-province block
+        create_statistics(values, variety=self.variety, year=2020, scenario=self.potential)
+        create_statistics(values, scenario=self.potential)
+        create_statistics([9.0, 9.0], province='NORTH', scenario=self.potential)
+        build_statistics_cube()
+
+        cell = StatisticsCube.objects.get(variety='*', province='*', year='2020', category='Potential')
+        self.assertEqual((cell.count, cell.mean, cell.median), (5, values.mean(), np.median(values)))
+        overall = StatisticsCube.objects.get(variety='*', province='*', year='*', category='Potential')
+        self.assertEqual((overall.count, overall.median), (5, np.median(values)))
+        # Taken from the workbook row, not from the per-year rows below it
+        north = StatisticsCube.objects.get(variety='*', province='NORTH', year='*', category='Potential')
+        self.assertEqual((north.count, north.mean), (2, 9.0))
+        south = StatisticsCube.objects.get(variety='*', province='SOUTH', year='*', category='Potential')
+        self.assertEqual((south.count, south.mean), (2, 5.0))
+        self.assertFalse(StatisticsCube.objects.filter(province='').exists())
+
+    def test_rebuilt_only_when_statistics_change(self):
+        self.assertEqual(self.result.created, StatisticsCube.objects.count())
+        version = DatasetVersion.current('statistics')
+        self.assertIsNone(build_statistics_cube())
+        YieldStatistics.objects.filter(province='SOUTH').delete()
+        result = build_statistics_cube()
+        self.assertTrue(result.deleted)
+        self.assertGreater(DatasetVersion.current('statistics'), version)
+
+    def test_summary_endpoint(self):
+        response = self.client.get('/api/yield-statistics/summary/', {'province': 'NORTH', 'variety': self.variety.id})
+        self.assertEqual(response.json()['Potential']['mean'], 2.0)
+        self.assertEqual(self.client.get('/api/yield-statistics/summary/', {'year': '1990'}).json(), {})
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.get('/api/yield-statistics/summary/', {'year': 'last'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AggregateTests(ParcelDataTestCase):
+    def aggregate(self, **params):
+        response = self.client.get('/api/aggregate/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_std_of_single_row_groups_is_null(self):
+        rows = self.aggregate(source='parcels', group_by='province,year', metrics='yield_per_ha', functions='std,count')
+        std = {(row['province'], row['year']): row['yield_per_ha_std'] for row in rows}
+        self.assertAlmostEqual(std.pop(('NORTH', 2020)), statistics.stdev([2.0, 3.0, 4.0, 5.0]))
+        self.assertEqual(std, {('NORTH', 2021): None, ('SOUTH', 2020): None})
+        self.assertEqual([row['yield_per_ha_count'] for row in rows], [4, 1, 1])
+
+    def test_grouped_and_filtered(self):
+        rows = self.aggregate(group_by='year', metrics='yield_gap,actual_yield', functions='avg,max', province='NORTH')
+        self.assertEqual([(row['year'], row['rows']) for row in rows], [(2020, 1), (2021, 1), (9999, 1)])
+        self.assertEqual(rows[1]['yield_gap_max'], 3.5)
+        [total] = self.aggregate(source='parcels', functions='sum', year='2020')
+        self.assertEqual((total['rows'], total['yield_per_ha_sum']), (5, 15.0))
+
+    def test_whitelists(self):
+        for params in ({'source': 'auth_user'}, {'group_by': 'boundary__code'}, {'metrics': 'id'},
+                       {'functions': 'median'}, {'year': 'latest'}):
+            self.assertBadRequest('/api/aggregate/', params)
+
+
+class ClassBreaksTests(MapDataTestCase):
+    def test_jenks_finds_natural_groups(self):
+        values = np.array([9.2, 1.0, 5.0, 1.1, 9.0, 1.2, 5.1])
+        self.assertEqual(classify.jenks_breaks(values, 3), [1.0, 1.2, 5.1, 9.2])
+        # No more classes than distinct values
+        self.assertEqual(classify.jenks_breaks(np.array([2.0, 2.0, 3.0]), 5), [2.0, 2.0, 3.0])
+
+    def test_equal_interval_and_quantile(self):
+        values = np.arange(1.0, 10.0)
+        self.assertEqual(classify.equal_interval_breaks(values, 4), [1.0, 3.0, 5.0, 7.0, 9.0])
+        self.assertEqual(classify.quantile_breaks(values, 2), [1.0, 5.0, 9.0])
+
+    def test_stats_endpoint(self):
+        response = self.client.get('/api/yield-data/stats/', {'metric': 'yield_gap', 'classes': '2'})
+        data = response.json()
+        values = np.array([4.0, 3.5, 3.75, 4.0, 4.0])
+        self.assertEqual((data['count'], data['min'], data['max']), (5, 3.5, 4.0))
+        self.assertEqual(data['mean'], round(values.mean(), 4))
+        self.assertEqual(data['std'], round(values.std(), 4))
+        self.assertEqual(data['breaks']['equal_interval'], [3.5, 3.75, 4.0])
+        self.assertEqual(len(data['breaks']['jenks']), 3)
+
+        data = self.client.get('/api/yield-data/stats/', {'year': '1990'}).json()
+        self.assertEqual((data['count'], data['breaks']['quantile']), (0, []))
+
+    def test_stats_validation(self):
+        for params in ({'metric': 'id'}, {'classes': '1'}, {'classes': '13'}, {'classes': 'many'}):
+            self.assertBadRequest('/api/yield-data/stats/', params)
+
+
+class TimeseriesTests(MapDataTestCase):
+    def test_series_aligned_on_shared_years(self):
+        response = self.client.get('/api/timeseries/', {'boundary': '1,2', 'metrics': 'actual_yield,yield_gap'})
+        data = response.json()
+        self.assertEqual(data['years'], [2020, 2021])
+        north, south = data['series']
+        self.assertEqual(north['boundary_name'], 'NORTH')
+        self.assertEqual(north['values'], {'actual_yield': [2.0, 3.0], 'yield_gap': [4.0, 3.5]})
+        self.assertEqual(north['average'], {'actual_yield': 2.5, 'yield_gap': 3.75})
+        self.assertEqual(south['values']['actual_yield'], [1.0, None])
+
+    def test_crop_filter_and_unknown_boundary(self):
+        data = self.client.get('/api/timeseries/', {'boundary': '9', 'crop': 'wheat'}).json()
+        self.assertEqual((data['years'], data['series']), ([], []))
+
+    def test_validation(self):
+        for params in ({}, {'boundary': '1', 'metrics': 'boundary_id'},
+                       {'boundary': ','.join(str(code) for code in range(101))}):
+            self.assertBadRequest('/api/timeseries/', params)
+
+
+class CompareFarmTests(ParcelDataTestCase):
+    def setUp(self):
+        super().setUp()
+        # The index is cached per parcels version, which every test rolls back
+        benchmark._percentile_index.cache_clear()
+
+    def compare(self, **params):
+        response = self.client.get('/api/compare-farm/', {'year': '2020', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranking_and_modeled_gaps(self):
+        data = self.compare(province='north', variety='ACHTAR', **{'yield': '3'})
+        self.assertEqual(data['ranking'], {'parcels': 3, 'percentile': 50.0, 'min': 2.0, 'median': 3.0, 'max': 4.0})
+        self.assertEqual(data['references']['potential_yield'], {'value': 6.0, 'gap': 3.0, 'gap_percent': 50.0})
+        self.assertEqual(data['references']['water_limited_yield']['gap'], 1.0)
+
+    def test_percentile_rank(self):
+        self.assertEqual(benchmark.percentile_rank([1.0, 2.0, 2.0, 3.0], 2.0), 50.0)
+        self.assertEqual(benchmark.percentile_rank([1.0, 2.0], 5.0), 100.0)
+        self.assertEqual(benchmark.percentile_rank([1.0, 2.0], 0.5), 0.0)
+
+    def test_index_follows_parcels_version(self):
+        self.assertEqual(self.compare(province='SOUTH', variety='Achtar', **{'yield': '2'})['ranking']['parcels'], 1)
+        ParcelPoint.objects.create(parcel_id='s2', province='SOUTH', variety=self.achtar, year=2020,
+                                   yield_per_ha=3.0, x=-7.5, y=31.5)
+        DatasetVersion.bump('parcels')
+        ranking = self.compare(province='SOUTH', variety='Achtar', **{'yield': '2'})['ranking']
+        self.assertEqual((ranking['parcels'], ranking['median']), (2, 2.0))
+
+    def test_no_matching_parcels(self):
+        data = self.compare(province='NORTH', variety='Faiza', crop='barley', **{'yield': '3'})
+        self.assertEqual((data['ranking']['parcels'], data['ranking']['percentile']), (0, None))
+        self.assertEqual(data['references'], {'potential_yield': None, 'water_limited_yield': None})
+
+    def test_validation(self):
+        required = {'province': 'NORTH', 'variety': 'Achtar', 'year': '2020'}
+        for params in ({'variety': 'Achtar', 'year': '2020', 'yield': '3'}, {**required, 'year': 'now', 'yield': '3'},
+                       {**required, 'yield': 'high'}, {**required, 'yield': 'nan'}, {**required, 'yield': '-1'}):
+            self.assertBadRequest('/api/compare-farm/', params)
+
+
+class FacetTests(ParcelDataTestCase):
+    def facets(self, **params):
+        response = self.client.get('/api/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def counts(self, values):
+        return {value['value']: value['count'] for value in values}
+
+    def test_unfiltered_counts(self):
+        facets = self.facets()['facets']
+        self.assertEqual(self.counts(facets['yield-data']['year']), {2020: 2, 2021: 1, 9999: 2})
+        self.assertEqual(self.counts(facets['yield-data']['crop']), {'wheat': 5})
+        self.assertEqual(self.counts(facets['parcels']['variety']), {'Achtar': 5, 'Radia': 1})
+        self.assertEqual(facets['yield-statistics']['scenario'], [])
+
+    def test_filters_narrow_other_dimensions_only(self):
+        data = self.facets(year='2020', variety='Radia')
+        self.assertEqual(data['filters'], {'variety': 'Radia', 'year': 2020})
+        parcels = data['facets']['parcels']
+        self.assertEqual(self.counts(parcels['province']), {'NORTH': 1})
+        self.assertEqual(self.counts(parcels['year']), {2020: 1})
+        self.assertEqual(self.counts(parcels['variety']), {'Achtar': 4, 'Radia': 1})
+        # yield-data has no variety, so only the year narrows it
+        self.assertEqual(self.counts(data['facets']['yield-data']['province']), {'NORTH': 1, 'SOUTH': 1})
+        self.assertEqual(self.counts(data['facets']['yield-data']['year']), {2020: 2, 2021: 1, 9999: 2})
+
+    def test_year_must_be_an_integer(self):
+        self.assertBadRequest('/api/facets/', {'year': 'all'})
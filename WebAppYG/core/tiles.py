@@ -0,0 +1,181 @@
+"""
+Mapbox Vector Tile (MVT v2) encoding in pure Python.
+
+Boundary polygons are clipped to the Web Mercator tile, projected to
+integer tile coordinates and written with a minimal protobuf encoder,
+so no tile server or native MVT library is needed.
+"""
+import math
+import struct
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, MultiPolygon, GeometryCollection
+
+EXTENT = 4096  # Tile coordinate resolution
+BUFFER = 64  # Extra tile units kept around the edge so strokes don't seam
+
+# MVT geometry commands and feature types
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+POLYGON = 3
+
+
+def tile_bounds(z, x, y):
+    """(min_lon, min_lat, max_lon, max_lat) of a Web Mercator tile"""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def clip_to_tile(geometry, z, x, y):
+    """Clip a lon/lat geometry to the tile (plus buffer) and project to tile units"""
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    pad_x = (max_lon - min_lon) * BUFFER / EXTENT
+    pad_y = (max_lat - min_lat) * BUFFER / EXTENT
+    clipped = shapely.clip_by_rect(geometry, min_lon - pad_x, min_lat - pad_y,
+                                   max_lon + pad_x, max_lat + pad_y)
+    if clipped.is_empty:
+        return None
+
+    n = 2 ** z
+
+    def project(coords):
+        lon = coords[:, 0]
+        lat = np.radians(np.clip(coords[:, 1], -85.0511, 85.0511))
+        px = ((lon + 180) / 360 * n - x) * EXTENT
+        py = ((1 - np.arcsinh(np.tan(lat)) / math.pi) / 2 * n - y) * EXTENT
+        return np.column_stack([px, py])
+
+    return shapely.transform(clipped, project)
+
+
+def _polygons(geometry):
+    if isinstance(geometry, Polygon):
+        return [geometry]
+    if isinstance(geometry, (MultiPolygon, GeometryCollection)):
+        return [part for geom in geometry.geoms for part in _polygons(geom)]
+    return []
+
+
+def _ring(coords, exterior):
+    """Integer ring without the closing point, wound as MVT requires"""
+    points = np.rint(np.asarray(coords)[:-1]).astype(np.int64)
+    if len(points) == 0:
+        return None
+    # Drop consecutive duplicates created by rounding
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    points = points[keep]
+    if len(points) > 1 and np.array_equal(points[0], points[-1]):
+        points = points[:-1]
+    if len(points) < 3:
+        return None
+    # Surveyor's formula in tile coordinates (y down): exterior > 0, interior < 0
+    area = np.sum(points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1])
+    if area == 0:
+        return None
+    if (area > 0) != exterior:
+        points = points[::-1]
+    return points
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def encode_polygon(geometry):
+    """MVT command stream for a (multi)polygon already in tile coordinates"""
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for polygon in _polygons(geometry):
+        exterior = _ring(polygon.exterior.coords, True)
+        if exterior is None:
+            continue
+        rings = [exterior]
+        for interior in polygon.interiors:
+            ring = _ring(interior.coords, False)
+            if ring is not None:
+                rings.append(ring)
+        for ring in rings:
+            # Parameters are zigzag-encoded deltas from the previous point
+            deltas = np.diff(np.vstack([cursor, ring]), axis=0)
+            params = _zigzag(deltas).ravel().tolist()
+            cursor = ring[-1]
+            commands.append(MOVE_TO | (1 << 3))
+            commands.extend(params[:2])
+            commands.append(LINE_TO | ((len(ring) - 1) << 3))
+            commands.extend(params[2:])
+            commands.append(CLOSE_PATH | (1 << 3))
+    return commands
+
+
+# Protobuf wire format
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field, values):
+    return _bytes_field(field, b''.join(_varint(v) for v in values))
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint(_zigzag(value))  # sint_value
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)  # double_value
+    return _bytes_field(1, str(value).encode('utf-8'))  # string_value
+
+
+def encode_layer(name, features):
+    """
+    Encode one layer. features is an iterable of (id, tile geometry, properties);
+    returns b'' when nothing in the layer is visible in the tile.
+    """
+    keys, values = {}, {}
+    encoded = []
+    for feature_id, geometry, properties in features:
+        commands = encode_polygon(geometry)
+        if not commands:
+            continue
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            value_key = (type(value).__name__, value)
+            tags.append(values.setdefault(value_key, len(values)))
+        feature = b''
+        if feature_id is not None:
+            feature += _key(1, 0) + _varint(feature_id)
+        feature += _packed(2, tags) + _key(3, 0) + _varint(POLYGON) + _packed(4, commands)
+        encoded.append(feature)
+
+    if not encoded:
+        return b''
+    layer = _key(15, 0) + _varint(2) + _bytes_field(1, name.encode('utf-8'))
+    layer += b''.join(_bytes_field(2, feature) for feature in encoded)
+    layer += b''.join(_bytes_field(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(_bytes_field(4, _value(value)) for _, value in values)
+    layer += _key(5, 0) + _varint(EXTENT)
+    return _bytes_field(3, layer)
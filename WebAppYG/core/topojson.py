@@ -0,0 +1,226 @@
+"""
+TopoJSON encoding for administrative boundaries.
+
+Borders shared by neighbouring provinces are stored once as arcs and
+referenced by index from every polygon that uses them. Coordinates are
+snapped to an integer grid and delta-encoded. Topologies are built from
+the unsimplified shapefile geometry at load time (see load_shapefiles) and
+the arcs are simplified afterwards, so shared borders stay identical at
+every level of detail.
+"""
+from shapely.geometry import LineString, Polygon, MultiPolygon
+from shapely.geometry.polygon import orient
+
+# Grid (degrees) on which shared vertices are matched and arcs are cut
+TOPOLOGY_PRECISION = 1e-6
+# Output quantization step as a fraction of the simplification tolerance
+QUANTIZATION_FACTOR = 10
+TRANSLATE = [-180.0, -90.0]  # Shared by all topologies so they can be merged
+OBJECT_NAME = 'boundaries'
+
+
+def quantization_scale(tolerance):
+    return tolerance / QUANTIZATION_FACTOR
+
+
+def _polygons(geometry):
+    if isinstance(geometry, Polygon):
+        return [geometry]
+    if isinstance(geometry, MultiPolygon):
+        return list(geometry.geoms)
+    return []
+
+
+def _quantize_ring(coords):
+    """Integer ring (closed, no consecutive duplicates) or None if it collapses"""
+    ring = []
+    for x, y in coords:
+        point = (round((x - TRANSLATE[0]) / TOPOLOGY_PRECISION),
+                 round((y - TRANSLATE[1]) / TOPOLOGY_PRECISION))
+        if not ring or ring[-1] != point:
+            ring.append(point)
+    if ring[0] != ring[-1]:
+        ring.append(ring[0])
+    return ring if len(ring) >= 4 else None
+
+
+def _find_junctions(rings):
+    """Points where rings meet with different neighbours - arcs are cut there"""
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        count = len(ring) - 1
+        for i in range(count):
+            point = ring[i]
+            pair = (ring[i - 1] if i else ring[count - 1], ring[i + 1])
+            seen = neighbours.setdefault(point, pair)
+            if seen != pair and seen != pair[::-1]:
+                junctions.add(point)
+    return junctions
+
+
+def _split_ring(ring, junctions):
+    """Cut a closed ring into arcs at junctions"""
+    body = ring[:-1]
+    cuts = [i for i, point in enumerate(body) if point in junctions]
+    if not cuts:
+        # Closed arc: start at the smallest point so shared rings dedupe
+        start = body.index(min(body))
+        body = body[start:] + body[:start]
+        return [body + [body[0]]]
+    start = cuts[0]
+    rotated = body[start:] + body[:start] + [body[start]]
+    cuts = [i - start if i >= start else i - start + len(body) for i in cuts] + [len(body)]
+    return [rotated[a:b + 1] for a, b in zip(cuts, cuts[1:])]
+
+
+def _simplify_arc(arc, tolerance):
+    if len(arc) <= 2:
+        return arc
+    simplified = [tuple(map(int, point)) for point in LineString(arc).simplify(tolerance).coords]
+    if arc[0] == arc[-1] and len(simplified) < 4:
+        return arc  # Keep small closed rings instead of collapsing them
+    return simplified
+
+
+def _encode_arc(arc, ratio):
+    """Snap an arc to the output grid and delta-encode it"""
+    points = []
+    for x, y in arc:
+        point = (round(x / ratio), round(y / ratio))
+        if not points or points[-1] != point:
+            points.append(point)
+    if len(points) == 1:
+        points.append(points[0])
+    encoded = [list(points[0])]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        encoded.append([x1 - x0, y1 - y0])
+    return encoded
+
+
+def build_topology(features, tolerance):
+    """
+    Build a TopoJSON Topology from (id, shapely geometry) pairs.
+
+    Arcs are cut and shared on a TOPOLOGY_PRECISION grid, simplified to the
+    tolerance, then quantized to tolerance / QUANTIZATION_FACTOR degrees.
+    """
+    scale = quantization_scale(tolerance)
+    shapes = []
+    rings = []
+    for feature_id, geometry in features:
+        polygons = []
+        for polygon in _polygons(geometry):
+            # Islands and holes smaller than one output grid cell would collapse
+            if polygon.area < scale ** 2:
+                continue
+            polygon = orient(polygon, sign=1.0)  # RFC 7946 winding
+            polygon_rings = [_quantize_ring(polygon.exterior.coords)]
+            if polygon_rings[0] is None:
+                continue
+            for interior in polygon.interiors:
+                ring = _quantize_ring(interior.coords) if Polygon(interior).area >= scale ** 2 else None
+                if ring is not None:
+                    polygon_rings.append(ring)
+            rings.extend(polygon_rings)
+            polygons.append(polygon_rings)
+        if polygons:
+            shapes.append((feature_id, polygons))
+
+    junctions = _find_junctions(rings)
+    arcs = []
+    arc_index = {}
+
+    def index_of(arc):
+        key = tuple(arc)
+        if key in arc_index:
+            return arc_index[key]
+        if key[::-1] in arc_index:
+            return ~arc_index[key[::-1]]
+        arc_index[key] = len(arcs)
+        arcs.append(arc)
+        return arc_index[key]
+
+    geometries = []
+    for feature_id, polygons in shapes:
+        polygon_arcs = [
+            [[index_of(arc) for arc in _split_ring(ring, junctions)] for ring in polygon]
+            for polygon in polygons
+        ]
+        if len(polygon_arcs) == 1:
+            geometries.append({'type': 'Polygon', 'id': feature_id, 'arcs': polygon_arcs[0]})
+        else:
+            geometries.append({'type': 'MultiPolygon', 'id': feature_id, 'arcs': polygon_arcs})
+
+    # Simplify each shared arc once, then quantize and delta-encode it
+    encoded_arcs = [
+        _encode_arc(_simplify_arc(arc, tolerance / TOPOLOGY_PRECISION), scale / TOPOLOGY_PRECISION)
+        for arc in arcs
+    ]
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [scale, scale], 'translate': TRANSLATE},
+        'objects': {OBJECT_NAME: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': encoded_arcs,
+    }
+
+
+def _remap(arcs, mapping):
+    """Apply an old -> new arc index mapping to nested arc index lists"""
+    if isinstance(arcs, int):
+        return mapping[arcs] if arcs >= 0 else ~mapping[~arcs]
+    return [_remap(item, mapping) for item in arcs]
+
+
+def _arc_indexes(arcs):
+    if isinstance(arcs, int):
+        yield arcs if arcs >= 0 else ~arcs
+    else:
+        for item in arcs:
+            yield from _arc_indexes(item)
+
+
+def merge_topologies(topologies, properties):
+    """
+    Merge stored topologies (same tolerance) into one Topology.
+
+    properties maps feature id -> list of property dicts; each dict emits
+    one geometry, so several years of one boundary share the same arcs.
+    Features without properties and unused arcs are dropped; when several
+    topologies contain the same id the last one wins.
+    """
+    shapes = {}
+    source_arcs = []
+    transform = None
+    for topology in topologies:
+        offset = len(source_arcs)
+        source_arcs.extend(topology['arcs'])
+        transform = topology['transform']
+        for geometry in topology['objects'][OBJECT_NAME]['geometries']:
+            arcs = _remap(geometry['arcs'], {i: i + offset for i in _arc_indexes(geometry['arcs'])})
+            shapes[geometry['id']] = (geometry['type'], arcs)
+
+    used = {}
+    geometries = []
+    for feature_id, property_list in properties.items():
+        if feature_id not in shapes:
+            continue
+        geometry_type, arcs = shapes[feature_id]
+        for index in _arc_indexes(arcs):
+            used.setdefault(index, len(used))
+        arcs = _remap(arcs, used)
+        for feature_properties in property_list:
+            geometries.append({'type': geometry_type, 'id': feature_id,
+                               'properties': feature_properties, 'arcs': arcs})
+
+    merged_arcs = [None] * len(used)
+    for old_index, new_index in used.items():
+        merged_arcs[new_index] = source_arcs[old_index]
+
+    return {
+        'type': 'Topology',
+        'transform': transform or {'scale': [1, 1], 'translate': TRANSLATE},
+        'objects': {OBJECT_NAME: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': merged_arcs,
+    }
@@ -7,5 +7,5 @@ urlpatterns = [
     path('api/boundaries/', views.api_boundaries, name='boundaries_api'),
     path('api/crops/', views.api_crops, name='crops_api'),
     path('api/years/', views.api_years, name='years_api'),
-    path('api/export-csv/', views.export_csv, name='export_csv'),
+    path('api/export-csv/', views.export_data, name='export_csv'),
 ]
\ No newline at end of file
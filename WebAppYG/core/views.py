@@ -1,146 +1,786 @@
-from django.shortcuts import render
-from django.http import JsonResponse
+import csv
+import json
+import math
+import os
+import shutil
+import threading
+from functools import lru_cache
+import numpy as np
+from django.conf import settings
+from django.shortcuts import render, redirect
+from django.core.exceptions import BadRequest
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, Http404
 from django.db.models import Q
-from .models import AdministrativeBoundary, Crop, YieldData, ParcelPoint
+from django.utils.text import slugify
+from shapely.geometry import shape
+from .models import (
+    AdministrativeBoundary, BoundaryGeometry, BoundaryTopology, Crop, YieldData, ParcelPoint, ParcelCluster,
+    DatasetVersion, YieldStatistics, GapStatistics
+)
+from .aggregate import aggregate, facets, list_param
+from .benchmark import compare_farm
+from .clusters import MAX_CLUSTER_ZOOM
+from .gaps import LEVEL_FIELDS, round_level
+from .geometry import DEFAULT_TOLERANCE, tolerance_for_zoom, nearest_tolerance, zoom_range
+from .tiles import clip_to_tile, encode_layer
+from . import binary, classify, columnar
+from .cache import cached_view, conditional_view
+from .topojson import merge_topologies
+
+# Numeric YieldData columns exposed by the map API
+YIELD_METRICS = [
+    # Yield levels
+    'actual_yield', 'potential_yield', 'water_limited_yield',
+    'nutrient_limited_yield', 'unfertilized_yield',
+    # Basic gaps
+    'yield_gap', 'yield_gap_percent',
+    # Decomposed gaps
+    'water_gap', 'nutrient_gap', 'management_gap', 'fertilizer_response_gap',
+]
+
+# Pseudo-year of the multi-year average rows
+AVERAGE_YEAR = 9999
+
+# Boundaries accepted by one /api/timeseries/ request
+MAX_TIMESERIES_BOUNDARIES = 100
+
+# One year in seconds - versioned geometry URLs never change content
+GEOMETRY_CACHE_SECONDS = 365 * 24 * 3600
+
+# Compact separators for the large TopoJSON payloads
+COMPACT_JSON = {'separators': (',', ':')}
+
+# Parcel points per page of /api/parcel-points/ (?limit= up to the maximum)
+PARCEL_PAGE_SIZE = 5000
+MAX_PARCEL_PAGE_SIZE = 50000
+
+# Vector tile layers served by /api/tiles/<layer>/<z>/<x>/<y>.pbf
+TILE_LAYERS = ('boundaries', 'yield')
+MAX_TILE_ZOOM = 18
+
+
+def _flag(request, name, default=True):
+    """Read a boolean query parameter such as ?geometry=0"""
+    value = request.GET.get(name)
+    if value is None or value == '':
+        return default
+    return value.lower() not in ('0', 'false', 'no', 'off')
+
+
+def _geometry_tolerance(request):
+    """Resolve ?zoom= or ?tolerance= to a stored level of detail (None = default)"""
+    zoom = request.GET.get('zoom')
+    tolerance = request.GET.get('tolerance')
+    if zoom:
+        try:
+            return tolerance_for_zoom(int(float(zoom)))
+        except (ValueError, OverflowError):
+            raise BadRequest('zoom must be a number')
+    if tolerance:
+        try:
+            value = float(tolerance)
+        except ValueError:
+            value = math.nan
+        if not math.isfinite(value):
+            raise BadRequest('tolerance must be a number')
+        return nearest_tolerance(value)
+    return None
+
+
+def _bbox(request):
+    """Parse ?bbox=min_x,min_y,max_x,max_y (lon/lat degrees), or None"""
+    value = request.GET.get('bbox')
+    if not value:
+        return None
+    try:
+        min_x, min_y, max_x, max_y = (float(part) for part in value.split(','))
+    except ValueError:
+        raise BadRequest('bbox must be min_x,min_y,max_x,max_y')
+    return min_x, min_y, max_x, max_y
+
+
+def _bbox_filter(bbox, prefix=''):
+    """Q for boundaries whose stored bounding box intersects bbox"""
+    min_x, min_y, max_x, max_y = bbox
+    return Q(**{
+        f'{prefix}min_x__lte': max_x, f'{prefix}max_x__gte': min_x,
+        f'{prefix}min_y__lte': max_y, f'{prefix}max_y__gte': min_y,
+    })
+
+
+def _geometry_by_boundary(tolerance):
+    """Boundary id -> GeoJSON text at a level of detail, or None for geometry_json"""
+    if tolerance is None or tolerance == DEFAULT_TOLERANCE:
+        return None
+    return dict(BoundaryGeometry.objects.filter(
+        tolerance=tolerance
+    ).values_list('boundary_id', 'geometry_json'))
+
+
+def _topology(tolerance, properties):
+    """
+    Merge the precomputed TopoJSON of every loaded shapefile at a level of
+    detail; properties maps boundary code -> list of property dicts.
+    """
+    stored = BoundaryTopology.objects.filter(
+        tolerance=tolerance or DEFAULT_TOLERANCE
+    ).order_by('updated_at').values_list('topology_json', flat=True)
+    return merge_topologies([json.loads(topology) for topology in stored], properties)
+
+
+def _boundary_properties(bbox=None):
+    """Boundary code -> [{code, name, level}] for TopoJSON output"""
+    queryset = AdministrativeBoundary.objects.all()
+    if bbox:
+        queryset = queryset.filter(_bbox_filter(bbox))
+    return {
+        code: [{'code': code, 'name': name, 'level': level}]
+        for code, name, level in queryset.values_list('code', 'name', 'level')
+    }
 
 def map_view(request):
     return render(request, 'map.html')
 
-def api_yield_data(request):
-    # Get filter parameters
+def _yield_queryset(request):
+    """YieldData filtered by ?crop=, ?year= and ?bbox="""
+    queryset = YieldData.objects.all()
     crop_name = request.GET.get('crop', '')
-    year = request.GET.get('year', '')
+    if crop_name:
+        queryset = queryset.filter(crop__name=crop_name)
+    year = _int_param(request, 'year')
+    if year is not None:
+        queryset = queryset.filter(year=year)
+    bbox = _bbox(request)
+    if bbox:
+        queryset = queryset.filter(_bbox_filter(bbox, prefix='boundary__'))
+    return queryset
+
+@cached_view('boundaries', 'yield')
+def api_yield_data(request):
     metric = request.GET.get('metric', 'actual_yield')
+    # format=topojson returns one shared-arc topology with values as properties
+    output_format = request.GET.get('format', 'json')
+    # geometry=0 returns values only; polygons come from /api/boundary-geometry/
+    include_geometry = _flag(request, 'geometry') and output_format != 'topojson'
+    levels = _geometry_by_boundary(_geometry_tolerance(request)) if include_geometry else None
     
-    # Build query
-    queryset = YieldData.objects.select_related('boundary', 'crop')
+    queryset = _yield_queryset(request)
     
-    if crop_name:
-        queryset = queryset.filter(crop__name=crop_name)
-    if year:
-        queryset = queryset.filter(year=int(year))
+    fields = ['id', 'boundary__name', 'boundary__code', 'crop__name', 'year'] + YIELD_METRICS
+    if include_geometry:
+        fields += ['boundary_id', 'boundary__geometry_json']
     
-    # Get data with geometry
     data = []
-    for yield_data in queryset:
+    for row in queryset.values(*fields):
         item = {
-            'id': yield_data.id,
-            'boundary_name': yield_data.boundary.name,
-            'boundary_code': yield_data.boundary.code,
-            'crop_name': yield_data.crop.name,
-            'year': yield_data.year,
-            # Yield levels
-            'actual_yield': yield_data.actual_yield,
-            'potential_yield': yield_data.potential_yield,
-            'water_limited_yield': yield_data.water_limited_yield,
-            'nutrient_limited_yield': yield_data.nutrient_limited_yield,
-            'unfertilized_yield': yield_data.unfertilized_yield,
-            # Basic gaps
-            'yield_gap': yield_data.yield_gap,
-            'yield_gap_percent': yield_data.yield_gap_percent,
-            # Decomposed gaps
-            'water_gap': yield_data.water_gap,
-            'nutrient_gap': yield_data.nutrient_gap,
-            'management_gap': yield_data.management_gap,
-            'fertilizer_response_gap': yield_data.fertilizer_response_gap,
-            # Geometry
-            'geometry': yield_data.boundary.geometry_json,
-            'metric_value': getattr(yield_data, metric, None)
+            'id': row['id'],
+            'boundary_name': row['boundary__name'],
+            'boundary_code': row['boundary__code'],
+            'crop_name': row['crop__name'],
+            'year': row['year'],
         }
+        for field in YIELD_METRICS:
+            item[field] = round_level(row[field])
+        if include_geometry:
+            item['geometry'] = row['boundary__geometry_json']
+            if levels:
+                # Fall back to the default geometry for boundaries loaded before levels existed
+                item['geometry'] = levels.get(row['boundary_id'], item['geometry'])
+        item['metric_value'] = item.get(metric) if metric in YIELD_METRICS else None
         data.append(item)
     
-    return JsonResponse(data, safe=False)
+    if output_format == 'topojson':
+        properties = {}
+        for item in data:
+            properties.setdefault(item['boundary_code'], []).append(item)
+        response = JsonResponse(_topology(_geometry_tolerance(request), properties), json_dumps_params=COMPACT_JSON)
+    else:
+        response = JsonResponse(data, safe=False)
+    response['X-Boundaries-Version'] = DatasetVersion.current('boundaries')
+    return response
 
+@cached_view('boundaries', 'yield')
+def api_yield_stats(request):
+    """
+    Distribution of ?metric= over the yield rows matching ?crop=, ?year=
+    and ?bbox=: count, min, max, mean, median and std, plus equal-interval,
+    quantile and Jenks natural-breaks boundaries for ?classes= classes.
+    """
+    metric = request.GET.get('metric', 'actual_yield')
+    if metric not in YIELD_METRICS:
+        raise BadRequest(f'metric must be one of {", ".join(YIELD_METRICS)}')
+    classes = _int_param(request, 'classes')
+    if classes is None:
+        classes = classify.DEFAULT_CLASSES
+    if not 2 <= classes <= classify.MAX_CLASSES:
+        raise BadRequest(f'classes must be between 2 and {classify.MAX_CLASSES}')
+
+    values = np.fromiter(
+        _yield_queryset(request).filter(**{f'{metric}__isnull': False}).values_list(metric, flat=True),
+        dtype=float,
+    )
+    return JsonResponse({
+        'metric': metric,
+        'classes': classes,
+        **classify.describe(values),
+        'breaks': classify.breaks(values, classes),
+    })
+
+@cached_view('boundaries')
 def api_boundaries(request):
-    data = list(AdministrativeBoundary.objects.values(
-        'id', 'name', 'code', 'level', 'geometry_json'
-    ))
+    bbox = _bbox(request)
+    if request.GET.get('format') == 'topojson':
+        topology = _topology(_geometry_tolerance(request), _boundary_properties(bbox))
+        return JsonResponse(topology, json_dumps_params=COMPACT_JSON)
+    
+    queryset = AdministrativeBoundary.objects.all()
+    if bbox:
+        queryset = queryset.filter(_bbox_filter(bbox))
+    
+    data = []
+    for row in queryset.values(
+        'id', 'name', 'code', 'level', 'geometry_json',
+        'min_x', 'min_y', 'max_x', 'max_y', 'centroid_x', 'centroid_y', 'area_km2'
+    ):
+        item = {key: row[key] for key in ('id', 'name', 'code', 'level', 'geometry_json')}
+        # Precomputed extent for zoom-to-region without parsing geometry
+        item['bbox'] = [row['min_x'], row['min_y'], row['max_x'], row['max_y']] if row['min_x'] is not None else None
+        item['centroid'] = [row['centroid_x'], row['centroid_y']] if row['centroid_x'] is not None else None
+        item['area_km2'] = row['area_km2']
+        data.append(item)
+    
+    # ?zoom= / ?tolerance= swap in the matching level of detail
+    levels = _geometry_by_boundary(_geometry_tolerance(request))
+    if levels:
+        for item in data:
+            item['geometry_json'] = levels.get(item['id'], item['geometry_json'])
+    
     return JsonResponse(data, safe=False)
 
+@cached_view('boundaries')
+def api_boundary_geometry(request):
+    """
+    Boundary polygons as a GeoJSON FeatureCollection keyed by boundary code.
+    
+    Geometry only changes when load_shapefiles runs, so the response is
+    served under ?v=<boundaries version> with a long-lived immutable
+    Cache-Control. Requests without the current version are redirected.
+    format=topojson returns the precomputed shared-arc topology instead.
+    ?zoom= is resolved to its level of detail and redirected to the
+    canonical ?tolerance= URL so every zoom of a level shares one cache entry.
+    """
+    version = DatasetVersion.current('boundaries')
+    tolerance = _geometry_tolerance(request) or DEFAULT_TOLERANCE
+    if request.GET.get('v') != str(version) or 'zoom' in request.GET:
+        params = request.GET.copy()
+        params.pop('zoom', None)
+        params['tolerance'] = tolerance
+        params['v'] = version
+        response = redirect(f'{request.path}?{params.urlencode()}')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    
+    min_zoom, max_zoom = zoom_range(tolerance)
+    if request.GET.get('format') == 'topojson':
+        topology = _topology(tolerance, _boundary_properties(_bbox(request)))
+        topology.update({'version': version, 'tolerance': tolerance, 'zoom_range': [min_zoom, max_zoom]})
+        response = JsonResponse(topology, json_dumps_params=COMPACT_JSON)
+        response['Cache-Control'] = f'public, max-age={GEOMETRY_CACHE_SECONDS}, immutable'
+        return response
+    
+    # Spliced in as raw text below, so an empty string would break the whole body
+    boundaries = AdministrativeBoundary.objects.exclude(geometry_json__isnull=True).exclude(geometry_json='')
+    bbox = _bbox(request)
+    if bbox:
+        boundaries = boundaries.filter(_bbox_filter(bbox))
+    boundaries = boundaries.values_list('id', 'code', 'name', 'level', 'geometry_json')
+    levels = _geometry_by_boundary(tolerance) or {}
+    
+    # geometry_json is already serialized GeoJSON - splice it in as-is
+    features = []
+    for boundary_id, code, name, level, geometry_json in boundaries:
+        geometry_json = levels.get(boundary_id, geometry_json)
+        properties = json.dumps({'code': code, 'name': name, 'level': level})
+        features.append(
+            f'{{"type":"Feature","id":{json.dumps(code)},"properties":{properties},"geometry":{geometry_json}}}'
+        )
+    body = (
+        f'{{"type":"FeatureCollection","version":{version},"tolerance":{tolerance},'
+        f'"zoom_range":{json.dumps([min_zoom, max_zoom])},"features":[{",".join(features)}]}}'
+    )
+    
+    response = HttpResponse(body, content_type='application/json')
+    response['Cache-Control'] = f'public, max-age={GEOMETRY_CACHE_SECONDS}, immutable'
+    return response
+
+@cached_view('yield')
 def api_crops(request):
     data = list(Crop.objects.values('id', 'name', 'scientific_name'))
     return JsonResponse(data, safe=False)
 
+@cached_view('yield')
 def api_years(request):
     # Return real years + Average (9999)
     years = list(YieldData.objects.values_list('year', flat=True).distinct().order_by('year'))
     
     # Add real years and Average
     if not years:
-        years = [2019, 2020, 2021, 9999]  # 9999 = Average
-    elif 9999 not in years:
-        years.append(9999)
+        years = [2019, 2020, 2021, AVERAGE_YEAR]
+    elif AVERAGE_YEAR not in years:
+        years.append(AVERAGE_YEAR)
     
     return JsonResponse(sorted(years), safe=False)
 
-def export_csv(request):
-    import csv
-    from django.http import HttpResponse
-    
-    # Get filter parameters
-    crop_name = request.GET.get('crop', '')
-    year = request.GET.get('year', '')
+class _Echo:
+    """File-like object whose write() hands the CSV line straight back"""
+    def write(self, value):
+        return value
+
+
+def _int_param(request, name):
+    value = request.GET.get(name, '')
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f'{name} must be an integer')
+
+
+def _export_yield(request):
+    queryset = YieldData.objects.all()
+    if request.GET.get('crop'):
+        queryset = queryset.filter(crop__name=request.GET['crop'])
+    year = _int_param(request, 'year')
+    if year is not None:
+        queryset = queryset.filter(year=year)
+    return queryset.order_by('boundary__name', 'year')
+
+
+def _parcel_queryset(request):
+    """
+    ParcelPoints matching the exact-match filters ?province= (boundary
+    name), ?boundary= (id), ?variety= (name), ?variety_id= and ?year=,
+    all served by the (year, variety, boundary) and (boundary, year) indexes,
+    and inside ?bbox= (served by the (x, y) index).
+    """
+    queryset = ParcelPoint.objects.all()
+    bbox = _bbox(request)
+    if bbox:
+        min_x, min_y, max_x, max_y = bbox
+        queryset = queryset.filter(x__gte=min_x, x__lte=max_x, y__gte=min_y, y__lte=max_y)
+    if request.GET.get('province'):
+        queryset = queryset.filter(boundary__name=request.GET['province'])
+    if request.GET.get('variety'):
+        queryset = queryset.filter(variety__name=request.GET['variety'])
+    for param, field in (('boundary', 'boundary_id'), ('variety_id', 'variety_id'), ('year', 'year')):
+        value = _int_param(request, param)
+        if value is not None:
+            queryset = queryset.filter(**{field: value})
+    return queryset
+
+
+def _export_parcels(request):
+    return _parcel_queryset(request).order_by('pk')
+
+
+def _export_statistics(model, category_field):
+    def build(request):
+        queryset = model.objects.all()
+        for param, lookup in (('variety', 'variety__name'), ('province', 'province'),
+                              (category_field, f'{category_field}__name')):
+            if request.GET.get(param):
+                queryset = queryset.filter(**{lookup: request.GET[param]})
+        year = _int_param(request, 'year')
+        if year is not None:
+            queryset = queryset.filter(year=year)
+        return queryset.order_by('pk')
+    return build
+
+
+_STATISTICS_COLUMNS = [
+    ('Count', 'count'), ('Mean', 'mean'), ('Std', 'std'), ('Min', 'min'), ('Q25', 'q25'),
+    ('Median', 'median'), ('Q75', 'q75'), ('Max', 'max'), ('Data Source', 'data_source'),
+]
+
+# dataset -> (queryset builder, download file name, [(CSV header, values_list field)])
+EXPORTS = {
+    'yield': (_export_yield, 'yield_data.csv', [
+        ('Region', 'boundary__name'), ('Region Code', 'boundary__code'), ('Crop', 'crop__name'), ('Year', 'year'),
+        ('Actual Yield (t/ha)', 'actual_yield'), ('Potential Yield (t/ha)', 'potential_yield'),
+        ('Water-Limited Yield (t/ha)', 'water_limited_yield'),
+        ('Nutrient-Limited Yield (t/ha)', 'nutrient_limited_yield'),
+        ('Unfertilized Yield (t/ha)', 'unfertilized_yield'),
+        ('Yield Gap (t/ha)', 'yield_gap'), ('Yield Gap (%)', 'yield_gap_percent'),
+        ('Water Gap (t/ha)', 'water_gap'), ('Nutrient Gap (t/ha)', 'nutrient_gap'),
+        ('Management Gap (t/ha)', 'management_gap'),
+        ('Fertilizer Response Gap (t/ha)', 'fertilizer_response_gap'),
+        ('Data Source', 'data_source'),
+    ]),
+    'parcels': (_export_parcels, 'parcel_points.csv', [
+        ('Parcel ID', 'parcel_id'), ('Province', 'province'), ('Variety', 'variety__name'), ('Year', 'year'),
+        ('Longitude', 'x'), ('Latitude', 'y'), ('Area', 'area'),
+        ('Yield Total', 'yield_total'), ('Yield (t/ha)', 'yield_per_ha'),
+    ]),
+    'yield-statistics': (_export_statistics(YieldStatistics, 'scenario'), 'yield_statistics.csv', [
+        ('Variety', 'variety__name'), ('Province', 'province'), ('Year', 'year'),
+        ('Scenario', 'scenario__name'),
+    ] + _STATISTICS_COLUMNS),
+    'gap-statistics': (_export_statistics(GapStatistics, 'gap_type'), 'gap_statistics.csv', [
+        ('Gap Type', 'gap_type__name'), ('Variety', 'variety__name'), ('Province', 'province'),
+        ('Year', 'year'),
+    ] + _STATISTICS_COLUMNS),
+}
+
+# Rows fetched per database round trip while streaming an export
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _round_levels(rows, indexes):
+    """Export rows with the yield levels at the given column indexes rounded"""
+    for row in rows:
+        row = list(row)
+        for index in indexes:
+            row[index] = round_level(row[index])
+        yield row
+
+
+@conditional_view('boundaries', 'yield', 'parcels', 'statistics')
+def export_data(request, dataset='yield'):
+    """
+    Export a dataset: /api/export/<dataset>/ (or /api/export-csv/ for
+    yield data) with ?format=csv (default), parquet or arrow. Datasets are
+    yield, parcels, yield-statistics and gap-statistics.
+
+    Rows are read with a chunked iterator. CSV and Arrow IPC are written
+    as they are produced, so memory stays flat whatever the export size;
+    Parquet needs its footer last and is spooled to a temporary file.
+    """
+    if dataset not in EXPORTS:
+        raise Http404(f'Unknown dataset: {dataset}')
+    export_format = request.GET.get('format', 'csv')
+    if export_format != 'csv' and export_format not in columnar.FORMATS:
+        raise BadRequest('format must be csv, parquet or arrow')
+
+    build_queryset, filename, columns = EXPORTS[dataset]
+    queryset = build_queryset(request)
+    lookups = [field for _, field in columns]
+    rows = queryset.values_list(*lookups).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    # Yield levels are stored unrounded
+    rounded = [index for index, lookup in enumerate(lookups) if lookup in LEVEL_FIELDS]
+    if rounded:
+        rows = _round_levels(rows, rounded)
+
+    if export_format != 'csv':
+        if not columnar.ARROW_AVAILABLE:
+            return JsonResponse({'error': f'{export_format} export requires pyarrow'}, status=501)
+        content_type, extension = columnar.FORMATS[export_format]
+        schema = columnar.schema_for(queryset.model, lookups)
+        filename = f'{os.path.splitext(filename)[0]}.{extension}'
+        if export_format == 'parquet':
+            return FileResponse(columnar.write_parquet(rows, schema), as_attachment=True,
+                                filename=filename, content_type=content_type)
+        response = StreamingHttpResponse(columnar.stream_arrow(rows, schema), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    writer = csv.writer(_Echo())
+
+    def stream():
+        yield writer.writerow([header for header, _ in columns])
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+# (response key, lookup) of each parcel point served by the API
+PARCEL_COLUMNS = [
+    ('id', 'id'), ('x', 'x'), ('y', 'y'), ('parcel_id', 'parcel_id'), ('province', 'province'),
+    ('boundary_id', 'boundary_id'), ('variety', 'variety__name'), ('year', 'year'),
+    ('area', 'area'), ('yield_total', 'yield_total'), ('yield_per_ha', 'yield_per_ha'),
+]
+
+
+# (column, binary type, lookup) of ?format=binary parcel points; parcel_id
+# and boundary_id are left out, the map fetches details per clicked parcel
+PARCEL_BINARY_COLUMNS = [
+    ('id', 'int64', 'id'), ('x', 'float32', 'x'), ('y', 'float32', 'y'),
+    ('yield_per_ha', 'float32', 'yield_per_ha'), ('area', 'float32', 'area'),
+    ('yield_total', 'float32', 'yield_total'), ('year', 'int16', 'year'),
+    ('variety', 'dictionary', 'variety__name'), ('province', 'dictionary', 'province'),
+]
+
+
+def _parcel_page(request, queryset, lookups):
+    """
+    Keyset page of queryset by id: at most ?limit= rows with an id above
+    ?cursor=, as value tuples of lookups (which start with 'id'). Returns
+    (rows, cursor of the next page or None). Each page is one index range
+    scan, however deep into the table it is.
+    """
+    limit = _int_param(request, 'limit')
+    if limit is None:
+        limit = PARCEL_PAGE_SIZE
+    elif limit < 1:
+        raise BadRequest('limit must be positive')
+    limit = min(limit, MAX_PARCEL_PAGE_SIZE)
+    cursor = _int_param(request, 'cursor')
+    if cursor is not None:
+        queryset = queryset.filter(pk__gt=cursor)
+    rows = list(queryset.order_by('pk').values_list(*lookups)[:limit + 1])
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1][0]
+    return rows, None
+
+
+def _parcel_dicts(request, queryset):
+    """(page of parcel points as dicts, next cursor or None)"""
+    rows, next_cursor = _parcel_page(request, queryset, [lookup for _, lookup in PARCEL_COLUMNS])
+    keys = [key for key, _ in PARCEL_COLUMNS]
+    return [dict(zip(keys, row)) for row in rows], next_cursor
+
+
+def _parcel_binary(request, queryset):
+    """(page of parcel points in the core.binary layout, next cursor or None)"""
+    rows, next_cursor = _parcel_page(request, queryset, [lookup for _, _, lookup in PARCEL_BINARY_COLUMNS])
+    values = list(zip(*rows)) or [()] * len(PARCEL_BINARY_COLUMNS)
+    columns = [(name, kind, column) for (name, kind, _), column in zip(PARCEL_BINARY_COLUMNS, values)]
+    return binary.encode_columns(columns, next_cursor=next_cursor), next_cursor
+
+
+@cached_view('parcels')
+def api_parcel_points(request):
+    """
+    Parcel points matching the _parcel_queryset filters, one keyset page
+    at a time. The next page's URL is in the Link header (rel="next") and
+    its cursor in X-Next-Cursor; both are absent on the last page.
+    ?format=binary returns the page as typed columns (see core.binary).
+    """
+    queryset = _parcel_queryset(request)
+    if request.GET.get('format') == 'binary':
+        body, next_cursor = _parcel_binary(request, queryset)
+        response = HttpResponse(body, content_type=binary.CONTENT_TYPE)
+    else:
+        points, next_cursor = _parcel_dicts(request, queryset)
+        response = JsonResponse(points, safe=False)
+    if next_cursor is not None:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        response['Link'] = f'<{request.path}?{params.urlencode()}>; rel="next"'
+        response['X-Next-Cursor'] = next_cursor
+    return response
+
+
+@cached_view('parcels')
+def api_parcel_clusters(request):
+    """
+    Parcel points for a map view: ?zoom= (required), optional ?bbox= and
+    ?year=. Up to MAX_CLUSTER_ZOOM the precomputed grid clusters are
+    returned with their count, mean yield and variety breakdown; beyond
+    it, a page of the individual points, which accept the
+    /api/parcel-points/ filters and pagination (next_cursor).
+    """
+    zoom = _int_param(request, 'zoom')
+    if zoom is None:
+        raise BadRequest('zoom is required')
     
-    # Build query
-    queryset = YieldData.objects.select_related('boundary', 'crop')
+    if zoom > MAX_CLUSTER_ZOOM:
+        points, next_cursor = _parcel_dicts(request, _parcel_queryset(request))
+        return JsonResponse({'zoom': zoom, 'clustered': False, 'points': points, 'next_cursor': next_cursor})
     
+    bbox = _bbox(request)
+    year = _int_param(request, 'year')
+    clusters = ParcelCluster.objects.filter(zoom=max(zoom, 0))
+    clusters = clusters.filter(year=year) if year is not None else clusters.filter(year__isnull=True)
+    if bbox:
+        min_x, min_y, max_x, max_y = bbox
+        clusters = clusters.filter(x__gte=min_x, x__lte=max_x, y__gte=min_y, y__lte=max_y)
+    data = [
+        {'x': x, 'y': y, 'count': count,
+         'mean_yield': round(mean_yield, 2) if mean_yield is not None else None,
+         'varieties': json.loads(varieties)}
+        for x, y, count, mean_yield, varieties in clusters.values_list(
+            'x', 'y', 'count', 'mean_yield', 'varieties_json'
+        )
+    ]
+    return JsonResponse({'zoom': zoom, 'clustered': True, 'clusters': data})
+
+
+
+@cached_view('boundaries', 'yield', 'parcels', 'statistics')
+def api_aggregate(request):
+    """
+    Grouped aggregates in one GROUP BY query: ?source= (yield-data,
+    yield-statistics, gap-statistics, parcels), ?group_by= (province,
+    year, crop, variety, scenario, gap_type as the source allows),
+    ?metrics= and ?functions= (count, sum, avg, min, max, std), each a
+    comma-separated list. See core.aggregate for the whitelists.
+    """
+    return JsonResponse(aggregate(request.GET))
+
+@cached_view('boundaries', 'yield', 'parcels', 'statistics')
+def api_facets(request):
+    """
+    Every filter dimension of every source (crops, years, provinces,
+    varieties, scenarios, gap types) with per-value row counts, optionally
+    narrowed by ?crop=, ?year=, ?province=, ?variety=, ?scenario= or
+    ?gap_type=. See core.aggregate.facets.
+    """
+    return JsonResponse(facets(request.GET))
+
+@cached_view('boundaries', 'yield')
+def api_timeseries(request):
+    """
+    Year-indexed series of ?metrics= (default actual_yield) for every
+    boundary in ?boundary= (codes), optionally for one ?crop=, from a
+    single query. Each series' metric arrays line up with the shared
+    'years' list, with null for missing years; the multi-year Average
+    row is reported separately under 'average'.
+    """
+    codes = list_param(request.GET, 'boundary')
+    if not codes:
+        raise BadRequest('boundary is required')
+    if len(codes) > MAX_TIMESERIES_BOUNDARIES:
+        raise BadRequest(f'At most {MAX_TIMESERIES_BOUNDARIES} boundaries per request')
+    metrics = list_param(request.GET, 'metrics', ['actual_yield'])
+    unknown = [metric for metric in metrics if metric not in YIELD_METRICS]
+    if unknown:
+        raise BadRequest(f'metrics must be among {", ".join(YIELD_METRICS)} (got {", ".join(unknown)})')
+
+    queryset = YieldData.objects.filter(boundary__code__in=codes)
+    crop_name = request.GET.get('crop', '')
     if crop_name:
         queryset = queryset.filter(crop__name=crop_name)
-    if year:
-        queryset = queryset.filter(year=int(year))
-    
-    # Create CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="yield_data.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Region', 'Crop', 'Year', 'Actual Yield (t/ha)', 'Potential Yield (t/ha)', 'Yield Gap (t/ha)', 'Yield Gap (%)', 'Data Source'])
-    
-    for yield_data in queryset:
-        writer.writerow([
-            yield_data.boundary.name,
-            yield_data.crop.name,
-            yield_data.year,
-            yield_data.actual_yield,
-            yield_data.potential_yield,
-            yield_data.yield_gap,
-            yield_data.yield_gap_percent,
-            yield_data.data_source
-        ])
-    
-    return response
+    rows = list(queryset.order_by('boundary__code', 'crop__name', 'year').values_list(
+        'boundary__code', 'boundary__name', 'crop__name', 'year', *metrics,
+    ))
 
-def api_parcel_points(request):
-    # Get filter parameters
+    years = sorted({row[3] for row in rows if row[3] != AVERAGE_YEAR})
+    position = {year: index for index, year in enumerate(years)}
+    series = {}
+    for code, name, crop, year, *values in rows:
+        item = series.get((code, crop))
+        if item is None:
+            item = series[(code, crop)] = {
+                'boundary_code': code,
+                'boundary_name': name,
+                'crop': crop,
+                'values': {metric: [None] * len(years) for metric in metrics},
+                'average': None,
+            }
+        if year == AVERAGE_YEAR:
+            item['average'] = {metric: round_level(value) for metric, value in zip(metrics, values)}
+            continue
+        for metric, value in zip(metrics, values):
+            item['values'][metric][position[year]] = round_level(value)
+
+    return JsonResponse({'years': years, 'metrics': metrics, 'series': list(series.values())})
+
+@conditional_view('boundaries', 'yield', 'parcels')
+def api_compare_farm(request):
+    """
+    "Compare My Farm": the percentile of ?yield= (t/ha) among the parcels
+    of ?province=, ?variety= and ?year=, and its gap to the province's
+    modeled potential and water-limited yields (optionally for ?crop=).
+    """
     province = request.GET.get('province', '')
     variety = request.GET.get('variety', '')
-    year = request.GET.get('year', '')
+    year = _int_param(request, 'year')
+    if not province or not variety or year is None:
+        raise BadRequest('province, variety and year are required')
+    try:
+        value = float(request.GET.get('yield', ''))
+    except ValueError:
+        raise BadRequest('yield must be a number')
+    if not math.isfinite(value) or value < 0:
+        raise BadRequest('yield must be a non-negative number')
+    return JsonResponse(compare_farm(province, variety, year, value, crop=request.GET.get('crop') or None))
+
+@lru_cache(maxsize=8)
+def _boundary_shapes(tolerance, version):
+    """Parsed boundary polygons at a level of detail, cached per geometry version"""
+    levels = _geometry_by_boundary(tolerance) or {}
+    shapes = {}
+    for boundary_id, code, name, level, geometry_json in AdministrativeBoundary.objects.values_list(
+        'id', 'code', 'name', 'level', 'geometry_json'
+    ):
+        geometry_json = levels.get(boundary_id, geometry_json)
+        if geometry_json:
+            shapes[boundary_id] = (shape(json.loads(geometry_json)), {'code': code, 'name': name, 'level': level})
+    return shapes
+
+
+def _render_tile(layer, z, x, y, crop_name, year):
+    shapes = _boundary_shapes(tolerance_for_zoom(z), DatasetVersion.current('boundaries'))
     
-    # Build query
-    queryset = ParcelPoint.objects.all()
+    if layer == 'boundaries':
+        rows = [(boundary_id, boundary_id, {}) for boundary_id in shapes]
+    else:
+        queryset = YieldData.objects.all()
+        if crop_name:
+            queryset = queryset.filter(crop__name=crop_name)
+        if year is not None:
+            queryset = queryset.filter(year=year)
+        rows = []
+        for row in queryset.values('id', 'boundary_id', 'crop__name', 'year', *YIELD_METRICS):
+            properties = {'crop_name': row.pop('crop__name')}
+            feature_id = row.pop('id')
+            boundary_id = row.pop('boundary_id')
+            properties['year'] = row.pop('year')
+            properties.update({metric: round_level(value) for metric, value in row.items()})
+            rows.append((feature_id, boundary_id, properties))
     
-    if province:
-        queryset = queryset.filter(province__icontains=province)
-    if variety:
-        queryset = queryset.filter(variety__icontains=variety)
-    if year:
-        queryset = queryset.filter(year=int(year))
+    features = []
+    for feature_id, boundary_id, properties in rows:
+        if boundary_id not in shapes:
+            continue
+        geometry, attributes = shapes[boundary_id]
+        tile_geometry = clip_to_tile(geometry, z, x, y)
+        if tile_geometry is not None:
+            features.append((feature_id, tile_geometry, {**attributes, **properties}))
+    return encode_layer(layer, features)
+
+
+@conditional_view('boundaries', 'yield')
+def api_tiles(request, layer, z, x, y):
+    """
+    Mapbox Vector Tile of boundary polygons.
     
-    # Get data
-    data = []
-    for parcel in queryset:
-        item = {
-            'id': parcel.id,
-            'x': parcel.x,
-            'y': parcel.y,
-            'parcel_id': parcel.parcel_id,
-            'province': parcel.province,
-            'variety': parcel.variety,
-            'year': parcel.year,
-            'area': parcel.area,
-            'yield_total': parcel.yield_total,
-            'yield_per_ha': parcel.yield_per_ha
-        }
-        data.append(item)
+    The 'yield' layer joins YieldData attributes (filtered by ?crop= and
+    ?year=) onto each polygon. Rendered tiles are kept on disk under
+    TILE_CACHE_DIR/<dataset version>/ until the next data load.
+    """
+    if layer not in TILE_LAYERS or not 0 <= z <= MAX_TILE_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise Http404('Unknown tile')
+    
+    crop_name = request.GET.get('crop', '') if layer == 'yield' else ''
+    year = _int_param(request, 'year') if layer == 'yield' else None
+    filters = f"{slugify(crop_name) or 'all'}-{'all' if year is None else year}"
     
-    return JsonResponse(data, safe=False)
\ No newline at end of file
+    version = f"b{DatasetVersion.current('boundaries')}-y{DatasetVersion.current('yield')}"
+    version_dir = settings.TILE_CACHE_DIR / version
+    cache_path = version_dir / layer / filters / str(z) / str(x) / f'{y}.pbf'
+    
+    if cache_path.exists():
+        tile = cache_path.read_bytes()
+    else:
+        tile = _render_tile(layer, z, x, y, crop_name, year)
+        if not version_dir.exists() and settings.TILE_CACHE_DIR.exists():
+            # First tile of a new dataset version - drop tiles of older versions
+            for old_dir in settings.TILE_CACHE_DIR.iterdir():
+                if old_dir.name != version:
+                    shutil.rmtree(old_dir, ignore_errors=True)
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp_path.write_bytes(tile)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # A worker still on the previous version dropped this directory; serve the tile uncached
+            pass
+    
+    response = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
@@ -138,6 +138,33 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# Server-side API response cache (see core/cache.py). Keys include dataset
+# versions, so entries never need explicit invalidation; the timeout only
+# bounds how long data edited outside the loader commands can stay stale.
+# In-process memory by default; set API_CACHE_DIR to share a file cache
+# between gunicorn workers.
+API_CACHE_SECONDS = int(os.environ.get('API_CACHE_SECONDS', 24 * 3600))
+if os.environ.get('API_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['API_CACHE_DIR'],
+            'TIMEOUT': API_CACHE_SECONDS,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'yg-api',
+            'TIMEOUT': API_CACHE_SECONDS,
+            'OPTIONS': {'MAX_ENTRIES': 2000},
+        }
+    }
+
+# Disk cache for /api/tiles/ vector tiles, one subdirectory per dataset version
+TILE_CACHE_DIR = Path(os.environ.get('TILE_CACHE_DIR', BASE_DIR / 'tile_cache'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 